@@ -0,0 +1,126 @@
+import struct
+
+from blockchain.etc import hash256, read_varint, encode_varint, as_stream, BytesReader
+from blockchain.merkle import merkle_root
+from blockchain.transactions import Transaction
+
+_HEADER = struct.Struct('<I32s32sI4s4s')
+
+
+def bits_to_target(bits: bytes) -> int:
+    """
+    Target encoded by the bits field of a block header
+
+    The last byte is an exponent and the first three bytes a little endian coefficient.
+
+    >>> hex(bits_to_target(bytes.fromhex('ffff001d')))
+    '0xffff0000000000000000000000000000000000000000000000000000'
+    """
+    exponent = bits[3]
+    coefficient = bits[0] | bits[1] << 8 | bits[2] << 16
+    return coefficient << 8 * (exponent - 3)
+
+
+class BlockHeader:
+    """
+    Block header structure
+    ----------------------
+    - version (4 bytes)
+    - previous block (32 bytes)
+    - merkle root (32 bytes)
+    - timestamp (4 bytes)
+    - bits (4 bytes)
+    - nonce (4 bytes)
+    """
+    SIZE = _HEADER.size
+
+    def __init__(self, version, prev_block, merkle_root, timestamp, bits, nonce):
+        self.version = version
+        self.prev_block = prev_block
+        self.merkle_root = merkle_root
+        self.timestamp = timestamp
+        self.bits = bits
+        self.nonce = nonce
+
+    def __repr__(self):
+        return 'BlockHeader: {}'.format(self.id())
+
+    @classmethod
+    def parse(cls, s):
+        s = as_stream(s)
+        version, prev_block, root, timestamp, bits, nonce = _HEADER.unpack(s.read(cls.SIZE))
+        return cls(version, prev_block[::-1], root[::-1], timestamp, bits, nonce)
+
+    def serialize(self):
+        return _HEADER.pack(self.version, self.prev_block[::-1], self.merkle_root[::-1],
+                            self.timestamp, self.bits, self.nonce)
+
+    def id(self):
+        """ Human-readable hexadecimal of the block hash """
+        return self.hash().hex()
+
+    def hash(self):
+        """ Binary hash of the serialization """
+        return hash256(self.serialize())[::-1]
+
+    def target(self) -> int:
+        return bits_to_target(self.bits)
+
+    def difficulty(self) -> float:
+        """ Target of the lowest difficulty over the target of the block """
+        return 0xffff * 256 ** (0x1d - 3) / self.target()
+
+    def check_pow(self) -> bool:
+        """ Whether the hash of the header is below the target """
+        proof = int.from_bytes(hash256(self.serialize()), 'little')
+        return proof < self.target()
+
+
+class Block:
+    """
+    Block structure
+    ---------------
+    - header (80 bytes)
+    - number of transactions (varint)
+    - transactions
+    """
+    def __init__(self, header, txs):
+        self.header = header
+        self.txs = txs
+
+    def __repr__(self):
+        return 'Block: {} ({} transactions)'.format(self.header.id(), len(self.txs))
+
+    @classmethod
+    def parse(cls, s, testnet=False):
+        s = as_stream(s)
+        header = BlockHeader.parse(s)
+
+        if isinstance(s, BytesReader):
+            num_txs = s.read_varint()
+        else:
+            num_txs = read_varint(s)
+
+        txs = [Transaction.parse(s, testnet) for _ in range(num_txs)]
+        return cls(header, txs)
+
+    def serialize(self):
+        parts = [self.header.serialize(), encode_varint(len(self.txs))]
+        parts.extend(tx.serialize() for tx in self.txs)
+        return b''.join(parts)
+
+    def id(self):
+        return self.header.id()
+
+    def hash(self):
+        return self.header.hash()
+
+    def check_pow(self) -> bool:
+        return self.header.check_pow()
+
+    def merkle_root(self) -> bytes:
+        """ Merkle root of the transaction hashes, in the byte order of the header field """
+        return merkle_root([tx.hash()[::-1] for tx in self.txs])[::-1]
+
+    def validate_merkle_root(self) -> bool:
+        return self.merkle_root() == self.header.merkle_root
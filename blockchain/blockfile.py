@@ -0,0 +1,193 @@
+"""
+Bitcoin Core block files
+
+``blk*.dat`` files are a sequence of records, each made of:
+
+- network magic (4 bytes)
+- size of the block (4 bytes, little endian)
+- block header (80 bytes)
+- number of transactions (varint)
+- transactions
+
+Files are memory-mapped and walked one block at a time, so reading a file takes constant memory no
+matter its size, and the kernel is told to read ahead of the block being parsed.
+"""
+import mmap
+import os
+import struct
+
+from blockchain.block import Block
+from blockchain.etc import BytesReader, encode_varint
+from blockchain.transactions import Transaction, LazyTransaction
+
+MAINNET_MAGIC = bytes.fromhex('f9beb4d9')
+TESTNET_MAGIC = bytes.fromhex('0b110907')
+HEADER_SIZE = 80
+
+_RECORD_HEADER = struct.Struct('<4sI')
+
+
+def _advise(mm, advice, start=0, length=None):
+    """ Hint the kernel about how the map is accessed, where the platform supports it """
+    advice = getattr(mmap, advice, None)
+
+    if advice is None or not hasattr(mm, 'madvise'):
+        return
+
+    # the start of the range has to be aligned on a page
+    aligned = start - start % mmap.PAGESIZE
+    if length is None:
+        length = len(mm) - aligned
+    else:
+        length = min(length + start - aligned, len(mm) - aligned)
+
+    if length > 0:
+        mm.madvise(advice, aligned, length)
+
+
+def iter_block_records(path, magic=MAINNET_MAGIC):
+    """
+    Iterate over the blocks of a block file
+
+    Parameters
+    ----------
+    path: str
+        Path of the ``blk*.dat`` file
+    magic: bytes
+        Network magic of the records
+
+    Yields
+    ------
+    memoryview
+        Header and transactions of each block. The view is only valid until the next block is
+        requested.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _advise(mm, 'MADV_SEQUENTIAL')
+
+            with memoryview(mm) as view:
+                offset = 0
+                end = len(view)
+
+                while offset + _RECORD_HEADER.size <= end:
+                    record_magic, size = _RECORD_HEADER.unpack_from(view, offset)
+
+                    # files are preallocated, so the end is padded with zeros
+                    if record_magic == b'\x00\x00\x00\x00':
+                        break
+
+                    if record_magic != magic:
+                        raise ValueError(f'bad magic {record_magic.hex()} at offset {offset}')
+
+                    start = offset + _RECORD_HEADER.size
+                    offset = start + size
+
+                    if offset > end:
+                        raise EOFError(f'truncated block at offset {start}')
+
+                    # read the next block while this one is parsed
+                    _advise(mm, 'MADV_WILLNEED', offset, size)
+
+                    record = view[start:offset]
+                    try:
+                        yield record
+                    finally:
+                        record.release()
+
+
+def iter_transactions(path, lazy=False, script_filter=None, testnet=False, magic=MAINNET_MAGIC):
+    """
+    Iterate over the transactions of all the blocks of a block file
+
+    Parameters
+    ----------
+    path: str
+        Path of the ``blk*.dat`` file
+    lazy: bool
+        Yield :obj:`LazyTransaction` objects, which only decode the fields that are accessed,
+        instead of fully parsed :obj:`Transaction` objects
+    script_filter: callable
+        Called with the raw script pubkey of outputs, see
+        :func:`blockchain.script.script_type`. Transactions are skipped before being fully parsed
+        unless one of their outputs passes the filter.
+    testnet: bool
+    magic: bytes
+        Network magic of the records
+
+    Yields
+    ------
+    :obj:`Transaction` or :obj:`LazyTransaction`
+    """
+    records = iter_block_records(path, magic)
+    record = reader = tx = None
+
+    try:
+        for record in records:
+            if lazy:
+                # lazy transactions keep views of the block, which must outlive the file map
+                reader = BytesReader(memoryview(bytes(record)), HEADER_SIZE)
+            else:
+                reader = BytesReader(record, HEADER_SIZE)
+
+            for _ in range(reader.read_varint()):
+                if script_filter is None:
+                    if lazy:
+                        yield LazyTransaction.parse(reader, testnet)
+                    else:
+                        yield Transaction.parse(reader, testnet)
+                    continue
+
+                # locating the outputs is enough to filter, scripts are not decoded
+                tx = LazyTransaction.parse(reader, testnet)
+                if any(script_filter(tx_out.script_pubkey._raw) for tx_out in tx.tx_outs):
+                    yield tx if lazy else Transaction.parse(tx._raw, testnet)
+
+                tx = None
+
+            # done with this block before the next one is read
+            record = reader = None
+
+    finally:
+        # views of the file map have to be gone before it is closed
+        record = reader = tx = None
+        records.close()
+
+
+def iter_blocks(path, testnet=False, magic=MAINNET_MAGIC):
+    """
+    Iterate over the blocks of a block file
+
+    Yields
+    ------
+    :obj:`blockchain.block.Block`
+    """
+    for record in iter_block_records(path, magic):
+        yield Block.parse(record, testnet)
+
+
+def write_block_file(path, blocks, magic=MAINNET_MAGIC):
+    """
+    Write blocks in the format of a block file
+
+    Parameters
+    ----------
+    path: str
+        Path of the file to write
+    blocks: iterable
+        (header, transactions) pairs, with the 80 byte header and the serialized transactions as
+        bytes
+    magic: bytes
+        Network magic of the records
+    """
+    with open(path, 'wb') as f:
+        for header, txs in blocks:
+            if len(header) != HEADER_SIZE:
+                raise ValueError(f'block header must be {HEADER_SIZE} bytes')
+
+            payload = b''.join([header, encode_varint(len(txs))] + list(txs))
+            f.write(_RECORD_HEADER.pack(magic, len(payload)))
+            f.write(payload)
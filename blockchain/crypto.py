@@ -2,12 +2,20 @@
 Cryptographic signing and verification
 """
 
+import hmac
+import os
 from collections import namedtuple
-from hashlib import sha256, pbkdf2_hmac as hmac
+from hashlib import sha256
 
-from blockchain.fields import FieldElement
+from blockchain.fields import FieldElement, batch_inverse_mod
 from blockchain.elliptic import EllipticCurvePoint
-from blockchain.etc import hash160, encode_base58_checksum
+from blockchain.etc import hash160, encode_base58_checksum, LRUCache
+from blockchain.secp256k1 import (P, N, GX, GY, GENERATOR_WNAF_WIDTH, is_on_curve, decompress,
+                                 to_jacobian, from_jacobian, jacobian_add_affine,
+                                 odd_multiples, batch_odd_multiples, wnaf_multiply,
+                                 wnaf_multiply_many, glv_split, glv_terms, jacobian_x_equals,
+                                 batch_from_jacobian, generator_multiply, generator_odd_multiples,
+                                 generator_endomorphism_odd_multiples)
 
 
 """
@@ -20,46 +28,189 @@ An elliptic curve for public key cryptography is defined with the following para
 
 ECparams = namedtuple(typename='ECparams', field_names='a b p gx gy n')
 
-secp256k1_params = ECparams(a=0, b=7, p=2**256 - 2**32 - 977,
-                            gx=0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798,
-                            gy=0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8,
-                            n=0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141)
+secp256k1_params = ECparams(a=0, b=7, p=P, gx=GX, gy=GY, n=N)
 
 
 class S256Field(FieldElement):
+    """
+    Element of the secp256k1 base field
+
+    Arithmetic between two S256Field elements skips the prime checks of :obj:`FieldElement` and
+    builds its (already reduced) result without going through ``__init__``.
+    """
+    __slots__ = ()
+
     def __init__(self, num, prime=None):
-        super().__init__(num, prime=secp256k1_params.p)
+        if num < 0 or num >= P:
+            raise ValueError(f'num={num} is not in field range 0 to {P - 1}')
+
+        self.num = num
+        self.prime = P
 
     def __repr__(self):
         return '{:x}'.format(self.num).zfill(64)
 
+    def __add__(self, other):
+        if other.__class__ is S256Field:
+            return _s256_field((self.num + other.num) % P)
+        return super().__add__(other)
+
+    def __sub__(self, other):
+        if other.__class__ is S256Field:
+            return _s256_field((self.num - other.num) % P)
+        return super().__sub__(other)
+
+    def __mul__(self, other):
+        if other.__class__ is S256Field:
+            return _s256_field(self.num * other.num % P)
+        return super().__mul__(other)
+
+    def __rmul__(self, other):
+        if other.__class__ is int and 0 <= other < P:
+            return _s256_field(other * self.num % P)
+        return super().__rmul__(other)
+
+    def __pow__(self, exponent):
+        return _s256_field(pow(self.num, exponent % (P - 1), P))
+
+    def __truediv__(self, other):
+        if other.__class__ is S256Field and other.num:
+            return _s256_field(self.num * pow(other.num, -1, P) % P)
+        return super().__truediv__(other)
+
+    def __neg__(self):
+        return _s256_field(-self.num % P)
+
     def sqrt(self):
         return self ** ((secp256k1_params.p + 1) // 4)
 
 
+def _s256_field(num):
+    """ S256Field from an integer already known to be in [0, P) """
+    element = object.__new__(S256Field)
+    element.num = num
+    element.prime = P
+    return element
+
+
+_S256_A = S256Field(secp256k1_params.a)
+_S256_B = S256Field(secp256k1_params.b)
+
+
 class S256Point(EllipticCurvePoint):
     """
     Point on the secp256k1 elliptic curve
     """
 
     def __init__(self, x, y, a=None, b=None):
-        a, b = S256Field(secp256k1_params.a), S256Field(secp256k1_params.b)
+        self.a = _S256_A
+        self.b = _S256_B
+        self._wnaf_table = None
 
         if type(x) == int:
-            super().__init__(S256Field(x), S256Field(y), a=a, b=b)
+            x, y = S256Field(x), S256Field(y)
+
+        self.x = x
+        self.y = y
+
+        # In case we initialize with the point at infinity
+        if x is None and y is None:
+            return
+
+        if not is_on_curve(x.num, y.num):
+            raise ValueError(f'({x}, {y}) is not on the curve')
+
+    @classmethod
+    def _from_affine(cls, coordinates):
+        """
+        Point from affine integer coordinates produced by our own arithmetic, which are known to
+        be on the curve, or None for the point at infinity
+        """
+        point = cls.__new__(cls)
+        point.a = _S256_A
+        point.b = _S256_B
+        point._wnaf_table = None
+
+        if coordinates is None:
+            point.x = point.y = None
         else:
-            # In case we initialize with the point at infinity
-            super().__init__(x, y, a, b)
+            point.x = _s256_field(coordinates[0])
+            point.y = _s256_field(coordinates[1])
+
+        return point
+
+    def __add__(self, other):
+        if not isinstance(other, S256Point):
+            return super().__add__(other)
 
-    def __rmul__(self, coefficient):
+        if self.x is None:
+            return other
+
+        if other.x is None:
+            return self
+
+        total = jacobian_add_affine(to_jacobian(self.x.num, self.y.num), other.x.num, other.y.num)
+        return self._from_affine(from_jacobian(total))
+
+    # window width used for variable-base scalar multiplication
+    wnaf_width = 5
+
+    # split variable-base scalar multiplications in two with the secp256k1 endomorphism (GLV)
+    use_glv = True
+
+    # parsed points by SEC serialization, see parse
+    parse_cache = LRUCache(maxsize=4096)
+
+    def odd_multiples(self, width):
+        """
+        Affine coordinates (as integers) of the odd multiples of this point used by
+        :meth:`multiply`, kept on the point once computed
+        """
+        if self._wnaf_table is None or self._wnaf_table[0] != width:
+            self._wnaf_table = (width, odd_multiples(self.x.num, self.y.num, width))
+
+        return self._wnaf_table[1]
+
+    def multiply(self, coefficient, width=None):
+        """
+        Scalar multiplication
+
+        The width-w NAF loop runs in Jacobian coordinates so that the only modular inversions are
+        the one that normalizes the table of odd multiples and the one needed to convert the result
+        back to affine coordinates. With ``use_glv`` the scalar is split into two halves of about
+        128 bits that share their doublings. Multiples of the generator are looked up in a
+        precomputed fixed-base table instead.
+        """
         coeff = coefficient % secp256k1_params.n
-        return super().__rmul__(coeff)
+
+        if self.x is None or coeff == 0:
+            return self._from_affine(None)
+
+        if self.x.num == GX and self.y.num == GY:
+            result = from_jacobian(generator_multiply(coeff))
+        else:
+            if width is None:
+                width = self.wnaf_width
+            table = self.odd_multiples(width)
+
+            if self.use_glv:
+                result = from_jacobian(wnaf_multiply_many(glv_terms(table, coeff, width)))
+            else:
+                result = from_jacobian(wnaf_multiply(table, coeff, width))
+
+        return self._from_affine(result)
 
     @classmethod
     def parse(cls, sec_bin):
         """
         Creates a point from pub key SEC binary
 
+        Recently parsed points are kept in ``parse_cache``, keyed by their SEC bytes, so a key
+        that is seen again skips the decompression and keeps any table of precomputed multiples
+        already built for it. The returned point may therefore be shared and must not be modified.
+        Use ``S256Point.parse_cache.resize()`` to change the number of points kept, and
+        ``S256Point.parse_cache.info()`` for hit and miss counts.
+
         Parameters
         ----------
         sec_bin: bytes
@@ -69,30 +220,27 @@ class S256Point(EllipticCurvePoint):
         -------
         :obj:`S256Point`
         """
+        key = bytes(sec_bin)
+        point = cls.parse_cache.get(key)
+
+        if point is None:
+            point = cls._parse_sec(key)
+            cls.parse_cache.put(key, point)
 
+        return point
+
+    @classmethod
+    def _parse_sec(cls, sec_bin):
         # uncompressed
         if sec_bin[0] == 4:
             x = int.from_bytes(sec_bin[1:33], 'big')
             y = int.from_bytes(sec_bin[33:65], 'big')
-            return S256Point(x=x, y=y)
+            return cls(x=x, y=y)
 
         # compressed
         is_even = sec_bin[0] == 2
-        x = S256Field(int.to_bytes(sec_bin[1:], 'big'))
-        alpha = x**3 + S256Field(secp256k1_params.b)
-        beta = alpha.sqrt()
-
-        if beta.num % 2 == 0:
-            even_beta = beta
-            odd_beta = S256Field(secp256k1_params.p - beta.num)
-        else:
-            even_beta = S256Field(secp256k1_params.p - beta.num)
-            odd_beta = beta
-
-        if is_even:
-            return S256Point(x, even_beta)
-        else:
-            return S256Point(x, odd_beta)
+        x = int.from_bytes(sec_bin[1:], 'big')
+        return cls._from_affine((x, decompress(x, is_even)))
 
     def verify(self, z, sig):
         """
@@ -113,13 +261,38 @@ class S256Point(EllipticCurvePoint):
         bool
             True if the signature for the given public key and signature hash is valid.
         """
-        # use Fermat's little theorem to get the inverse
-        s_inv = pow(sig.s, secp256k1_params.n - 2, secp256k1_params.n)
-        u = z * s_inv * secp256k1_params.n
-        v = sig.r * s_inv % secp256k1_params.n
-        total = u * G_S256 + v * self
+        # the same checks as verify_batch: no point at infinity, an invertible s and r in the field
+        if (self.x is None or not sig.s % secp256k1_params.n
+                or not 0 <= sig.r < secp256k1_params.p):
+            return False
 
-        return total.x.num == sig.r
+        s_inv = pow(sig.s, -1, secp256k1_params.n)
+        return self._verify_with_inverse(z, sig.r, s_inv)
+
+    def _verify_with_inverse(self, z, r, s_inv):
+        """
+        Check that the x coordinate of u * G + v * self is r
+
+        Both multiplications share one chain of doublings (Strauss' method) and the comparison is
+        done in Jacobian coordinates, so no inversion is needed. With ``use_glv`` both scalars are
+        also split in two, which halves the number of doublings.
+        """
+        u = z * s_inv % secp256k1_params.n
+        v = r * s_inv % secp256k1_params.n
+        width = self.wnaf_width
+        table = self.odd_multiples(width)
+
+        if self.use_glv:
+            u1, u2 = glv_split(u)
+            terms = [(generator_odd_multiples(), u1, GENERATOR_WNAF_WIDTH),
+                     (generator_endomorphism_odd_multiples(), u2, GENERATOR_WNAF_WIDTH)]
+            terms += glv_terms(table, v, width)
+        else:
+            terms = [(generator_odd_multiples(), u, GENERATOR_WNAF_WIDTH), (table, v, width)]
+
+        total = wnaf_multiply_many(terms)
+
+        return jacobian_x_equals(total, r)
 
     def sec(self, compressed=True):
         """
@@ -227,6 +400,37 @@ class PrivateKeyS256:
         self.secret = secret
         self.point = secret * G_S256
 
+    @classmethod
+    def from_secrets(cls, secrets):
+        """
+        Create many private keys at once
+
+        The public keys are computed in Jacobian coordinates and all converted back to affine
+        coordinates with a single modular inversion.
+
+        Parameters
+        ----------
+        secrets: iterable
+            Secrets as integers
+
+        Returns
+        -------
+        list
+            :obj:`PrivateKeyS256` objects, in the order of the secrets
+        """
+        secrets = list(secrets)
+        points = batch_from_jacobian([generator_multiply(secret % secp256k1_params.n)
+                                      for secret in secrets])
+        keys = []
+
+        for secret, point in zip(secrets, points):
+            key = cls.__new__(cls)
+            key.secret = secret
+            key.point = S256Point._from_affine(point)
+            keys.append(key)
+
+        return keys
+
     def hex(self):
         return f'{self.secret:x}'.zfill(64)
 
@@ -263,7 +467,7 @@ class PrivateKeyS256:
     def sign(self, z):
         k = self.deterministic_k(z)
         r = (k * G_S256).x.num
-        k_inv = pow(k, secp256k1_params.n - 2, secp256k1_params.n)
+        k_inv = pow(k, -1, secp256k1_params.n)
         s = (z + r * self.secret) * k_inv % secp256k1_params.n
 
         # It turns out that using a lower value for s will get nodes to relay our transactions.
@@ -289,3 +493,122 @@ class PrivateKeyS256:
         secret_bytes = self.secret.to_bytes(32, 'big')
 
         return encode_base58_checksum(prefix + secret_bytes + suffix)
+
+
+def verify_batch(items):
+    """
+    Verify many secp256k1 signatures at once
+
+    Gives the same answers as calling :meth:`S256Point.verify` on every item, but the s^-1 values
+    for all signatures are computed with a single modular inversion (Montgomery's trick), and so
+    are the tables of odd multiples of all public keys that do not have one yet. Each
+    u * G + v * P is then computed with Strauss' method, sharing one chain of doublings between
+    both scalars.
+
+    Parameters
+    ----------
+    items: iterable
+        (point, z, sig) triples of :obj:`S256Point` public key, signature hash and
+        :obj:`Signature`
+
+    Returns
+    -------
+    list
+        One bool per item, True if that signature is valid
+    """
+    n = secp256k1_params.n
+    items = list(items)
+    results = [False] * len(items)
+
+    # s = 0 has no inverse and r outside the field can never match an x coordinate
+    pending = [i for i, (point, _, sig) in enumerate(items)
+               if point.x is not None and sig.s % n and 0 <= sig.r < secp256k1_params.p]
+
+    s_invs = batch_inverse_mod([items[i][2].s for i in pending], n)
+
+    width = S256Point.wnaf_width
+    missing = {id(point): point for point in (items[i][0] for i in pending)
+               if point._wnaf_table is None or point._wnaf_table[0] != width}
+    missing = list(missing.values())
+
+    for point, table in zip(missing, batch_odd_multiples([(point.x.num, point.y.num)
+                                                          for point in missing], width)):
+        point._wnaf_table = (width, table)
+
+    for i, s_inv in zip(pending, s_invs):
+        point, z, sig = items[i]
+        results[i] = point._verify_with_inverse(z, sig.r, s_inv)
+
+    return results
+
+
+class SignatureCache:
+    """
+    Bounded cache of signatures that have already been verified successfully
+
+    Transactions are usually verified once when they enter the mempool and again when they are
+    included in a block. Recording successful verifications lets the second check skip the
+    elliptic curve math. Only valid signatures are recorded, so a miss always falls back to a full
+    verification.
+
+    Entries are salted SHA-256 digests of (z, SEC public key, DER signature). The random salt
+    keeps the layout of the cache unpredictable to anyone crafting transactions. When full, the
+    least recently used entries are evicted.
+
+    Parameters
+    ----------
+    max_bytes: int
+        Approximate memory cap. 0 disables the cache.
+    salt: bytes
+        Salt for the entry digests, random by default
+    """
+    # approximate memory used by one entry: a 32 byte digest plus the mapping overhead
+    ENTRY_SIZE = 176
+
+    def __init__(self, max_bytes=32 * 2**20, salt=None):
+        self.salt = os.urandom(32) if salt is None else salt
+        self._entries = LRUCache(maxsize=max_bytes // self.ENTRY_SIZE)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, z, sec, der):
+        # verification only depends on z modulo n, which also fits the 32 bytes of any z
+        z = z % secp256k1_params.n
+        return sha256(self.salt + z.to_bytes(32, 'big') + bytes(sec) + bytes(der)).digest()
+
+    def contains(self, z, sec, der, erase=False):
+        """
+        Check whether this signature has been verified before
+
+        Parameters
+        ----------
+        erase: bool
+            Remove the entry on a hit, e.g. during block validation when the same signature is
+            not expected again
+        """
+        key = self._key(z, sec, der)
+        found = self._entries.get(key) is not None
+
+        if found and erase:
+            self._entries.pop(key)
+
+        return found
+
+    def add(self, z, sec, der):
+        """ Record a successfully verified signature """
+        self._entries.put(self._key(z, sec, der), True)
+
+    def resize(self, max_bytes):
+        """ Change the memory cap, evicting entries if needed """
+        self._entries.resize(max_bytes // self.ENTRY_SIZE)
+
+    def clear(self):
+        self._entries.clear()
+
+    def info(self):
+        """ Hits, misses, evictions, capacity and size in entries """
+        return self._entries.info()
+
+
+signature_cache = SignatureCache()
@@ -1,4 +1,49 @@
 """ Elliptic curves """
+from blockchain.fields import FieldElement, batch_inverse, use_numpy, np
+
+
+def wnaf(coefficient, width):
+    """
+    Width-w non-adjacent form of a non-negative integer
+
+    Every non-zero digit is odd and smaller than 2^(width - 1) in absolute value, and any two
+    non-zero digits are separated by at least width - 1 zeros.
+
+    Parameters
+    ----------
+    coefficient: int
+        Non-negative integer
+    width: int
+        Window width, at least 2
+
+    Returns
+    -------
+    list
+        Digits, least significant first
+
+    Examples
+    --------
+    >>> wnaf(7, 2)
+    [-1, 0, 0, 1]
+    >>> sum(d * 2**i for i, d in enumerate(wnaf(1234567, 5)))
+    1234567
+    """
+    window = 1 << width
+    half = window >> 1
+    digits = []
+
+    while coefficient:
+        if coefficient & 1:
+            digit = coefficient & (window - 1)
+            if digit >= half:
+                digit -= window
+            coefficient -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        coefficient >>= 1
+
+    return digits
 
 
 class EllipticCurvePoint:
@@ -24,13 +69,27 @@ class EllipticCurvePoint:
     EllipticCurvePoint(-1, 1, 5, 7)
     >>> print(p1 + p2)
     EllipticCurvePoint(infinity)
+
+    **Scalar multiplication**
+
+    >>> prime = 223
+    >>> a, b = FieldElement(0, prime), FieldElement(7, prime)
+    >>> p = EllipticCurvePoint(FieldElement(47, prime), FieldElement(71, prime), a, b)
+    >>> print(21 * p)
+    EllipticCurvePoint(infinity)
+    >>> 5 * p == p.multiply(5, width=2) == p.multiply(5, width=3)
+    True
     """
 
+    # window width used for scalar multiplication
+    wnaf_width = 4
+
     def __init__(self, x, y, a, b):
         self.x = x
         self.y = y
         self.a = a
         self.b = b
+        self._wnaf_table = None
 
         if x is None and y is None:
             return
@@ -93,20 +152,139 @@ class EllipticCurvePoint:
                 y = slope * (self.x - x) - self.y
                 return self.__class__(x, y, self.a, self.b)
 
+    def __neg__(self):
+        if self.x is None:
+            return self
+        return self.__class__(self.x, -self.y, self.a, self.b)
+
     def __rmul__(self, coefficient):
-        coeff = coefficient
-        current = self
+        return self.multiply(coefficient)
+
+    def odd_multiples(self, width):
+        """
+        The points P, 3P, 5P, ..., (2^(width - 1) - 1)P used by :meth:`multiply`
+
+        The table is kept on the point, so repeated multiplications of the same point only build it
+        once.
+        """
+        if self._wnaf_table is None or self._wnaf_table[0] != width:
+            double = self + self
+            table = [self]
+            for _ in range((1 << (width - 2)) - 1):
+                table.append(table[-1] + double)
+            self._wnaf_table = (width, table)
+
+        return self._wnaf_table[1]
+
+    def multiply(self, coefficient, width=None):
+        """
+        Scalar multiplication using the width-w non-adjacent form of the coefficient
+
+        Parameters
+        ----------
+        coefficient: int
+            Scalar
+        width: int
+            Window width, defaults to ``wnaf_width``. Wider windows need fewer additions but a
+            larger table of precomputed odd multiples.
+        """
+        if width is None:
+            width = self.wnaf_width
+
+        if coefficient < 0:
+            return (-self).multiply(-coefficient, width)
+
         result = self.__class__(None, None, self.a, self.b)
 
-        while coeff:
-            if coeff & 1:
-                result += current
-            current += current
-            coeff >>= 1
+        if self.x is None or coefficient == 0:
+            return result
+
+        table = self.odd_multiples(width)
+
+        for digit in reversed(wnaf(coefficient, width)):
+            result += result
+            if digit > 0:
+                result += table[digit >> 1]
+            elif digit < 0:
+                result += -table[-digit >> 1]
 
         return result
 
 
+def batch_on_curve(xs, ys, a, b):
+    """
+    Check many coordinate pairs against the curve y^2 = x^3 + a*x + b
+
+    Gives the same answers as :meth:`EllipticCurvePoint.on_curve`, vectorized with NumPy for
+    small fields.
+
+    Returns
+    -------
+    list
+        One bool per (x, y) pair
+    """
+    if len(xs) != len(ys):
+        raise ValueError(f'Sequences have different lengths: {len(xs)} and {len(ys)}')
+
+    if not isinstance(a, FieldElement):
+        return [y ** 2 == x ** 3 + a * x + b for x, y in zip(xs, ys)]
+
+    prime = a.prime
+    if any(v.prime != prime for v in xs) or any(v.prime != prime for v in ys) or b.prime != prime:
+        raise TypeError('Cannot operate on numbers in different Fields')
+
+    if use_numpy(prime):
+        x = np.array([v.num for v in xs], dtype=np.int64)
+        y = np.array([v.num for v in ys], dtype=np.int64)
+        lhs = y * y % prime
+        rhs = (x * x % prime * x + a.num * x + b.num) % prime
+        return (lhs == rhs).tolist()
+
+    return [(y.num * y.num - x.num ** 3 - a.num * x.num - b.num) % prime == 0
+            for x, y in zip(xs, ys)]
+
+
+def batch_add_points(ps, qs):
+    """
+    Element-wise sum of two sequences of points over a finite field
+
+    Uses the same formulas as :meth:`EllipticCurvePoint.__add__`, but the denominators of all
+    slopes are inverted together with :func:`blockchain.fields.batch_inverse`.
+    """
+    if len(ps) != len(qs):
+        raise ValueError(f'Sequences have different lengths: {len(ps)} and {len(qs)}')
+
+    results = [None] * len(ps)
+    pending = []
+
+    for i, (p, q) in enumerate(zip(ps, qs)):
+        if p.a != q.a or p.b != q.b:
+            raise TypeError(f'Points {p}, {q} are not on the same curve')
+
+        if p.x is None:
+            results[i] = q
+        elif q.x is None:
+            results[i] = p
+        elif p.x != q.x:
+            pending.append((i, q.y - p.y, q.x - p.x))
+        elif p.y != q.y or p.y == 0 * p.x:
+            # additive inverses, or a vertical tangent
+            results[i] = p.__class__(None, None, p.a, p.b)
+        else:
+            pending.append((i, 3 * p.x ** 2 + p.a, 2 * p.y))
+
+    inverses = batch_inverse([denominator for _, _, denominator in pending])
+
+    for (i, numerator, _), inverse in zip(pending, inverses):
+        p, q = ps[i], qs[i]
+        slope = numerator * inverse
+        x = slope ** 2 - p.x - q.x
+        y = slope * (p.x - x) - p.y
+        results[i] = p.__class__(x, y, p.a, p.b)
+
+    return results
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
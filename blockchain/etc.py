@@ -1,5 +1,7 @@
 """ Various utilities """
 import hashlib
+import struct
+from collections import OrderedDict, namedtuple
 from typing.io import BinaryIO
 
 BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
@@ -80,6 +82,94 @@ def int_to_little_endian(n: int, length: int) -> bytes:
     return n.to_bytes(length, 'little')
 
 
+_UINT32 = struct.Struct('<I')
+_UINT64 = struct.Struct('<Q')
+_VARINT_SIZES = {0xfd: 2, 0xfe: 4, 0xff: 8}
+
+
+class BytesReader:
+    """
+    Read-only cursor over an in-memory buffer
+
+    Offers the ``read`` method of a binary stream, so it can be passed to any of the ``parse``
+    methods, but returns memoryview slices of the buffer instead of copying the data into new bytes
+    objects. Parsers that know about it use the typed ``read_*`` methods, which decode integers in
+    place, or work directly on ``buffer`` and ``offset``.
+
+    Parameters
+    ----------
+    data: bytes, bytearray or memoryview
+        Buffer to read from. ``bytes`` are kept as ``data`` and sliced directly, anything else is
+        accessed through a memoryview.
+    offset: int
+        Position of the cursor
+
+    Examples
+    --------
+    >>> reader = BytesReader(bytes([1, 2, 3]))
+    >>> reader.read(2).tolist()
+    [1, 2]
+    >>> reader.offset
+    2
+    """
+    def __init__(self, data, offset=0):
+        self.buffer = memoryview(data).cast('B')
+        self.data = data if type(data) is bytes else self.buffer
+        self.offset = offset
+
+    def read(self, n: int) -> memoryview:
+        start = self.offset
+        self.offset = min(start + n, len(self.buffer))
+        return self.buffer[start:self.offset]
+
+    def read_bytes(self, n: int) -> bytes:
+        """ Copy of the next n bytes """
+        start = self.offset
+        end = start + n
+        if end > len(self.buffer):
+            raise EOFError(f'cannot read {n} bytes at offset {start}')
+        self.offset = end
+        return bytes(self.data[start:end])
+
+    def read_uint32(self) -> int:
+        value, = _UINT32.unpack_from(self.buffer, self.offset)
+        self.offset += 4
+        return value
+
+    def read_uint64(self) -> int:
+        value, = _UINT64.unpack_from(self.buffer, self.offset)
+        self.offset += 8
+        return value
+
+    def read_varint(self) -> int:
+        """ Same as :func:`read_varint` """
+        buffer = self.buffer
+        offset = self.offset
+        i = buffer[offset]
+
+        if i < 0xfd:
+            self.offset = offset + 1
+            return i
+
+        size = _VARINT_SIZES[i]
+        self.offset = offset + 1 + size
+        return int.from_bytes(buffer[offset + 1:offset + 1 + size], 'little')
+
+    def tell(self) -> int:
+        return self.offset
+
+    def seek(self, offset: int) -> int:
+        self.offset = offset
+        return offset
+
+
+def as_stream(s):
+    """ Wrap a bytes-like object in a :obj:`BytesReader`; streams are returned unchanged """
+    if isinstance(s, (bytes, bytearray, memoryview)):
+        return BytesReader(s)
+    return s
+
+
 def read_varint(s: BinaryIO) -> int:
     """ reads a variable integer from a stream """
     i = s.read(1)[0]
@@ -115,3 +205,84 @@ def encode_varint(i: int) -> bytes:
 
     else:
         raise ValueError('Integer too large: {}'.format(i))
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses evictions maxsize currsize')
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry
+
+    Parameters
+    ----------
+    maxsize: int
+        Maximum number of entries. 0 disables the cache.
+
+    Examples
+    --------
+    >>> cache = LRUCache(maxsize=2)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> cache.info()
+    CacheInfo(hits=1, misses=1, evictions=1, maxsize=2, currsize=2)
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """ Look up a key, marking it as recently used """
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """ Insert or replace a key, evicting the least recently used entries if full """
+        if self.maxsize <= 0:
+            return
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        self._evict()
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def resize(self, maxsize):
+        """ Change the maximum number of entries, evicting entries if needed """
+        self.maxsize = maxsize
+        self._evict()
+
+    def clear(self):
+        """ Remove all entries and reset the statistics """
+        self._data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._data))
+
+    def _evict(self):
+        while len(self._data) > max(self.maxsize, 0):
+            self._data.popitem(last=False)
+            self.evictions += 1
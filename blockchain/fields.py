@@ -5,7 +5,20 @@ Intuitively, the fact that we have a prime order results in every element of a
 finite field being equivalent. If the order of the set was a composite number,
 multiplying the set by one of the divisors would result in a smaller set.
 
+The batch functions at the bottom of this module operate on whole sequences of field elements at
+once. For primes small enough that the product of two elements fits in 64 bits they are
+vectorized with NumPy, if it is installed.
+
 """
+import operator
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# products of two reduced elements must fit in an int64 to vectorize with NumPy
+NUMPY_MAX_PRIME = 2**31
 
 
 class FieldElement:
@@ -52,10 +65,18 @@ class FieldElement:
     >>> print(a**-3==b)
     True
 
+    ** Negation **
+
+    >>> a = FieldElement(7, 13)
+    >>> print(-a)
+    FieldElement_13(6)
+
     ** Division **
 
 
     """
+    __slots__ = ('num', 'prime')
+
     def __init__(self, num, prime):
         if num < 0 or num >= prime:
             error = f'num={num} is not in field range 0 to {prime - 1}'
@@ -96,6 +117,9 @@ class FieldElement:
     def __rmul__(self, other):
         return self.__class__(other, self.prime) * self
 
+    def __neg__(self):
+        return self.__class__(-self.num % self.prime, self.prime)
+
     def __pow__(self, exponent):
         n = exponent % (self.prime - 1)
         num = pow(self.num, n, self.prime)
@@ -108,6 +132,145 @@ class FieldElement:
         return self.__class__(num, self.prime)
 
 
+def use_numpy(prime):
+    """ Whether arithmetic modulo prime can be vectorized with NumPy """
+    return np is not None and prime < NUMPY_MAX_PRIME
+
+
+def _common_prime(*sequences):
+    primes = {element.prime for sequence in sequences for element in sequence}
+
+    if len(primes) > 1:
+        raise TypeError('Cannot operate on numbers in different Fields')
+
+    return primes.pop()
+
+
+def _batch_binary(op, a, b):
+    if len(a) != len(b):
+        raise ValueError(f'Sequences have different lengths: {len(a)} and {len(b)}')
+
+    if not a:
+        return []
+
+    prime = _common_prime(a, b)
+
+    if use_numpy(prime):
+        nums = op(np.array([x.num for x in a], dtype=np.int64),
+                  np.array([y.num for y in b], dtype=np.int64)) % prime
+        nums = nums.tolist()
+    else:
+        nums = [op(x.num, y.num) % prime for x, y in zip(a, b)]
+
+    cls = a[0].__class__
+    return [cls(num, prime) for num in nums]
+
+
+def batch_add(a, b):
+    """
+    Element-wise sum of two sequences of field elements
+
+    >>> [x.num for x in batch_add([FieldElement(7, 13), FieldElement(1, 13)],
+    ...                           [FieldElement(12, 13), FieldElement(2, 13)])]
+    [6, 3]
+    """
+    return _batch_binary(operator.add, a, b)
+
+
+def batch_sub(a, b):
+    """ Element-wise difference of two sequences of field elements """
+    return _batch_binary(operator.sub, a, b)
+
+
+def batch_mul(a, b):
+    """
+    Element-wise product of two sequences of field elements
+
+    >>> [x.num for x in batch_mul([FieldElement(3, 13), FieldElement(2, 13)],
+    ...                           [FieldElement(12, 13), FieldElement(2, 13)])]
+    [10, 4]
+    """
+    return _batch_binary(operator.mul, a, b)
+
+
+def batch_inverse(elements):
+    """
+    Multiplicative inverses of a sequence of field elements
+
+    Without NumPy this uses :func:`batch_inverse_mod`, which needs a single modular inversion for
+    the whole batch. As with ``element ** -1``, the inverse of zero is zero.
+
+    >>> [x.num for x in batch_inverse([FieldElement(7, 13), FieldElement(0, 13)])]
+    [2, 0]
+    """
+    if not elements:
+        return []
+
+    prime = _common_prime(elements)
+    cls = elements[0].__class__
+
+    if use_numpy(prime):
+        base = np.array([x.num for x in elements], dtype=np.int64)
+        nums = np.ones_like(base)
+        exponent = prime - 2
+        while exponent:
+            if exponent & 1:
+                nums = nums * base % prime
+            base = base * base % prime
+            exponent >>= 1
+        return [cls(num, prime) for num in nums.tolist()]
+
+    nums = batch_inverse_mod([element.num for element in elements], prime)
+    return [cls(num, prime) for num in nums]
+
+
+def batch_inverse_mod(nums, modulus):
+    """
+    Inverses of many integers modulo a prime, with a single modular inversion
+
+    Uses Montgomery's trick: the product of all values is inverted once and the individual
+    inverses are recovered by walking the running products backwards. Values that are zero
+    modulo the prime have no inverse and map to zero, like ``FieldElement(0, p) ** -1``, without
+    affecting the other results.
+
+    Parameters
+    ----------
+    nums: sequence
+        Integers
+    modulus: int
+        Prime modulus, e.g. the field prime or the order of a group
+
+    Returns
+    -------
+    list
+        Inverses in [0, modulus)
+
+    Examples
+    --------
+    >>> batch_inverse_mod([7, 0, 26, 3], 13)
+    [2, 0, 0, 9]
+    """
+    nums = [num % modulus for num in nums]
+    products = []
+    acc = 1
+
+    for num in nums:
+        if num:
+            acc = acc * num % modulus
+        products.append(acc)
+
+    acc_inv = pow(acc, -1, modulus)
+    result = [0] * len(nums)
+
+    for i in range(len(nums) - 1, -1, -1):
+        num = nums[i]
+        if num:
+            result[i] = acc_inv * (products[i - 1] if i else 1) % modulus
+            acc_inv = acc_inv * num % modulus
+
+    return result
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
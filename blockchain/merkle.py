@@ -0,0 +1,242 @@
+"""
+Merkle trees
+
+Hashes are in internal byte order, i.e. the reverse of the hexadecimal ids of transactions and
+blocks. A level with an odd number of hashes is completed by duplicating its last hash.
+"""
+import hashlib
+
+from blockchain.etc import hash256
+
+HASH_SIZE = 32
+
+
+def merkle_parent(hash1: bytes, hash2: bytes) -> bytes:
+    """ Hash of two children """
+    return hash256(hash1 + hash2)
+
+
+def merkle_root(hashes) -> bytes:
+    """
+    Root of the merkle tree of a list of hashes
+
+    Every level is kept as a single bytes object holding the concatenated hashes, and the parents
+    are hashed straight out of slices of it, so no node objects or per-level lists of children are
+    made.
+
+    Parameters
+    ----------
+    hashes: iterable
+        32 byte hashes, in internal byte order
+
+    Returns
+    -------
+    bytes
+    """
+    level = b''.join(hashes)
+    count = len(level) // HASH_SIZE
+
+    if count == 0 or len(level) != count * HASH_SIZE:
+        raise ValueError('merkle root needs one or more 32 byte hashes')
+
+    # hash256 inlined, the calls dominate the time spent here
+    sha256 = hashlib.sha256
+    pair_size = 2 * HASH_SIZE
+
+    while count > 1:
+        if count % 2:
+            level += level[-HASH_SIZE:]
+            count += 1
+
+        level = b''.join([sha256(sha256(level[i:i + pair_size]).digest()).digest()
+                          for i in range(0, count * HASH_SIZE, pair_size)])
+        count //= 2
+
+    return level
+
+
+def verify_proof(leaf: bytes, index: int, proof, root: bytes) -> bool:
+    """
+    Check a merkle inclusion proof
+
+    Parameters
+    ----------
+    leaf: bytes
+        Hash whose inclusion is proven
+    index: int
+        Position of the leaf in the tree
+    proof: list
+        Hashes of the siblings on the path from the leaf to the root, see :meth:`MerkleTree.proof`
+    root: bytes
+        Root of the tree
+
+    Returns
+    -------
+    bool
+    """
+    current = leaf
+
+    for sibling in proof:
+        if index & 1:
+            current = hash256(sibling + current)
+        else:
+            current = hash256(current + sibling)
+        index >>= 1
+
+    return index == 0 and current == root
+
+
+class MerkleTree:
+    """
+    Merkle tree that is updated in place as leaves are added, changed and removed
+
+    Every level of the tree is kept, as a bytearray of concatenated 32 byte hashes, so changing a
+    leaf only rehashes the O(log n) nodes on its path to the root.
+
+    Parameters
+    ----------
+    hashes: iterable
+        Leaves, in internal byte order. Use ``tx.hash()[::-1]`` for a :obj:`Transaction`, or
+        :meth:`from_transactions`.
+    """
+    def __init__(self, hashes=()):
+        level = bytearray().join(hashes)
+
+        if len(level) % HASH_SIZE:
+            raise ValueError('merkle leaves must be 32 byte hashes')
+
+        self.levels = [level]
+        sha256 = hashlib.sha256
+        pair_size = 2 * HASH_SIZE
+
+        while len(level) > HASH_SIZE:
+            # the last hash of an odd level is paired with itself
+            padded = level + level[-HASH_SIZE:] if len(level) % pair_size else level
+            level = bytearray().join([sha256(sha256(padded[i:i + pair_size]).digest()).digest()
+                                      for i in range(0, len(padded), pair_size)])
+            self.levels.append(level)
+
+    @classmethod
+    def from_transactions(cls, txs):
+        return cls(tx.hash()[::-1] for tx in txs)
+
+    def __len__(self):
+        return len(self.levels[0]) // HASH_SIZE
+
+    def __getitem__(self, index):
+        return bytes(self.levels[0][self._offset(index)])
+
+    def _offset(self, index):
+        count = len(self)
+        if index < 0:
+            index += count
+
+        if not 0 <= index < count:
+            raise IndexError('merkle leaf index out of range')
+
+        return slice(index * HASH_SIZE, (index + 1) * HASH_SIZE)
+
+    def root(self) -> bytes:
+        """ Root of the tree, in internal byte order """
+        if not self.levels[0]:
+            raise ValueError('empty merkle tree has no root')
+        return bytes(self.levels[-1][:HASH_SIZE])
+
+    def _update(self, index):
+        """ Rehash the path from a leaf to the root, resizing the levels on the way if needed """
+        depth = 0
+
+        while True:
+            level = self.levels[depth]
+            count = len(level) // HASH_SIZE
+
+            if count <= 1:
+                del self.levels[depth + 1:]
+                return
+
+            if depth + 1 == len(self.levels):
+                self.levels.append(bytearray())
+
+            parents = self.levels[depth + 1]
+            size = (count + 1) // 2 * HASH_SIZE
+            if len(parents) > size:
+                del parents[size:]
+            elif len(parents) < size:
+                parents.extend(bytes(size - len(parents)))
+
+            left = index & ~1
+            right = left + 1 if left + 1 < count else left
+            parent = index // 2 * HASH_SIZE
+
+            parents[parent:parent + HASH_SIZE] = hash256(
+                level[left * HASH_SIZE:(left + 1) * HASH_SIZE]
+                + level[right * HASH_SIZE:(right + 1) * HASH_SIZE])
+
+            index //= 2
+            depth += 1
+
+    def append(self, leaf: bytes):
+        if len(leaf) != HASH_SIZE:
+            raise ValueError('merkle leaves must be 32 byte hashes')
+
+        self.levels[0] += leaf
+        self._update(len(self) - 1)
+
+    def replace(self, index: int, leaf: bytes):
+        if len(leaf) != HASH_SIZE:
+            raise ValueError('merkle leaves must be 32 byte hashes')
+
+        offset = self._offset(index)
+        self.levels[0][offset] = leaf
+        self._update(offset.start // HASH_SIZE)
+
+    def remove(self, index: int) -> bytes:
+        """
+        Remove a leaf by moving the last leaf in its place
+
+        Keeping every other leaf in place would rehash all the leaves after the removed one, so the
+        order of the leaves changes: the last one takes the position of the removed one.
+
+        Returns
+        -------
+        bytes
+            The removed leaf
+        """
+        offset = self._offset(index)
+        leaves = self.levels[0]
+        removed = bytes(leaves[offset])
+
+        leaves[offset] = leaves[-HASH_SIZE:]
+        del leaves[-HASH_SIZE:]
+
+        count = len(self)
+        if count:
+            # the tail of every level shrinks, then the moved leaf is rehashed
+            self._update(count - 1)
+            if offset.start // HASH_SIZE < count - 1:
+                self._update(offset.start // HASH_SIZE)
+        else:
+            del self.levels[1:]
+
+        return removed
+
+    def proof(self, index: int) -> list:
+        """
+        Inclusion proof of a leaf, for :func:`verify_proof`
+
+        Returns
+        -------
+        list
+            Hash of the sibling at every level, from the leaves up
+        """
+        index = self._offset(index).start // HASH_SIZE
+        hashes = []
+
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling * HASH_SIZE >= len(level):
+                sibling = index
+            hashes.append(bytes(level[sibling * HASH_SIZE:(sibling + 1) * HASH_SIZE]))
+            index //= 2
+
+        return hashes
@@ -1,14 +1,28 @@
+import hashlib
 from functools import wraps
 from dataclasses import dataclass
 from typing import Any
 
 from blockchain.etc import hash160, hash256
-from blockchain.crypto import S256Point, Signature
+from blockchain.crypto import S256Point, Signature, signature_cache
 
 
 OP_CODE_FUNCTIONS = {}
 OP_CODE_NAMES = {}
 
+# OP_CAT, OP_SUBSTR, OP_LEFT, OP_RIGHT, OP_INVERT, OP_AND, OP_OR, OP_XOR, OP_2MUL, OP_2DIV, OP_MUL,
+# OP_DIV, OP_MOD, OP_LSHIFT, OP_RSHIFT, OP_VERIF and OP_VERNOTIF make a script invalid even in a
+# branch that is not executed
+DISABLED_OP_CODES = frozenset([126, 127, 128, 129, 131, 132, 133, 134, 141, 142, 149, 150, 151,
+                               152, 153, 101, 102])
+
+MAX_NUM_SIZE = 4
+LOCKTIME_THRESHOLD = 500000000
+SEQUENCE_FINAL = 0xffffffff
+SEQUENCE_DISABLE_FLAG = 1 << 31
+SEQUENCE_TYPE_FLAG = 1 << 22
+SEQUENCE_MASK = 0x0000ffff
+
 
 # def opcode(n, name, min_stack=1):
 #     def wrapper(f):
@@ -100,18 +114,329 @@ def decode_num(element):
         return result
 
 
+def decode_num_element(element, max_size=MAX_NUM_SIZE):
+    """ Decode a number, raising ValueError if it is longer than ``max_size`` bytes """
+    if len(element) > max_size:
+        raise ValueError('number too long')
+    return decode_num(element)
+
+
+def pop_num(stack, max_size=MAX_NUM_SIZE):
+    """
+    Pop a number from the stack
+
+    Raises
+    ------
+    ValueError
+        If the element is longer than ``max_size`` bytes
+    """
+    return decode_num_element(stack.pop(), max_size)
+
+
+def is_true(element) -> bool:
+    """ Whether a stack element is true: anything but zero, including negative zero """
+    if not element:
+        return False
+    if element[-1] & 0x7f:
+        return True
+    return any(element[:-1])
+
+
+# Constants
+
 @opcode(0, 'OP_0', min_stack=0)
 def op_0(stack):
     stack.append(encode_num(0))
     return True
 
 
+@opcode(79, 'OP_1NEGATE', min_stack=0)
+def op_1negate(stack):
+    stack.append(encode_num(-1))
+    return True
+
+
+def _small_int(n):
+    @opcode(80 + n, 'OP_{}'.format(n), min_stack=0)
+    def op_n(stack):
+        stack.append(encode_num(n))
+        return True
+
+    return op_n
+
+
+# OP_1 to OP_16
+for _n in range(1, 17):
+    _small_int(_n)
+
+
+# Flow control
+#
+# The branches of OP_IF, OP_NOTIF and OP_ELSE are followed by the interpreter, using the offsets
+# computed when the script is compiled (see blockchain.script.compile_cmds). OP_IF and OP_NOTIF
+# only pop their condition and tell whether the branch is taken.
+
+@opcode(97, 'OP_NOP', min_stack=0)
+def op_nop(stack):
+    return True
+
+
+@opcode(99, 'OP_IF')
+def op_if(stack):
+    return is_true(stack.pop())
+
+
+@opcode(100, 'OP_NOTIF')
+def op_notif(stack):
+    return not is_true(stack.pop())
+
+
+@opcode(103, 'OP_ELSE', min_stack=0)
+def op_else(stack):
+    return True
+
+
+@opcode(104, 'OP_ENDIF', min_stack=0)
+def op_endif(stack):
+    return True
+
+
+@opcode(105, 'OP_VERIFY')
+def op_verify(stack):
+    return is_true(stack.pop())
+
+
+@opcode(106, 'OP_RETURN', min_stack=0)
+def op_return(stack):
+    return False
+
+
+# Stack
+
+@opcode(107, 'OP_TOALTSTACK')
+def op_toaltstack(stack, altstack):
+    altstack.append(stack.pop())
+    return True
+
+
+@opcode(108, 'OP_FROMALTSTACK', min_stack=0)
+def op_fromaltstack(stack, altstack):
+    if not altstack:
+        return False
+    stack.append(altstack.pop())
+    return True
+
+
+@opcode(109, 'OP_2DROP', min_stack=2)
+def op_2drop(stack):
+    del stack[-2:]
+    return True
+
+
+@opcode(110, 'OP_2DUP', min_stack=2)
+def op_2dup(stack):
+    stack.extend(stack[-2:])
+    return True
+
+
+@opcode(111, 'OP_3DUP', min_stack=3)
+def op_3dup(stack):
+    stack.extend(stack[-3:])
+    return True
+
+
+@opcode(112, 'OP_2OVER', min_stack=4)
+def op_2over(stack):
+    stack.extend(stack[-4:-2])
+    return True
+
+
+@opcode(113, 'OP_2ROT', min_stack=6)
+def op_2rot(stack):
+    stack.extend(stack[-6:-4])
+    del stack[-8:-6]
+    return True
+
+
+@opcode(114, 'OP_2SWAP', min_stack=4)
+def op_2swap(stack):
+    stack[-4:] = stack[-2:] + stack[-4:-2]
+    return True
+
+
+@opcode(115, 'OP_IFDUP')
+def op_ifdup(stack):
+    if is_true(stack[-1]):
+        stack.append(stack[-1])
+    return True
+
+
+@opcode(116, 'OP_DEPTH', min_stack=0)
+def op_depth(stack):
+    stack.append(encode_num(len(stack)))
+    return True
+
+
+@opcode(117, 'OP_DROP')
+def op_drop(stack):
+    stack.pop()
+    return True
+
+
 @opcode(118, 'OP_DUP')
 def op_dup(stack):
     stack.append(stack[-1])
     return True
 
 
+@opcode(119, 'OP_NIP', min_stack=2)
+def op_nip(stack):
+    del stack[-2]
+    return True
+
+
+@opcode(120, 'OP_OVER', min_stack=2)
+def op_over(stack):
+    stack.append(stack[-2])
+    return True
+
+
+@opcode(121, 'OP_PICK', min_stack=2)
+def op_pick(stack):
+    n = pop_num(stack)
+    if n < 0 or n >= len(stack):
+        return False
+    stack.append(stack[-n - 1])
+    return True
+
+
+@opcode(122, 'OP_ROLL', min_stack=2)
+def op_roll(stack):
+    n = pop_num(stack)
+    if n < 0 or n >= len(stack):
+        return False
+    stack.append(stack.pop(-n - 1))
+    return True
+
+
+@opcode(123, 'OP_ROT', min_stack=3)
+def op_rot(stack):
+    stack.append(stack.pop(-3))
+    return True
+
+
+@opcode(124, 'OP_SWAP', min_stack=2)
+def op_swap(stack):
+    stack[-2], stack[-1] = stack[-1], stack[-2]
+    return True
+
+
+@opcode(125, 'OP_TUCK', min_stack=2)
+def op_tuck(stack):
+    stack.insert(-2, stack[-1])
+    return True
+
+
+# Splice
+
+@opcode(130, 'OP_SIZE')
+def op_size(stack):
+    stack.append(encode_num(len(stack[-1])))
+    return True
+
+
+# Bitwise logic
+
+@opcode(135, 'OP_EQUAL', min_stack=2)
+def op_equal(stack):
+    stack.append(encode_num(1 if stack.pop() == stack.pop() else 0))
+    return True
+
+
+@opcode(136, 'OP_EQUALVERIFY', min_stack=2)
+def op_equalverify(stack):
+    if stack.pop() != stack.pop():
+        return False
+    return True
+
+
+# Arithmetic, on numbers of at most 4 bytes
+
+def _unary(num, label, f):
+    @opcode(num, label)
+    def op(stack):
+        stack.append(encode_num(f(pop_num(stack))))
+        return True
+
+    return op
+
+
+def _binary(num, label, f):
+    @opcode(num, label, min_stack=2)
+    def op(stack):
+        b = pop_num(stack)
+        a = pop_num(stack)
+        stack.append(encode_num(f(a, b)))
+        return True
+
+    return op
+
+
+op_1add = _unary(139, 'OP_1ADD', lambda a: a + 1)
+op_1sub = _unary(140, 'OP_1SUB', lambda a: a - 1)
+op_negate = _unary(143, 'OP_NEGATE', lambda a: -a)
+op_abs = _unary(144, 'OP_ABS', abs)
+op_not = _unary(145, 'OP_NOT', lambda a: int(a == 0))
+op_0notequal = _unary(146, 'OP_0NOTEQUAL', lambda a: int(a != 0))
+
+op_add = _binary(147, 'OP_ADD', lambda a, b: a + b)
+op_sub = _binary(148, 'OP_SUB', lambda a, b: a - b)
+op_booland = _binary(154, 'OP_BOOLAND', lambda a, b: int(a != 0 and b != 0))
+op_boolor = _binary(155, 'OP_BOOLOR', lambda a, b: int(a != 0 or b != 0))
+op_numequal = _binary(156, 'OP_NUMEQUAL', lambda a, b: int(a == b))
+op_numnotequal = _binary(158, 'OP_NUMNOTEQUAL', lambda a, b: int(a != b))
+op_lessthan = _binary(159, 'OP_LESSTHAN', lambda a, b: int(a < b))
+op_greaterthan = _binary(160, 'OP_GREATERTHAN', lambda a, b: int(a > b))
+op_lessthanorequal = _binary(161, 'OP_LESSTHANOREQUAL', lambda a, b: int(a <= b))
+op_greaterthanorequal = _binary(162, 'OP_GREATERTHANOREQUAL', lambda a, b: int(a >= b))
+op_min = _binary(163, 'OP_MIN', min)
+op_max = _binary(164, 'OP_MAX', max)
+
+
+@opcode(157, 'OP_NUMEQUALVERIFY', min_stack=2)
+def op_numequalverify(stack):
+    return pop_num(stack) == pop_num(stack)
+
+
+@opcode(165, 'OP_WITHIN', min_stack=3)
+def op_within(stack):
+    maximum = pop_num(stack)
+    minimum = pop_num(stack)
+    x = pop_num(stack)
+    stack.append(encode_num(int(minimum <= x < maximum)))
+    return True
+
+
+# Crypto
+
+@opcode(166, 'OP_RIPEMD160')
+def op_ripemd160(stack):
+    stack.append(hashlib.new('ripemd160', stack.pop()).digest())
+    return True
+
+
+@opcode(167, 'OP_SHA1')
+def op_sha1(stack):
+    stack.append(hashlib.sha1(stack.pop()).digest())
+    return True
+
+
+@opcode(168, 'OP_SHA256')
+def op_sha256(stack):
+    stack.append(hashlib.sha256(stack.pop()).digest())
+    return True
+
+
 @opcode(169, 'OP_HASH160')
 def op_hash160(stack):
     el = stack.pop()
@@ -126,42 +451,157 @@ def op_hash256(stack):
     return True
 
 
+@opcode(171, 'OP_CODESEPARATOR', min_stack=0)
+def op_codeseparator(stack):
+    # the signature hashes are computed by the caller, from the whole script code
+    return True
+
+
+def check_signature(signature, sec_pubkey, z) -> bool:
+    """
+    Whether a signature is valid for a public key and signature hash
+
+    Parameters
+    ----------
+    signature: bytes
+        DER signature followed by its hash type byte
+    sec_pubkey: bytes
+    z: int
+
+    Raises
+    ------
+    ValueError, SyntaxError, IndexError
+        If the signature or the public key can't be parsed
+    """
+    der_signature = signature[:-1]
+
+    if signature_cache.contains(z, sec_pubkey, der_signature):
+        return True
+
+    point = S256Point.parse(sec_pubkey)
+    sig = Signature.parse(der_signature)
+
+    if point.verify(z, sig):
+        signature_cache.add(z, sec_pubkey, der_signature)
+        return True
+
+    return False
+
+
 @opcode(172, 'OP_CHECKSIG', min_stack=2)
 def op_checksig(stack, z):
     sec_pubkey = stack.pop()
-    der_signature = stack.pop()[:-1]
+    signature = stack.pop()
 
+    # an empty or malformed signature is a failed check, which pushes false like a wrong one
     try:
-        point = S256Point.parse(sec_pubkey)
-        sig = Signature.parse(der_signature)
-    except (ValueError, SyntaxError):
-        return False
+        valid = check_signature(signature, sec_pubkey, z)
+    except (ValueError, SyntaxError, IndexError):
+        valid = False
 
-    if point.verify(z, sig):
-        stack.append(encode_num(1))
-    else:
-        stack.append(encode_num(0))
-    print(f'opchecksig: {stack}')
+    stack.append(encode_num(1 if valid else 0))
     return True
 
 
-@opcode(136, 'OP_EQUALVERIFY', min_stack=2)
-def op_equalverify(stack):
-    if stack.pop() != stack.pop():
+@opcode(173, 'OP_CHECKSIGVERIFY', min_stack=2)
+def op_checksigverify(stack, z):
+    return op_checksig.func(stack, z) and op_verify.func(stack)
+
+
+@opcode(174, 'OP_CHECKMULTISIG')
+def op_checkmultisig(stack, z):
+    n = pop_num(stack)
+    if n < 0 or n > 20 or len(stack) < n + 1:
+        return False
+    sec_pubkeys = [stack.pop() for _ in range(n)]
+
+    m = pop_num(stack)
+    if m < 0 or m > n or len(stack) < m + 1:
         return False
+    signatures = [stack.pop() for _ in range(m)]
+
+    # an extra element is consumed, because of an off-by-one error in the original implementation
+    stack.pop()
+
+    # signatures must be in the same order as their public keys, which are tried until one matches
+    keys = iter(sec_pubkeys)
+    valid = True
+
+    for signature in signatures:
+        for sec_pubkey in keys:
+            try:
+                if check_signature(signature, sec_pubkey, z):
+                    break
+            except (ValueError, SyntaxError, IndexError):
+                pass
+        else:
+            valid = False
+            break
+
+    stack.append(encode_num(1 if valid else 0))
     return True
 
 
-@opcode(99, 'OP_IF')
-def op_if(stack, cmds):
-    raise NotImplementedError('OP_IF')
+@opcode(175, 'OP_CHECKMULTISIGVERIFY')
+def op_checkmultisigverify(stack, z):
+    return op_checkmultisig.func(stack, z) and op_verify.func(stack)
 
 
-@opcode(100, 'OP_NOTIF')
-def op_notif(stack, cmds):
-    raise NotImplementedError('OP_NOTIF')
+# Locktime
+#
+# timelocks is the (version, locktime, sequence) of the transaction and input being verified, None
+# if unknown, in which case the checks fail.
 
+@opcode(177, 'OP_CHECKLOCKTIMEVERIFY')
+def op_checklocktimeverify(stack, timelocks):
+    if timelocks is None:
+        return False
+    _, locktime, sequence = timelocks
 
-@opcode(107, 'OP_TOALTSTACK')
-def op_toaltstack(stack, altstack):
-    raise NotImplementedError('OP_TOALTSTACK')
+    # the element stays on the stack, and may be 5 bytes long to go past 2**31
+    element = decode_num_element(stack[-1], 5)
+    if element < 0 or sequence == SEQUENCE_FINAL:
+        return False
+
+    # both block heights or both timestamps
+    if (element < LOCKTIME_THRESHOLD) != (locktime < LOCKTIME_THRESHOLD):
+        return False
+
+    return element <= locktime
+
+
+@opcode(178, 'OP_CHECKSEQUENCEVERIFY')
+def op_checksequenceverify(stack, timelocks):
+    if timelocks is None:
+        return False
+    version, _, sequence = timelocks
+
+    element = decode_num_element(stack[-1], 5)
+    if element < 0:
+        return False
+
+    if element & SEQUENCE_DISABLE_FLAG:
+        return True
+
+    if version < 2 or sequence & SEQUENCE_DISABLE_FLAG:
+        return False
+
+    if (element & SEQUENCE_TYPE_FLAG) != (sequence & SEQUENCE_TYPE_FLAG):
+        return False
+
+    return element & SEQUENCE_MASK <= sequence & SEQUENCE_MASK
+
+
+def _nop(num, label):
+    @opcode(num, label, min_stack=0)
+    def op(stack):
+        return True
+
+    return op
+
+
+op_nop1 = _nop(176, 'OP_NOP1')
+
+# OP_NOP4 to OP_NOP10
+for _n in range(179, 186):
+    _nop(_n, 'OP_NOP{}'.format(_n - 175))
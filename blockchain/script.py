@@ -1,8 +1,39 @@
 from functools import wraps
 
 from blockchain.etc import (read_varint, little_endian_to_int, int_to_little_endian, encode_varint,
-                            hash160)
-from blockchain.op import OP_CODE_FUNCTIONS, OP_CODE_NAMES
+                            hash160, BytesReader, as_stream, LRUCache)
+from blockchain.op import (OP_CODE_FUNCTIONS, OP_CODE_NAMES, DISABLED_OP_CODES, check_signature,
+                          decode_num_element, encode_num, is_true)
+
+# kinds of instructions of a compiled script, telling what the handler of an opcode is called with
+PUSH = 0
+STACK = 1
+ALTSTACK = 2
+SIG = 3
+LOCKTIME = 4
+IF = 5
+ELSE = 6
+FAIL = 7
+MULTISIG = 8
+
+MAX_ELEMENT_SIZE = 520
+MAX_OPS = 201
+MAX_STACK_SIZE = 1000
+
+_ALTSTACK_OPS = (107, 108)
+_SIG_OPS = (172, 173)
+_MULTISIG_OPS = (174, 175)
+_LOCKTIME_OPS = (177, 178)
+_IF_OPS = (99, 100)
+_ELSE = 103
+_ENDIF = 104
+
+# OP_0, OP_1NEGATE and OP_1 to OP_16 compile to pushes of their number
+_SMALL_INTS = {0: b'', 79: encode_num(-1)}
+_SMALL_INTS.update((80 + n, encode_num(n)) for n in range(1, 17))
+
+# program of a script that fails whatever the stack, e.g. with a disabled opcode
+_INVALID = ((FAIL, None, 0, None),)
 
 
 def script_template(f):
@@ -21,13 +52,463 @@ def script_template(f):
     return wrapper
 
 
+def decode_cmds(data, start, end):
+    """
+    Decode the commands of a raw script (without its length prefix)
+
+    Parameters
+    ----------
+    data: bytes or memoryview
+        Buffer holding the script
+    start, end: int
+        Position of the script in the buffer
+
+    Returns
+    -------
+    list
+        Opcodes as integers and elements as bytes
+    """
+    copy = data.__class__ is not bytes
+    i = start
+    cmds = []
+    append = cmds.append
+
+    while i < end:
+        current_byte = data[i]
+        i += 1
+
+        # it's an op code
+        if current_byte > 78 or current_byte == 0:
+            append(current_byte)
+            continue
+
+        # next n bytes are an element
+        if current_byte < 76:
+            data_length = current_byte
+
+        # OP_PUSHDATA1, OP_PUSHDATA2 and OP_PUSHDATA4: the length takes the next 1, 2 or 4 bytes
+        else:
+            size = 1 << current_byte - 76
+            if i + size > end:
+                raise SyntaxError('parsing script failed')
+            data_length = int.from_bytes(data[i:i + size], 'little')
+            i += size
+
+        element = data[i:i + data_length]
+        append(element.tobytes() if copy else element)
+        i += data_length
+
+    if i != end:
+        raise SyntaxError('parsing script failed')
+
+    return cmds
+
+
+def compile_cmds(cmds):
+    """
+    Compile the commands of a script into a program for :func:`run_program`
+
+    Every command becomes one (kind, handler, arg, opcode) instruction, in the same order. Elements
+    and small numbers are (PUSH, element, 0, None). For the other opcodes, the kind tells which
+    arguments the handler takes, and arg is the minimum stack size, except for OP_IF, OP_NOTIF
+    and OP_ELSE: their arg is the position of the matching OP_ELSE or OP_ENDIF, where execution
+    continues when the branch is not taken. The arg of OP_CHECKMULTISIG and
+    OP_CHECKMULTISIGVERIFY is the number of public keys that the 201 opcode limit leaves room for,
+    as the keys of the executed ones are counted as opcodes too.
+
+    Scripts that can never be valid, with unbalanced conditionals, a disabled opcode, an element
+    longer than 520 bytes or more than 201 opcodes, compile to a program that always fails.
+
+    Parameters
+    ----------
+    cmds: list
+        Opcodes as integers and elements as bytes
+
+    Returns
+    -------
+    tuple
+    """
+    program = []
+    append = program.append
+    # positions of the OP_IF, OP_NOTIF and OP_ELSE waiting for their OP_ELSE or OP_ENDIF
+    branches = []
+    # positions of the OP_CHECKMULTISIG and OP_CHECKMULTISIGVERIFY
+    multisigs = []
+    ops = 0
+
+    for cmd in cmds:
+        if not isinstance(cmd, int):
+            if len(cmd) > MAX_ELEMENT_SIZE:
+                return _INVALID
+            append((PUSH, cmd, 0, None))
+            continue
+
+        small_int = _SMALL_INTS.get(cmd)
+        if small_int is not None:
+            append((PUSH, small_int, 0, None))
+            continue
+
+        # OP_RESERVED is not counted
+        if cmd > 96:
+            ops += 1
+            if ops > MAX_OPS:
+                return _INVALID
+
+        if cmd in DISABLED_OP_CODES:
+            return _INVALID
+
+        if cmd == _ELSE or cmd == _ENDIF:
+            if not branches:
+                return _INVALID
+
+            opening = branches.pop()
+            kind, handler, _, opening_cmd = program[opening]
+            program[opening] = (kind, handler, len(program), opening_cmd)
+
+            if cmd == _ELSE:
+                branches.append(len(program))
+                append((ELSE, None, None, cmd))
+                continue
+
+        operation = OP_CODE_FUNCTIONS.get(cmd)
+
+        # reserved and unknown opcodes fail when they are executed
+        if operation is None:
+            append((FAIL, None, 0, cmd))
+            continue
+
+        if cmd in _IF_OPS:
+            branches.append(len(program))
+            append((IF, operation.func, None, cmd))
+            continue
+
+        if cmd in _MULTISIG_OPS:
+            multisigs.append(len(program))
+            append((MULTISIG, operation.func, None, cmd))
+            continue
+
+        if cmd in _SIG_OPS:
+            kind = SIG
+        elif cmd in _ALTSTACK_OPS:
+            kind = ALTSTACK
+        elif cmd in _LOCKTIME_OPS:
+            kind = LOCKTIME
+        else:
+            kind = STACK
+
+        append((kind, operation.func, operation.min_stack, cmd))
+
+    if branches:
+        return _INVALID
+
+    for position in multisigs:
+        kind, handler, _, cmd = program[position]
+        program[position] = (kind, handler, MAX_OPS - ops, cmd)
+
+    return tuple(program)
+
+
+def run_program(program, stack, altstack, z, timelocks=None):
+    """
+    Execute a compiled script on a stack
+
+    Branches jump straight to the positions computed by :func:`compile_cmds`: a branch that is
+    not taken is never looked at, and since conditionals are balanced no condition stack is
+    needed to know whether an instruction runs.
+
+    Parameters
+    ----------
+    program: tuple
+    stack, altstack: list
+    z: int
+        Signature hash of the input
+    timelocks: tuple
+        (version, locktime, sequence) of the transaction and input, for OP_CHECKLOCKTIMEVERIFY
+        and OP_CHECKSEQUENCEVERIFY, which fail if it is None
+
+    Returns
+    -------
+    bool
+        False if an operation failed
+    """
+    pc = 0
+    end = len(program)
+    # public keys of the OP_CHECKMULTISIG executed so far
+    keys = 0
+
+    try:
+        while pc < end:
+            kind, handler, arg, _ = program[pc]
+            pc += 1
+
+            if kind == PUSH:
+                stack.append(handler)
+                if len(stack) + len(altstack) > MAX_STACK_SIZE:
+                    return False
+                continue
+
+            if kind == IF:
+                if not stack:
+                    valid = False
+                else:
+                    if not handler(stack):
+                        pc = arg + 1
+                    continue
+
+            elif kind == ELSE:
+                # reached at the end of a branch that was taken
+                pc = arg + 1
+                continue
+
+            elif kind == MULTISIG:
+                # the public keys count towards the opcode limit
+                keys += decode_num_element(stack[-1])
+                valid = keys <= arg and handler(stack, z)
+
+            elif len(stack) < arg:
+                valid = False
+            elif kind == STACK:
+                valid = handler(stack)
+            elif kind == SIG:
+                valid = handler(stack, z)
+            elif kind == ALTSTACK:
+                valid = handler(stack, altstack)
+            elif kind == LOCKTIME:
+                valid = handler(stack, timelocks)
+            else:
+                valid = False
+
+            if not valid:
+                return False
+
+            if len(stack) + len(altstack) > MAX_STACK_SIZE:
+                return False
+
+    except (ValueError, IndexError):
+        # numbers too long, or not enough elements for OP_PICK, OP_ROLL, OP_CHECKMULTISIG...
+        return False
+
+    return True
+
+
+def script_type(raw):
+    """
+    Classify a raw script (without its length prefix) by its standard template
+
+    Only the raw bytes are inspected, so outputs can be filtered before their scripts are decoded.
+
+    Parameters
+    ----------
+    raw: bytes-like
+
+    Returns
+    -------
+    str
+        One of 'p2pkh', 'p2sh', 'p2wpkh', 'p2wsh', 'p2pk', 'op_return' or 'nonstandard'
+
+    >>> script_type(bytes.fromhex('a914') + bytes(20) + bytes.fromhex('87'))
+    'p2sh'
+    """
+    length = len(raw)
+
+    if length == 25 and raw[0] == 0x76 and raw[1] == 0xa9 and raw[2] == 20 \
+            and raw[23] == 0x88 and raw[24] == 0xac:
+        return 'p2pkh'
+
+    if length == 23 and raw[0] == 0xa9 and raw[1] == 20 and raw[22] == 0x87:
+        return 'p2sh'
+
+    if length == 22 and raw[0] == 0 and raw[1] == 20:
+        return 'p2wpkh'
+
+    if length == 34 and raw[0] == 0 and raw[1] == 32:
+        return 'p2wsh'
+
+    if (length == 35 and raw[0] == 33 or length == 67 and raw[0] == 65) and raw[-1] == 0xac:
+        return 'p2pk'
+
+    if length and raw[0] == 0x6a:
+        return 'op_return'
+
+    return 'nonstandard'
+
+
+def _witness_version(raw):
+    """ Version of the witness program a raw script pubkey is, or None if it isn't one (BIP141) """
+    if (4 <= len(raw) <= 42 and (raw[0] == 0 or 0x51 <= raw[0] <= 0x60)
+            and raw[1] == len(raw) - 2):
+        return raw[0] - 0x50 if raw[0] else 0
+    return None
+
+
+def _pushes(program):
+    """ Elements pushed by a push-only program, or None if it has other operations """
+    pushes = []
+
+    for kind, handler, _, _ in program:
+        if kind != PUSH:
+            return None
+        pushes.append(handler)
+
+    return pushes
+
+
+def verify_standard(pushes, pubkey_raw, z, witness=None):
+    """
+    Verify an input spending a standard script without running the interpreter
+
+    Recognized are P2PK and P2PKH outputs, P2WPKH outputs, and P2SH outputs whose redeem script is
+    one of these. A P2PKH input is then one hash160 comparison and one signature
+    verification.
+
+    Parameters
+    ----------
+    pushes: list
+        Elements pushed by the script sig
+    pubkey_raw: bytes
+        Raw serialization of the script pubkey
+    z: int
+    witness: list
+        Witness of the input, None for a pre-segwit one
+
+    Returns
+    -------
+    bool
+        Whether the input is valid, or None if the scripts don't match a standard template and
+        must be evaluated by :func:`verify_generic`
+    """
+    kind = script_type(pubkey_raw)
+
+    try:
+        if kind == 'p2pkh':
+            if len(pushes) != 2 or witness:
+                return None
+            signature, sec = pushes
+            return hash160(sec) == pubkey_raw[3:23] and check_signature(signature, sec, z)
+
+        if kind == 'p2pk':
+            if len(pushes) != 1 or witness:
+                return None
+            return check_signature(pushes[0], pubkey_raw[1:-1], z)
+
+        if kind == 'p2wpkh':
+            if pushes or witness is None or len(witness) != 2:
+                return False
+            signature, sec = witness
+            return hash160(sec) == pubkey_raw[2:22] and check_signature(signature, sec, z)
+
+        if kind == 'p2sh':
+            if not pushes:
+                return None
+            redeem_script = pushes[-1]
+            if hash160(redeem_script) != pubkey_raw[2:22]:
+                return False
+            # a P2SH redeem script is only a hash comparison, P2SH rules don't apply to it again
+            if script_type(redeem_script) == 'p2sh':
+                return None
+            return verify_standard(pushes[:-1], redeem_script, z, witness)
+
+    except (ValueError, SyntaxError, IndexError):
+        return False
+
+    return None
+
+
+def _succeeds(program, stack, altstack, z, timelocks):
+    """ Whether a program runs without failing and leaves a true element on top of the stack """
+    if not run_program(program, stack, altstack, z, timelocks):
+        return False
+    return bool(stack) and is_true(stack[-1])
+
+
+def verify_generic(sig_program, pubkey_program, pubkey_raw, z, witness=None, timelocks=None):
+    """
+    Verify an input with the interpreter
+
+    The script sig runs first and the script pubkey then runs on the stack it left. If the script
+    pubkey is P2SH, the script sig must be push-only and the redeem script, its last push, then
+    runs on the stack as the script sig left it (BIP16).
+
+    If the script pubkey or the redeem script is a witness program, the script sig must be empty
+    or the single push of the redeem script (BIP141). For a P2WPKH program the P2PKH script of the
+    key hash then runs on the witness, which must have two items. Other witness programs, P2WSH
+    included, aren't supported and fail. Inputs spending anything else must have an empty witness.
+
+    Parameters
+    ----------
+    sig_program, pubkey_program: tuple
+        Compiled script sig and script pubkey, see :func:`compile_cmds`
+    pubkey_raw: bytes
+        Raw serialization of the script pubkey, None skips the P2SH and witness rules
+    z: int
+    witness: list
+    timelocks: tuple
+        (version, locktime, sequence), see :func:`run_program`
+
+    Returns
+    -------
+    bool
+    """
+    stack = []
+    altstack = []
+
+    if not run_program(sig_program, stack, altstack, z, timelocks):
+        return False
+
+    sig_stack = stack.copy()
+
+    if not _succeeds(pubkey_program, stack, altstack, z, timelocks):
+        return False
+
+    if pubkey_raw is None:
+        return True
+
+    if script_type(pubkey_raw) == 'p2sh':
+        pushes = _pushes(sig_program)
+        if pushes is None:
+            return False
+
+        pubkey_raw = sig_stack.pop()
+        try:
+            program = LazyScript(pubkey_raw).program()
+        except SyntaxError:
+            return False
+
+        if not _succeeds(program, sig_stack, [], z, timelocks):
+            return False
+
+        version = _witness_version(pubkey_raw)
+        if version is not None and len(pushes) != 1:
+            return False
+    else:
+        version = _witness_version(pubkey_raw)
+        if version is not None and sig_program:
+            return False
+
+    if version is None:
+        return not witness
+
+    # P2WSH and other witness programs aren't verified yet and fail
+    if script_type(pubkey_raw) != 'p2wpkh' or witness is None or len(witness) != 2:
+        return False
+
+    program = Script.p2pkh(bytes(pubkey_raw[2:22])).program()
+    return _succeeds(program, list(witness), [], z, timelocks)
+
+
 class Script:
+    # compiled programs of the scripts evaluated recently, by raw serialization
+    programs = LRUCache(maxsize=8192)
+
     def __init__(self, cmds=None):
         if cmds is None:
             self.cmds = []
         else:
             self.cmds = cmds
 
+        # (state, raw serialization, serialization) from the last time the script was serialized
+        self._serialization = None
+
     def __repr__(self):
         cmds = []
         for cmd in self.cmds:
@@ -40,32 +521,53 @@ class Script:
 
     @classmethod
     def parse(cls, s):
+        s = as_stream(s)
+
+        if isinstance(s, BytesReader):
+            return cls._parse_buffer(s)
+
         # script serialization always starts with the length of the entire script
         length = read_varint(s)
 
+        def read(n):
+            """ Next n bytes of the script, which must not run past its end or the stream's """
+            data = s.read(n) if count + n <= length else b''
+            if len(data) != n:
+                raise SyntaxError('parsing script failed')
+            return data
+
         cmds = []
         count = 0
 
         while count < length:
-            current_byte = s.read(1)[0]
+            current_byte = read(1)[0]
             count += 1
 
             # next n bytes are an element
             if 1 <= current_byte <= 75:
-                cmds.append(s.read(current_byte))
+                cmds.append(read(current_byte))
                 count += current_byte
 
             # OP_PUSHDATA1
             elif current_byte == 76:
-                data_length = little_endian_to_int(s.read(1))
-                cmds.append(s.read(data_length))
-                count += data_length + 1
+                data_length = little_endian_to_int(read(1))
+                count += 1
+                cmds.append(read(data_length))
+                count += data_length
 
             # OP_PUSHDATA2
             elif current_byte == 77:
-                data_length = little_endian_to_int(s.read(2))
-                cmds.append(s.read(data_length))
-                count += data_length + 2
+                data_length = little_endian_to_int(read(2))
+                count += 2
+                cmds.append(read(data_length))
+                count += data_length
+
+            # OP_PUSHDATA4
+            elif current_byte == 78:
+                data_length = little_endian_to_int(read(4))
+                count += 4
+                cmds.append(read(data_length))
+                count += data_length
 
             # it's an op code
             else:
@@ -76,80 +578,265 @@ class Script:
 
         return cls(cmds)
 
-    def raw_serialize(self):
-        result = b''
+    @classmethod
+    def _parse_buffer(cls, reader):
+        """ :meth:`parse` working directly on the buffer of a :obj:`BytesReader` """
+        length = reader.read_varint()
+        start = reader.offset
+        end = start + length
+
+        if end > len(reader.data):
+            raise SyntaxError('parsing script failed')
+
+        reader.offset = end
+        return cls(decode_cmds(reader.data, start, end))
+
+    def _state(self):
+        """ Snapshot of everything the serialization depends on """
+        return tuple(self.cmds)
+
+    def _serialized(self):
+        """ (raw serialization, serialization), rebuilt only when the commands have changed """
+        state = self._state()
+        cached = self._serialization
+
+        if cached is not None and cached[0] == state:
+            return cached[1], cached[2]
+
+        raw = self._raw_serialize()
+        self._serialization = (state, raw, encode_varint(len(raw)) + raw)
+        return raw, self._serialization[2]
+
+    def _raw_serialize(self):
+        parts = []
+        append = parts.append
 
         for cmd in self.cmds:
             # if it's an int, then it is an opcode
             if isinstance(cmd, int):
-                result += int_to_little_endian(cmd, 1)
+                append(int_to_little_endian(cmd, 1))
             else:
                 length = len(cmd)
 
-                if length < 75:
-                    result += int_to_little_endian(length, 1)
+                if length <= 75:
+                    append(int_to_little_endian(length, 1))
+
+                elif length < 256:
+                    append(int_to_little_endian(76, 1))
+                    append(int_to_little_endian(length, 1))
 
-                elif 75 < length < 256:
-                    result += int_to_little_endian(76, 1)
-                    result += int_to_little_endian(length, 1)
+                elif length < 0x10000:
+                    append(int_to_little_endian(77, 1))
+                    append(int_to_little_endian(length, 2))
 
-                elif 256 <= length <= 520:
-                    result += int_to_little_endian(77, 1)
-                    result += int_to_little_endian(length, 2)
+                # longer than the 520 bytes scripts may push, but still a valid serialization
+                elif length < 0x100000000:
+                    append(int_to_little_endian(78, 1))
+                    append(int_to_little_endian(length, 4))
 
                 else:
                     raise ValueError('cmd too long')
 
-                result += cmd
+                append(cmd)
 
-        return result
+        return b''.join(parts)
+
+    def raw_serialize(self):
+        return self._serialized()[0]
 
     def serialize(self):
-        result = self.raw_serialize()
-        length = len(result)
-        return encode_varint(length) + result
+        return self._serialized()[1]
+
+    def program(self):
+        """
+        Compiled form of the script, see :func:`compile_cmds`
+
+        Programs are shared by all the scripts with the same serialization, so the script pubkeys
+        of standard outputs are only compiled once, and a :obj:`LazyScript` found in the cache is
+        never decoded.
+        """
+        try:
+            raw = self.raw_serialize()
+        except ValueError:
+            # elements too long to be serialized, e.g. in a script built by hand
+            return compile_cmds(self.cmds)
+
+        program = self.programs.get(raw)
+        if program is None:
+            program = compile_cmds(self.cmds)
+            self.programs.put(raw, program)
+
+        return program
 
     def __add__(self, other):
-        return Script(self.cmds + other.cmds)
+        return CombinedScript(self, other)
+
+    def evaluate(self, z, witness=None, timelocks=None):
+        """
+        Evaluate the script
+
+        A script made by adding a script sig and a script pubkey is a :obj:`CombinedScript`, which
+        checks the pair against standard templates first.
+
+        Parameters
+        ----------
+        z: int
+            Signature hash of the input
+        witness: list
+            Witness of the input, must be empty or None unless it spends a witness program
+        timelocks: tuple
+            (version, locktime, sequence) of the transaction and input, needed by
+            OP_CHECKLOCKTIMEVERIFY and OP_CHECKSEQUENCEVERIFY
+        """
+        return verify_generic((), self.program(), None, z, timelocks=timelocks)
+
+    @classmethod
+    @script_template
+    def p2pkh(cls, pk_hash: bytes):
+        return ['OP_DUP', 'OP_HASH160', pk_hash, 'OP_EQUALVERIFY', 'OP_CHECKSIG']
+
+    @classmethod
+    @script_template
+    def p2pk(cls, sec_pubkey: bytes):
+        return [sec_pubkey, 'OP_CHECKSIG']
 
-    def evaluate(self, z):
-        cmds = self.cmds.copy()
-        stack = []
-        altstack = []
+    @classmethod
+    @script_template
+    def p2sh(cls, script_hash: bytes):
+        return ['OP_HASH160', script_hash, 'OP_EQUAL']
 
-        while cmds:
-            cmd = cmds.pop(0)
+    @classmethod
+    @script_template
+    def p2wpkh(cls, pk_hash: bytes):
+        return ['OP_0', pk_hash]
 
-            if isinstance(cmd, int):
-                operation = OP_CODE_FUNCTIONS[cmd]
-                args = [stack]
 
-                # OP_IF, OP_NOTIF
-                if cmd in (99, 100):
-                    args += [cmds]
+class LazyScript(Script):
+    """
+    Script that keeps its raw serialization and only decodes its commands when they are accessed
 
-                # OP_TOALTSTACK, OP_FROMALTSTACK
-                elif cmd in (107, 108):
-                    args += [altstack]
+    Serializing a lazy script whose commands have not been accessed, or are the same as when they
+    were decoded, returns the raw bytes as they are.
+    """
+    def __init__(self, raw):
+        self._raw = raw
+        self._cmds = None
+        # commands as decoded from the raw bytes
+        self._decoded = None
+        self._serialization = None
 
-                # OP_CHECKSIG, OP_CHECKSIGVERIFY, OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY
-                elif cmd in (172, 173, 174, 175):
-                    args += [z]
+    @classmethod
+    def _parse_buffer(cls, reader):
+        length = reader.read_varint()
+        start = reader.offset
+        end = start + length
 
-                if not operation(*args):
-                    # TODO: add logging here
-                    print('bad op: {!r}'.format(operation))
-                    return False
+        if end > len(reader.data):
+            raise SyntaxError('parsing script failed')
 
+        reader.offset = end
+        return cls(reader.data[start:end])
+
+    @property
+    def cmds(self):
+        if self._cmds is None:
+            self._cmds = decode_cmds(self._raw, 0, len(self._raw))
+            self._decoded = tuple(self._cmds)
+        return self._cmds
+
+    @cmds.setter
+    def cmds(self, cmds):
+        self._cmds = cmds
+
+    def __reduce__(self):
+        # memoryviews can't be pickled, e.g. when sent to a validation worker
+        if self._cmds is None:
+            return self.__class__, (bytes(self._raw),)
+        return Script, (self._cmds,)
+
+    def _state(self):
+        if self._cmds is None:
+            return self._raw
+
+        cmds = tuple(self._cmds)
+        if cmds == self._decoded:
+            return self._raw
+        return cmds
+
+    def _raw_serialize(self):
+        if self._cmds is None or tuple(self._cmds) == self._decoded:
+            return bytes(self._raw)
+        return super()._raw_serialize()
+
+
+class CombinedScript(Script):
+    """
+    Script sig followed by the script pubkey it spends, as made by adding them
+
+    The two halves are compiled when they are added, and their commands are only joined when
+    :attr:`cmds` is accessed. Evaluating a pair that matches a standard template thus never decodes
+    a :obj:`LazyScript` script pubkey. Once joined, the commands are evaluated as a whole if they
+    are changed.
+    """
+    def __init__(self, script_sig, script_pubkey):
+        sig_cmds = list(script_sig.cmds)
+
+        try:
+            pubkey_raw = script_pubkey.raw_serialize()
+        except ValueError:
+            pubkey_raw = None
+
+        # the script pubkey as it is now: its raw bytes while a lazy script is unchanged, its
+        # commands otherwise
+        self._halves = (sig_cmds, script_pubkey._state())
+        self._cmds = None
+        # commands as joined from the halves
+        self._joined = None
+        self._serialization = None
+
+        # the script sig is usually unique and is compiled on its own, the script pubkey goes
+        # through the cache
+        self._components = (compile_cmds(sig_cmds), script_pubkey.program(), pubkey_raw)
+
+    @property
+    def cmds(self):
+        if self._cmds is None:
+            sig_cmds, pubkey_state = self._halves
+            if isinstance(pubkey_state, tuple):
+                pubkey_cmds = list(pubkey_state)
             else:
-                stack.append(cmd)
+                pubkey_cmds = decode_cmds(pubkey_state, 0, len(pubkey_state))
 
-        if not stack or not stack.pop():
-            return False
+            self._cmds = sig_cmds + pubkey_cmds
+            self._joined = tuple(self._cmds)
+        return self._cmds
 
-        return True
+    @cmds.setter
+    def cmds(self, cmds):
+        self._cmds = cmds
+        self._joined = None
 
-    @classmethod
-    @script_template
-    def p2pkh(cls, pk_hash: bytes):
-        return ['OP_DUP', 'OP_HASH160', pk_hash, 'OP_EQUALVERIFY', 'OP_CHECKSIG']
+    def __reduce__(self):
+        # compiled programs hold the opcode functions, which can't be pickled
+        return Script, (self.cmds,)
+
+    def evaluate(self, z, witness=None, timelocks=None):
+        """
+        Evaluate the script sig and script pubkey
+
+        The pair is checked with :func:`verify_standard` when it matches a standard template, and
+        with :func:`verify_generic` otherwise. See :meth:`Script.evaluate` for the parameters.
+        """
+        if self._cmds is not None and tuple(self._cmds) != self._joined:
+            return super().evaluate(z, witness, timelocks)
+
+        sig_program, pubkey_program, pubkey_raw = self._components
+
+        if pubkey_raw is not None:
+            pushes = _pushes(sig_program)
+            if pushes is not None:
+                valid = verify_standard(pushes, pubkey_raw, z, witness)
+                if valid is not None:
+                    return valid
+
+        return verify_generic(sig_program, pubkey_program, pubkey_raw, z, witness, timelocks)
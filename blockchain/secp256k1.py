@@ -0,0 +1,549 @@
+"""
+Internal arithmetic for the secp256k1 curve
+
+Field elements are plain integers in [0, P) and modular inverses use pow(x, -1, P), which is
+much faster than Fermat's little theorem for numbers of this size.
+
+Points are handled here as plain integer tuples in Jacobian coordinates, (X, Y, Z), which
+represent the affine point (X / Z^2, Y / Z^3). Adding and doubling in this representation needs
+no modular inversion, so a whole scalar multiplication can be carried out with a single inversion
+at the end when converting back to affine coordinates.
+
+The point at infinity is any tuple with Z == 0.
+
+secp256k1 also has an efficiently computable endomorphism, (x, y) -> (BETA * x, y), which equals
+multiplication by LAMBDA. It is used to split one 256 bit scalar multiplication into two 128 bit
+ones that share their doublings (the GLV method, see :func:`glv_split`).
+
+Multiples of the generator use a precomputed fixed-base table (see :class:`FixedBaseTable`) which
+is built lazily on first use and can be saved to disk and memory-mapped back in.
+"""
+import mmap
+import os
+
+from blockchain.elliptic import wnaf
+from blockchain.fields import batch_inverse_mod
+
+P = 2**256 - 2**32 - 977
+N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+GX = 0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798
+GY = 0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8
+
+# cube roots of unity mod P and mod N with LAMBDA * (x, y) == (BETA * x, y)
+BETA = 0x7ae96a2b657c07106e64479eac3434e99cf0497512f58995c1396c28719501ee
+LAMBDA = 0x5363ad4cc05c30e0a5261c028812645a122e22ea20816678df02967c1b23bd72
+
+# short basis of the lattice {(a, b): a + b * LAMBDA = 0 mod N} used by glv_split
+GLV_A1 = 0x3086d221a7d46bcde86c90e49284eb15
+GLV_B1 = -0xe4437ed6010e88286f547fa90abfe4c3
+GLV_A2 = 0x114ca50f7a8e2f3f657c1108d9d44cfd8
+GLV_B2 = GLV_A1
+
+INFINITY = (0, 1, 0)
+
+
+def is_on_curve(x, y):
+    """ Check y^2 = x^3 + 7 for affine coordinates in [0, P) """
+    return (y * y - x * x * x - 7) % P == 0
+
+
+def decompress(x, is_even):
+    """
+    The y coordinate of the point with the given x coordinate and parity of y
+
+    Raises
+    ------
+    ValueError
+        If no point on the curve has this x coordinate
+    """
+    if not 0 <= x < P:
+        raise ValueError(f'x={x} is not in field range 0 to {P - 1}')
+
+    alpha = (x * x * x + 7) % P
+    # P = 3 mod 4, so a square root is a single exponentiation
+    beta = pow(alpha, (P + 1) // 4, P)
+
+    if beta * beta % P != alpha:
+        raise ValueError(f'no point on the curve with x={x:x}')
+
+    if (beta & 1) == is_even:
+        beta = P - beta
+
+    return beta
+
+
+def to_jacobian(x, y):
+    """ Affine coordinates to Jacobian coordinates """
+    return x, y, 1
+
+
+def from_jacobian(point):
+    """
+    Jacobian coordinates to affine coordinates
+
+    Returns
+    -------
+    tuple
+        (x, y) as integers, or None for the point at infinity
+    """
+    x, y, z = point
+
+    if z == 0:
+        return None
+
+    z_inv = pow(z, -1, P)
+    z_inv2 = z_inv * z_inv % P
+    return x * z_inv2 % P, y * z_inv2 * z_inv % P
+
+
+def jacobian_double(point):
+    """ Double a point in Jacobian coordinates (dbl-2009-l, for a = 0) """
+    x1, y1, z1 = point
+
+    if z1 == 0 or y1 == 0:
+        return INFINITY
+
+    a = x1 * x1 % P
+    b = y1 * y1 % P
+    c = b * b % P
+    d = 2 * ((x1 + b) ** 2 - a - c) % P
+    e = 3 * a % P
+    f = e * e % P
+    x3 = (f - 2 * d) % P
+    y3 = (e * (d - x3) - 8 * c) % P
+    z3 = 2 * y1 * z1 % P
+
+    return x3, y3, z3
+
+
+def jacobian_add(p1, p2):
+    """ Add two points in Jacobian coordinates """
+    x1, y1, z1 = p1
+    x2, y2, z2 = p2
+
+    if z1 == 0:
+        return p2
+
+    if z2 == 0:
+        return p1
+
+    z1z1 = z1 * z1 % P
+    z2z2 = z2 * z2 % P
+    u1 = x1 * z2z2 % P
+    u2 = x2 * z1z1 % P
+    s1 = y1 * z2 * z2z2 % P
+    s2 = y2 * z1 * z1z1 % P
+
+    h = (u2 - u1) % P
+    r = (s2 - s1) % P
+
+    if h == 0:
+        if r == 0:
+            return jacobian_double(p1)
+        # additive inverses
+        return INFINITY
+
+    h2 = h * h % P
+    h3 = h * h2 % P
+    u1h2 = u1 * h2 % P
+
+    x3 = (r * r - h3 - 2 * u1h2) % P
+    y3 = (r * (u1h2 - x3) - s1 * h3) % P
+    z3 = h * z1 * z2 % P
+
+    return x3, y3, z3
+
+
+def jacobian_add_affine(point, x2, y2):
+    """ Add an affine point (x2, y2) to a point in Jacobian coordinates (mixed addition) """
+    x1, y1, z1 = point
+
+    if z1 == 0:
+        return x2, y2, 1
+
+    z1z1 = z1 * z1 % P
+    u2 = x2 * z1z1 % P
+    s2 = y2 * z1 * z1z1 % P
+
+    h = (u2 - x1) % P
+    r = (s2 - y1) % P
+
+    if h == 0:
+        if r == 0:
+            return jacobian_double(point)
+        return INFINITY
+
+    h2 = h * h % P
+    h3 = h * h2 % P
+    u1h2 = x1 * h2 % P
+
+    x3 = (r * r - h3 - 2 * u1h2) % P
+    y3 = (r * (u1h2 - x3) - y1 * h3) % P
+    z3 = h * z1 % P
+
+    return x3, y3, z3
+
+
+def batch_from_jacobian(points):
+    """
+    Convert many points to affine coordinates with a single modular inversion
+
+    Returns
+    -------
+    list
+        (x, y) tuples, with None for points at infinity
+    """
+    z_invs = batch_inverse_mod([z for _, _, z in points], P)
+    result = []
+
+    for (x, y, z), z_inv in zip(points, z_invs):
+        if z == 0:
+            result.append(None)
+        else:
+            z_inv2 = z_inv * z_inv % P
+            result.append((x * z_inv2 % P, y * z_inv2 * z_inv % P))
+
+    return result
+
+
+def jacobian_multiply(point, coefficient):
+    """
+    Scalar multiplication in Jacobian coordinates using double-and-add
+
+    Parameters
+    ----------
+    point: tuple
+        Point in Jacobian coordinates
+    coefficient: int
+        Non-negative scalar
+
+    Returns
+    -------
+    tuple
+        Point in Jacobian coordinates
+    """
+    result = INFINITY
+    current = point
+
+    while coefficient:
+        if coefficient & 1:
+            result = jacobian_add(result, current)
+        current = jacobian_double(current)
+        coefficient >>= 1
+
+    return result
+
+
+def odd_multiples(x, y, width):
+    """
+    Affine coordinates of P, 3P, 5P, ..., (2^(width - 1) - 1)P for the affine point P = (x, y)
+
+    The multiples are computed in Jacobian coordinates and normalized with a single inversion.
+    """
+    return batch_odd_multiples([(x, y)], width)[0]
+
+
+def batch_odd_multiples(points, width):
+    """ :func:`odd_multiples` for many affine points, sharing a single inversion """
+    size = 1 << (width - 2)
+    jacobian_points = []
+
+    for x, y in points:
+        base = to_jacobian(x, y)
+        double = jacobian_double(base)
+        jacobian_points.append(base)
+        for _ in range(size - 1):
+            jacobian_points.append(jacobian_add(jacobian_points[-1], double))
+
+    affine = batch_from_jacobian(jacobian_points)
+    return [affine[i:i + size] for i in range(0, len(affine), size)]
+
+
+def glv_split(coefficient):
+    """
+    Split a scalar k into k1 + k2 * LAMBDA (mod N) with k1 and k2 of about 128 bits each
+
+    Parameters
+    ----------
+    coefficient: int
+        Scalar in [0, N)
+
+    Returns
+    -------
+    tuple
+        (k1, k2), either of which may be negative
+    """
+    half = N >> 1
+    c1 = (GLV_B2 * coefficient + half) // N
+    c2 = (-GLV_B1 * coefficient + half) // N
+
+    k1 = coefficient - c1 * GLV_A1 - c2 * GLV_A2
+    k2 = -c1 * GLV_B1 - c2 * GLV_B2
+
+    return k1, k2
+
+
+def endomorphism_table(table):
+    """ Odd multiples of LAMBDA * P from the odd multiples of P, via the endomorphism """
+    return [(BETA * x % P, y) for x, y in table]
+
+
+def glv_terms(table, coefficient, width):
+    """ The two :func:`wnaf_multiply_many` terms equivalent to (table, coefficient, width) """
+    k1, k2 = glv_split(coefficient)
+    return [(table, k1, width), (endomorphism_table(table), k2, width)]
+
+
+def wnaf_multiply(table, coefficient, width):
+    """
+    Scalar multiplication using the width-w non-adjacent form of the coefficient
+
+    Parameters
+    ----------
+    table: list
+        Odd multiples of the point, as returned by :func:`odd_multiples` for the same width
+    coefficient: int
+        Non-negative scalar
+    width: int
+        Window width
+
+    Returns
+    -------
+    tuple
+        Point in Jacobian coordinates
+    """
+    return wnaf_multiply_many([(table, coefficient, width)])
+
+
+def wnaf_multiply_many(terms):
+    """
+    Compute a sum of scalar multiples k1 * P1 + k2 * P2 + ... (Strauss' method with wNAF)
+
+    All terms share a single chain of doublings; at every position each term with a non-zero digit
+    adds the matching entry of its table of odd multiples, negated for negative digits.
+
+    Parameters
+    ----------
+    terms: list
+        (table, coefficient, width) tuples, where table holds the odd multiples of the point as
+        returned by :func:`odd_multiples` for that width. Coefficients may be negative.
+
+    Returns
+    -------
+    tuple
+        Point in Jacobian coordinates
+    """
+    expansions = []
+    for table, coefficient, width in terms:
+        if coefficient < 0:
+            expansions.append((table, [-digit for digit in wnaf(-coefficient, width)]))
+        else:
+            expansions.append((table, wnaf(coefficient, width)))
+
+    result = INFINITY
+
+    for i in range(max(len(digits) for _, digits in expansions) - 1, -1, -1):
+        result = jacobian_double(result)
+
+        for table, digits in expansions:
+            if i < len(digits):
+                digit = digits[i]
+                if digit > 0:
+                    x, y = table[digit >> 1]
+                    result = jacobian_add_affine(result, x, y)
+                elif digit < 0:
+                    x, y = table[-digit >> 1]
+                    result = jacobian_add_affine(result, x, P - y)
+
+    return result
+
+
+def jacobian_x_equals(point, x):
+    """ Check whether the affine x coordinate of a Jacobian point equals x, without inverting """
+    x1, _, z1 = point
+
+    if z1 == 0:
+        return False
+
+    return x1 == x * z1 * z1 % P
+
+
+class FixedBaseTable:
+    """
+    Precomputed multiples of a fixed point for fast scalar multiplication
+
+    The scalar is split into windows of ``window`` bits. For every window position i the table
+    holds the affine points j * 2^(window * i) * base for j = 1 .. 2^window - 1, so a multiplication
+    is one mixed addition per non-zero window and no doublings at all.
+
+    The table is stored as consecutive 64 byte entries (x and y, 32 bytes each, big endian) after
+    a small header, which is also the on-disk format used by :meth:`save` and :meth:`load`.
+
+    Parameters
+    ----------
+    entries: list or buffer
+        Either a list of (x, y) tuples or a buffer in the on-disk format
+    window: int
+        Window width in bits
+    """
+    MAGIC = b'BCFB'
+    HEADER_SIZE = 8
+    ENTRY_SIZE = 64
+
+    def __init__(self, entries, window):
+        self.window = window
+        self.rows = -(-256 // window)
+        self.columns = (1 << window) - 1
+
+        if isinstance(entries, list):
+            self._points = entries
+            self._buffer = None
+        else:
+            self._points = None
+            self._buffer = entries
+
+    @classmethod
+    def build(cls, x, y, window=8):
+        """ Compute the table for the affine base point (x, y) """
+        rows = -(-256 // window)
+        columns = (1 << window) - 1
+
+        points = []
+        base = to_jacobian(x, y)
+
+        for _ in range(rows):
+            current = base
+            for _ in range(columns):
+                points.append(current)
+                current = jacobian_add(current, base)
+            # current is now 2^window * base
+            base = current
+
+        return cls(batch_from_jacobian(points), window)
+
+    @classmethod
+    def load(cls, path):
+        """ Memory-map a table previously written with :meth:`save` """
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if buffer[:4] != cls.MAGIC:
+            buffer.close()
+            raise ValueError(f'{path} is not a fixed-base table')
+
+        window = buffer[4]
+        table = cls(buffer, window)
+
+        if len(buffer) != cls.HEADER_SIZE + table.rows * table.columns * cls.ENTRY_SIZE:
+            buffer.close()
+            raise ValueError(f'{path} has the wrong size for window {window}')
+
+        return table
+
+    def save(self, path):
+        """ Write the table to disk """
+        tmp_path = f'{path}.tmp'
+
+        with open(tmp_path, 'wb') as f:
+            f.write(self.MAGIC + bytes([self.window]) + bytes(3))
+            for i in range(self.rows * self.columns):
+                x, y = self.entry(i)
+                f.write(x.to_bytes(32, 'big') + y.to_bytes(32, 'big'))
+
+        os.replace(tmp_path, path)
+
+    def entry(self, index):
+        """ Affine coordinates of entry ``index`` (row * columns + digit - 1) """
+        if self._points is not None:
+            return self._points[index]
+
+        offset = self.HEADER_SIZE + index * self.ENTRY_SIZE
+        buffer = self._buffer
+        return (int.from_bytes(buffer[offset:offset + 32], 'big'),
+                int.from_bytes(buffer[offset + 32:offset + 64], 'big'))
+
+    def multiply(self, coefficient):
+        """
+        Multiply the base point by a scalar in [0, 2^256)
+
+        Returns
+        -------
+        tuple
+            Point in Jacobian coordinates
+        """
+        window = self.window
+        mask = self.columns
+        columns = self.columns
+        entry = self.entry
+
+        result = INFINITY
+        offset = -1
+
+        while coefficient:
+            digit = coefficient & mask
+            if digit:
+                x, y = entry(offset + digit)
+                result = jacobian_add_affine(result, x, y)
+            coefficient >>= window
+            offset += columns
+
+        return result
+
+
+_generator_table = None
+_generator_odd_multiples = None
+_generator_endomorphism_odd_multiples = None
+
+# window width for G when it is one of several terms in wnaf_multiply_many
+GENERATOR_WNAF_WIDTH = 8
+
+
+def generator_table():
+    """ The fixed-base table for G, built on first use """
+    global _generator_table
+
+    if _generator_table is None:
+        _generator_table = FixedBaseTable.build(GX, GY)
+
+    return _generator_table
+
+
+def generator_odd_multiples():
+    """ Odd multiples of G for a window of GENERATOR_WNAF_WIDTH, computed on first use """
+    global _generator_odd_multiples
+
+    if _generator_odd_multiples is None:
+        _generator_odd_multiples = odd_multiples(GX, GY, GENERATOR_WNAF_WIDTH)
+
+    return _generator_odd_multiples
+
+
+def generator_endomorphism_odd_multiples():
+    """ :func:`generator_odd_multiples` of LAMBDA * G, computed on first use """
+    global _generator_endomorphism_odd_multiples
+
+    if _generator_endomorphism_odd_multiples is None:
+        _generator_endomorphism_odd_multiples = endomorphism_table(generator_odd_multiples())
+
+    return _generator_endomorphism_odd_multiples
+
+
+def use_generator_table(path, window=8):
+    """
+    Use a persistent fixed-base table for G
+
+    The table at ``path`` is memory-mapped if it exists, otherwise it is built and saved there
+    first so that later processes can skip the precomputation.
+    """
+    global _generator_table
+
+    if not os.path.exists(path):
+        FixedBaseTable.build(GX, GY, window=window).save(path)
+
+    _generator_table = FixedBaseTable.load(path)
+    return _generator_table
+
+
+def generator_multiply(coefficient):
+    """ Multiply G by a scalar in [0, 2^256) using the fixed-base table """
+    return generator_table().multiply(coefficient)
@@ -0,0 +1,197 @@
+"""
+Signature hashes
+
+The signature hash, or z, of an input is the hash that its signature signs. Legacy inputs sign a
+modified copy of the whole transaction, so the work per input grows with the size of the
+transaction. Segwit v0 inputs sign a digest defined in BIP143, made of hashes of the outpoints, the
+sequences and the outputs that are the same for every input of a transaction, which are computed
+once here.
+"""
+import hashlib
+
+from blockchain.etc import int_to_little_endian, encode_varint, hash256
+
+SIGHASH_ALL = 1
+SIGHASH_NONE = 2
+SIGHASH_SINGLE = 3
+SIGHASH_ANYONECANPAY = 0x80
+
+_ZERO_HASH = bytes(32)
+# SIGHASH_SINGLE legacy inputs without a matching output sign this value
+_SINGLE_BUG = 1
+
+
+class SigHasher:
+    """
+    Signature hashes of the inputs of one transaction
+
+    The parts of the digests that do not depend on the input are computed once, when first needed,
+    from the transaction as it is when the hasher is created. Script sigs and witnesses are not part
+    of any signature hash, so inputs can be signed one after the other with the same hasher, but a
+    new one is needed if anything else in the transaction changes, see
+    :meth:`blockchain.transactions.Transaction.sig_hasher`.
+
+    Parameters
+    ----------
+    tx: :obj:`blockchain.transactions.Transaction`
+    """
+    def __init__(self, tx):
+        self.version = int_to_little_endian(tx.version, 4)
+        self.locktime = int_to_little_endian(tx.locktime, 4)
+
+        self.outpoints = [tx_in.prev_tx[::-1] + int_to_little_endian(tx_in.prev_index, 4)
+                          for tx_in in tx.tx_ins]
+        self.sequences = [int_to_little_endian(tx_in.sequence, 4) for tx_in in tx.tx_ins]
+        self.outputs = [tx_out.serialize() for tx_out in tx.tx_outs]
+
+        self._legacy = None
+        self._hash_prevouts = None
+        self._hash_sequence = None
+        self._hash_outputs = None
+        self._midstates = {}
+
+    def sig_hash(self, input_index, script_code, amount=None, hash_type=SIGHASH_ALL,
+                 witness_v0=False) -> int:
+        """
+        Signature hash of an input
+
+        Parameters
+        ----------
+        input_index: int
+        script_code: :obj:`blockchain.script.Script`
+            Script the input is checked against: the script pubkey it spends, the redeem script of
+            a P2SH input, or the P2PKH script of the key hash of a P2WPKH input
+        amount: int
+            Amount of the spent output, required for segwit inputs
+        hash_type: int
+        witness_v0: bool
+            Compute the BIP143 digest of a segwit v0 input instead of the legacy one
+
+        Returns
+        -------
+        int
+        """
+        if witness_v0:
+            if amount is None:
+                raise ValueError('the signature hash of a segwit input needs the amount spent')
+            return self.segwit_v0(input_index, script_code, amount, hash_type)
+
+        return self.legacy(input_index, script_code, hash_type)
+
+    def legacy(self, input_index, script_code, hash_type=SIGHASH_ALL) -> int:
+        """ Signature hash of a pre-segwit input """
+        count = len(self.outpoints)
+        if not 0 <= input_index < count:
+            raise IndexError('input index out of range')
+
+        base_type = hash_type & 0x1f
+        anyone_can_pay = hash_type & SIGHASH_ANYONECANPAY
+
+        if base_type == SIGHASH_SINGLE and input_index >= len(self.outputs):
+            return _SINGLE_BUG
+
+        current = b''.join([self.outpoints[input_index], script_code.serialize(),
+                            self.sequences[input_index]])
+        trailer = self.locktime + int_to_little_endian(hash_type, 4)
+
+        if base_type not in (SIGHASH_NONE, SIGHASH_SINGLE) and not anyone_can_pay:
+            # the other inputs, with empty script sigs, and the outputs are the same for every
+            # input, only the input being signed is hashed in between
+            if self._legacy is None:
+                blanks = [outpoint + b'\x00' + sequence
+                          for outpoint, sequence in zip(self.outpoints, self.sequences)]
+                outputs = b''.join([encode_varint(len(self.outputs))] + self.outputs)
+                self._legacy = (b''.join(blanks), len(blanks[0]), outputs)
+
+            blanks, size, outputs = self._legacy
+
+            h = hashlib.sha256(self.version + encode_varint(count))
+            with memoryview(blanks) as view:
+                h.update(view[:input_index * size])
+                h.update(current)
+                h.update(view[(input_index + 1) * size:])
+            h.update(outputs)
+            h.update(trailer)
+            return int.from_bytes(hashlib.sha256(h.digest()).digest(), 'big')
+
+        parts = [self.version]
+
+        if anyone_can_pay:
+            parts.append(encode_varint(1))
+            parts.append(current)
+        else:
+            parts.append(encode_varint(count))
+            for index, (outpoint, sequence) in enumerate(zip(self.outpoints, self.sequences)):
+                if index == input_index:
+                    parts.append(current)
+                else:
+                    # the other inputs can be updated without invalidating the signature
+                    parts.append(outpoint + b'\x00' + (sequence if base_type == SIGHASH_ALL
+                                                       else bytes(4)))
+
+        if base_type == SIGHASH_NONE:
+            parts.append(encode_varint(0))
+        elif base_type == SIGHASH_SINGLE:
+            # earlier outputs are blanked: amount -1 and empty script
+            parts.append(encode_varint(input_index + 1))
+            parts.extend([b'\xff' * 8 + b'\x00'] * input_index)
+            parts.append(self.outputs[input_index])
+        else:
+            parts.append(encode_varint(len(self.outputs)))
+            parts.extend(self.outputs)
+
+        parts.append(trailer)
+        return int.from_bytes(hash256(b''.join(parts)), 'big')
+
+    def hash_prevouts(self) -> bytes:
+        if self._hash_prevouts is None:
+            self._hash_prevouts = hash256(b''.join(self.outpoints))
+        return self._hash_prevouts
+
+    def hash_sequence(self) -> bytes:
+        if self._hash_sequence is None:
+            self._hash_sequence = hash256(b''.join(self.sequences))
+        return self._hash_sequence
+
+    def hash_outputs(self) -> bytes:
+        if self._hash_outputs is None:
+            self._hash_outputs = hash256(b''.join(self.outputs))
+        return self._hash_outputs
+
+    def _midstate(self, hash_type):
+        """ sha256 state after the fields that are the same for all inputs signed the same way """
+        base_type = hash_type & 0x1f
+        anyone_can_pay = bool(hash_type & SIGHASH_ANYONECANPAY)
+        key = (anyone_can_pay, base_type in (SIGHASH_NONE, SIGHASH_SINGLE))
+
+        midstate = self._midstates.get(key)
+        if midstate is None:
+            hash_prevouts = _ZERO_HASH if anyone_can_pay else self.hash_prevouts()
+            hash_sequence = _ZERO_HASH if any(key) else self.hash_sequence()
+            midstate = self._midstates[key] = hashlib.sha256(
+                self.version + hash_prevouts + hash_sequence)
+
+        return midstate
+
+    def segwit_v0(self, input_index, script_code, amount, hash_type=SIGHASH_ALL) -> int:
+        """ Signature hash of a segwit v0 input, as defined in BIP143 """
+        if not 0 <= input_index < len(self.outpoints):
+            raise IndexError('input index out of range')
+
+        base_type = hash_type & 0x1f
+        if base_type not in (SIGHASH_NONE, SIGHASH_SINGLE):
+            hash_outputs = self.hash_outputs()
+        elif base_type == SIGHASH_SINGLE and input_index < len(self.outputs):
+            hash_outputs = hash256(self.outputs[input_index])
+        else:
+            hash_outputs = _ZERO_HASH
+
+        h = self._midstate(hash_type).copy()
+        h.update(self.outpoints[input_index])
+        h.update(script_code.serialize())
+        h.update(int_to_little_endian(amount, 8))
+        h.update(self.sequences[input_index])
+        h.update(hash_outputs)
+        h.update(self.locktime)
+        h.update(int_to_little_endian(hash_type, 4))
+        return int.from_bytes(hashlib.sha256(h.digest()).digest(), 'big')
@@ -0,0 +1,140 @@
+"""
+Storage of raw transactions
+
+Stores map the 32 byte hash of a transaction, in internal byte order, to its serialization. They
+are used by :obj:`blockchain.transactions.TransactionFetcher` to keep fetched transactions across
+restarts.
+"""
+import mmap
+import os
+import struct
+from abc import ABC, abstractmethod
+
+# txid, offset of the transaction in the data file, length of the transaction
+_INDEX_ENTRY = struct.Struct('<32sQI')
+
+
+class TransactionStore(ABC):
+    """ Interface of the transaction stores """
+    @abstractmethod
+    def get(self, tx_hash: bytes):
+        """ Serialization of a transaction, or None if it is not stored """
+
+    @abstractmethod
+    def put(self, tx_hash: bytes, raw: bytes):
+        """ Store the serialization of a transaction """
+
+    def __contains__(self, tx_hash):
+        return self.get(tx_hash) is not None
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MemoryStore(TransactionStore):
+    """ Store keeping the transactions in a dict, mostly for tests """
+    def __init__(self):
+        self._data = {}
+
+    def get(self, tx_hash):
+        return self._data.get(tx_hash)
+
+    def put(self, tx_hash, raw):
+        self._data[tx_hash] = bytes(raw)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileStore(TransactionStore):
+    """
+    Append-only store of transactions in a directory
+
+    Transactions are appended to ``transactions.dat``, and for every one of them an entry with its
+    hash, offset and length is appended to ``transactions.idx``. The index is memory-mapped and
+    loaded into a dict when the store is opened, after which a lookup is a dict access and a single
+    positioned read of the data file.
+
+    Entries are only written to the index once the transaction is in the data file, so an
+    interrupted write leaves at most an unreferenced tail in the data file and a partial entry at
+    the end of the index, which is dropped on the next open.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the store, created if it does not exist
+    """
+    DATA_FILE = 'transactions.dat'
+    INDEX_FILE = 'transactions.idx'
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._data = open(os.path.join(path, self.DATA_FILE), 'ab+')
+        self._index_file = open(os.path.join(path, self.INDEX_FILE), 'ab+')
+        self._index = self._load_index()
+
+    def _load_index(self):
+        fd = self._index_file.fileno()
+        size = os.fstat(fd).st_size
+        data_size = os.fstat(self._data.fileno()).st_size
+
+        # drop an entry cut short by an interrupted write
+        complete = size - size % _INDEX_ENTRY.size
+        if complete != size:
+            self._index_file.truncate(complete)
+
+        index = {}
+        if complete == 0:
+            return index
+
+        with mmap.mmap(fd, complete, access=mmap.ACCESS_READ) as mm:
+            for tx_hash, offset, length in _INDEX_ENTRY.iter_unpack(mm):
+                if offset + length <= data_size:
+                    index[tx_hash] = (offset, length)
+
+        return index
+
+    def get(self, tx_hash):
+        entry = self._index.get(tx_hash)
+        if entry is None:
+            return None
+
+        offset, length = entry
+        return os.pread(self._data.fileno(), length, offset)
+
+    def put(self, tx_hash, raw):
+        if tx_hash in self._index:
+            return
+
+        self._data.seek(0, os.SEEK_END)
+        offset = self._data.tell()
+        self._data.write(raw)
+        self._data.flush()
+
+        self._index_file.write(_INDEX_ENTRY.pack(tx_hash, offset, len(raw)))
+        self._index_file.flush()
+        self._index[tx_hash] = (offset, len(raw))
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def close(self):
+        self._data.close()
+        self._index_file.close()
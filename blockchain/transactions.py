@@ -1,8 +1,16 @@
+import hashlib
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from blockchain.etc import (little_endian_to_int, hash256, read_varint, encode_varint,
-                            int_to_little_endian)
-from blockchain.script import Script
+                            int_to_little_endian, as_stream, BytesReader, LRUCache)
+from blockchain.script import Script, LazyScript
+from blockchain.sighash import SigHasher, SIGHASH_ALL
 
 
 class FetchError(Exception):
@@ -14,20 +22,34 @@ class Transaction:
     Transaction structure
     ---------------------
     - version (4 bytes)
+    - segwit marker and flag (2 bytes, 00 01, segwit only)
     - inputs
         - number of inputs (varint)
         - inputs
     - outputs
         - number of outputs (varint)
         - outputs
+    - witnesses, one per input (segwit only)
+        - number of items (varint)
+        - items, each prefixed by its length (varint)
     - locktime
+
+    The id of a transaction is the hash of its serialization without the segwit marker, flag and
+    witnesses, see :meth:`hash` and :meth:`whash`.
     """
-    def __init__(self, version, tx_ins, tx_outs, locktime, testnet=False):
+    def __init__(self, version, tx_ins, tx_outs, locktime, testnet=False, segwit=False):
         self.version = version
         self.tx_ins = tx_ins
         self.tx_outs = tx_outs
         self.locktime = locktime
         self.testnet = testnet
+        self.segwit = segwit
+
+        # (state, serialization, offset of the witnesses or None) and (serialization, hash) from
+        # the last time they were computed
+        self._serialization = None
+        self._hash = None
+        self._sig_hasher = None
 
     def __repr__(self):
         inputs = '\n'.join(repr(tx_in) for tx_in in self.tx_ins)
@@ -46,15 +68,67 @@ class Transaction:
         return self.hash().hex()
 
     def hash(self):
-        """ Binary hash of the serialization """
+        """ Binary hash of the serialization without witnesses """
+        serialization = self.serialize()
+        cached = self._hash
+
+        # the serialization is only the same object while the transaction is unchanged
+        if cached is None or cached[0] is not serialization:
+            witness_start = self._serialization[2]
+
+            if witness_start is None:
+                digest = hash256(serialization)
+            else:
+                # hash the parts around the marker, flag and witnesses instead of copying them out
+                with memoryview(serialization) as view:
+                    inner = hashlib.sha256(view[:4])
+                    inner.update(view[6:witness_start])
+                    inner.update(view[-4:])
+                digest = hashlib.sha256(inner.digest()).digest()
+
+            cached = self._hash = (serialization, digest[::-1])
+
+        return cached[1]
+
+    def wtxid(self):
+        """ Human-readable hexadecimal of the hash of the serialization with witnesses """
+        return self.whash().hex()
+
+    def whash(self):
+        """ Binary hash of the serialization with witnesses """
         return hash256(self.serialize())[::-1]
 
     @classmethod
     def parse(cls, s, testnet=False):
+        """
+        Parse a transaction
+
+        Parameters
+        ----------
+        s: stream or bytes-like
+            A binary stream, or bytes, bytearray or memoryview. Buffers are parsed in place through
+            a :obj:`blockchain.etc.BytesReader` instead of being copied a few bytes at a time.
+        testnet: bool
+        """
+        s = as_stream(s)
+
+        if isinstance(s, BytesReader):
+            return cls._parse_buffer(s, testnet)
+
         version = little_endian_to_int(s.read(4))
 
+        # a segwit marker where the number of inputs would be
+        num_inputs = s.read(1)[0]
+        segwit = num_inputs == 0
+        if segwit:
+            if s.read(1) != b'\x01':
+                raise SyntaxError('bad segwit flag')
+            num_inputs = read_varint(s)
+        elif num_inputs >= 0xfd:
+            # rest of a varint: 0xfd, 0xfe and 0xff are followed by 2, 4 and 8 bytes
+            num_inputs = little_endian_to_int(s.read(2 ** (num_inputs - 0xfc)))
+
         # parse inputs
-        num_inputs = read_varint(s)
         inputs = []
 
         for _ in range(num_inputs):
@@ -67,30 +141,162 @@ class Transaction:
         for _ in range(num_outputs):
             outputs.append(TransactionOutput.parse(s))
 
-        locktime = little_endian_to_int(s.read(4))
+        if segwit:
+            for tx_in in inputs:
+                tx_in.witness = [s.read(read_varint(s)) for _ in range(read_varint(s))]
 
-        return cls(version, inputs, outputs, locktime, testnet)
+        locktime = little_endian_to_int(s.read(4))
 
-    def serialize(self):
-        result = int_to_little_endian(self.version, 4)
+        return cls(version, inputs, outputs, locktime, testnet, segwit)
 
-        result += encode_varint(len(self.tx_ins))
+    @classmethod
+    def _parse_buffer(cls, reader, testnet=False):
+        """ :meth:`parse` decoding fields in place from a :obj:`BytesReader` """
+        start = reader.offset
+        version = reader.read_uint32()
+
+        segwit = reader.buffer[reader.offset] == 0
+        if segwit:
+            if reader.buffer[reader.offset + 1] != 1:
+                raise SyntaxError('bad segwit flag')
+            reader.offset += 2
+
+        inputs = [TransactionInput._parse_buffer(reader) for _ in range(reader.read_varint())]
+        outputs = [TransactionOutput._parse_buffer(reader) for _ in range(reader.read_varint())]
+
+        witness_start = None
+        if segwit:
+            witness_start = reader.offset - start
+            for tx_in in inputs:
+                tx_in.witness = [reader.read_bytes(reader.read_varint())
+                                 for _ in range(reader.read_varint())]
+
+        locktime = reader.read_uint32()
+
+        tx = cls(version, inputs, outputs, locktime, testnet, segwit)
+        # keep the bytes the transaction was parsed from as its serialization
+        tx._serialization = (tx._state(), bytes(reader.data[start:reader.offset]), witness_start)
+        return tx
+
+    def _state(self):
+        """ Snapshot of everything the serialization depends on """
+        return (self.version, self.locktime, self.segwit,
+                tuple([tx_in._state() for tx_in in self.tx_ins]),
+                tuple([tx_out._state() for tx_out in self.tx_outs]))
+
+    def _parts(self, witness):
+        """ Pieces of the serialization, and the index of the first witness piece or None """
+        parts = [int_to_little_endian(self.version, 4)]
+
+        if witness:
+            parts.append(b'\x00\x01')
+
+        parts.append(encode_varint(len(self.tx_ins)))
         for tx_in in self.tx_ins:
-            result += tx_in.serialize()
+            tx_in._write(parts)
 
-        result += encode_varint(len(self.tx_outs))
+        parts.append(encode_varint(len(self.tx_outs)))
         for tx_out in self.tx_outs:
-            result += tx_out.serialize()
+            tx_out._write(parts)
+
+        witness_index = None
+        if witness:
+            witness_index = len(parts)
+            for tx_in in self.tx_ins:
+                tx_in._write_witness(parts)
 
-        result += int_to_little_endian(self.locktime, 4)
+        parts.append(int_to_little_endian(self.locktime, 4))
+        return parts, witness_index
 
-        return result
+    def serialize(self):
+        """
+        Serialization of the transaction, with witnesses if it is a segwit transaction
+
+        The result is cached, and only rebuilt when a field of the transaction, its inputs, outputs
+        or their scripts changed since the last call.
+        """
+        state = self._state()
+        cached = self._serialization
+
+        if cached is None or cached[0] != state:
+            parts, witness_index = self._parts(self.segwit)
+
+            witness_start = None
+            if witness_index is not None:
+                witness_start = sum(len(part) for part in parts[:witness_index])
+
+            cached = self._serialization = (state, b''.join(parts), witness_start)
+
+        return cached[1]
+
+    def serialize_legacy(self):
+        """ Serialization without the segwit marker, flag and witnesses """
+        if not self.segwit:
+            return self.serialize()
+        return b''.join(self._parts(False)[0])
+
+    def sig_hasher(self):
+        """
+        :obj:`blockchain.sighash.SigHasher` of the transaction
 
-    def fee(self):
+        The hasher, and the hashes it shares between inputs, are kept until something other than
+        the script sigs or witnesses of the transaction changes. The check is cheap enough to run
+        for every input: the inputs are compared by identity and assignments to their outpoints
+        and sequences are counted by :obj:`TransactionInput`, only the outputs, usually few, are
+        compared by value.
+        """
+        key = (self.version, self.locktime, TransactionInput._changes,
+               tuple([tx_out._state() for tx_out in self.tx_outs]))
+        cached = self._sig_hasher
+
+        if cached is None or cached[0] != key or cached[1] != self.tx_ins:
+            cached = self._sig_hasher = (key, list(self.tx_ins), SigHasher(self))
+
+        return cached[2]
+
+    def sig_hash(self, input_index, script_code, amount=None, hash_type=SIGHASH_ALL,
+                 witness_v0=False) -> int:
+        """
+        Signature hash (z) of an input, see :meth:`blockchain.sighash.SigHasher.sig_hash`
+
+        Parameters
+        ----------
+        input_index: int
+        script_code: :obj:`blockchain.script.Script`
+            Script the input is checked against: the script pubkey it spends, the redeem script of
+            a P2SH input, or the P2PKH script of the key hash of a P2WPKH input
+        amount: int
+            Amount of the spent output, required for segwit inputs
+        hash_type: int
+        witness_v0: bool
+            Compute the BIP143 digest of a segwit v0 input instead of the legacy one
+
+        Returns
+        -------
+        int
+        """
+        return self.sig_hasher().sig_hash(input_index, script_code, amount, hash_type, witness_v0)
+
+    def prefetch(self):
+        """ Fetch all the transactions spent by the inputs at once """
+        TransactionFetcher.fetch_many([tx_in.prev_tx.hex() for tx_in in self.tx_ins],
+                                      testnet=self.testnet)
+
+    def fee(self, utxo_set=None):
         """
         The transaction fee is the sum of the inputs minus the sum of the outputs
+
+        Parameters
+        ----------
+        utxo_set: :obj:`blockchain.utxo.UtxoSet`
+            Set to look up the values of the inputs in, instead of fetching the transactions they
+            spend
         """
-        input_sum = sum([tx_in.value(testnet=self.testnet) for tx_in in self.tx_ins])
+        if utxo_set is None:
+            self.prefetch()
+
+        input_sum = sum([tx_in.value(testnet=self.testnet, utxo_set=utxo_set)
+                         for tx_in in self.tx_ins])
         output_sum = sum([tx_out.amount for tx_out in self.tx_outs])
         return input_sum - output_sum
 
@@ -104,11 +310,17 @@ class TransactionInput:
     - scriptsig
     - sequence (4 bytes)
 
+    The witness of a segwit input is serialized with the transaction, after all the outputs.
+
     NOTE: Note that locktime is ignored if the sequence numbers for every input are ffffffff.
     """
-    def __init__(self, prev_tx, prev_index, script_sig=None, sequence=0xffffffff):
-        self.prev_tx = prev_tx
-        self.prev_index = prev_index
+    # number of assignments to the outpoint or sequence of any input, which tells a cached
+    # SigHasher that it may be stale without comparing every input, see Transaction.sig_hasher
+    _changes = 0
+
+    def __init__(self, prev_tx, prev_index, script_sig=None, sequence=0xffffffff, witness=None):
+        self._prev_tx = prev_tx
+        self._prev_index = prev_index
 
         if script_sig is None:
             self.script_sig = Script()
@@ -117,36 +329,98 @@ class TransactionInput:
         else:
             self.script_sig = script_sig
 
-        self.sequence = sequence
+        self._sequence = sequence
+        self.witness = [] if witness is None else witness
 
     def __repr__(self):
         return '{}:{}'.format(self.prev_tx.hex(), self.prev_index)
 
+    @property
+    def prev_tx(self):
+        return self._prev_tx
+
+    @prev_tx.setter
+    def prev_tx(self, prev_tx):
+        self._prev_tx = prev_tx
+        TransactionInput._changes += 1
+
+    @property
+    def prev_index(self):
+        return self._prev_index
+
+    @prev_index.setter
+    def prev_index(self, prev_index):
+        self._prev_index = prev_index
+        TransactionInput._changes += 1
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    @sequence.setter
+    def sequence(self, sequence):
+        self._sequence = sequence
+        TransactionInput._changes += 1
+
     @classmethod
     def parse(cls, s):
+        s = as_stream(s)
+
+        if isinstance(s, BytesReader):
+            return cls._parse_buffer(s)
+
         prev_tx = s.read(32)[::-1]
         prev_index = little_endian_to_int(s.read(4))
         script_sig = Script.parse(s)
         sequence = little_endian_to_int(s.read(4))
         return cls(prev_tx, prev_index, script_sig, sequence)
 
-    def serialize(self):
-        result = self.prev_tx[::-1]
-        result += int_to_little_endian(self.prev_index, 4)
-        result += self.script_sig.serialize()
-        result += int_to_little_endian(self.sequence, 4)
+    @classmethod
+    def _parse_buffer(cls, reader):
+        prev_tx = reader.read_bytes(32)[::-1]
+        prev_index = reader.read_uint32()
+        script_sig = Script._parse_buffer(reader)
+        sequence = reader.read_uint32()
+        return cls(prev_tx, prev_index, script_sig, sequence)
 
-        return result
+    def _state(self):
+        return (self.prev_tx, self.prev_index, self.sequence, self.script_sig._state(),
+                tuple(self.witness))
+
+    def _write(self, parts):
+        """ Append the pieces of the serialization to a list """
+        parts.append(self.prev_tx[::-1])
+        parts.append(int_to_little_endian(self.prev_index, 4))
+        parts.append(self.script_sig.serialize())
+        parts.append(int_to_little_endian(self.sequence, 4))
+
+    def _write_witness(self, parts):
+        """ Append the pieces of the serialization of the witness to a list """
+        parts.append(encode_varint(len(self.witness)))
+        for item in self.witness:
+            parts.append(encode_varint(len(item)))
+            parts.append(item)
+
+    def serialize(self):
+        parts = []
+        self._write(parts)
+        return b''.join(parts)
 
     def _fetch_tx(self, testnet=False):
         return TransactionFetcher.fetch(self.prev_tx.hex(), testnet=testnet)
 
-    def value(self, testnet=False) -> int:
+    def value(self, testnet=False, utxo_set=None) -> int:
         """ Value in bitcoins of transaction input """
+        if utxo_set is not None:
+            return utxo_set.value(self)
+
         tx = self._fetch_tx(testnet=testnet)
         return tx.tx_outs[self.prev_index].amount
 
-    def script_pubkey(self, testnet=False) -> Script:
+    def script_pubkey(self, testnet=False, utxo_set=None) -> Script:
+        if utxo_set is not None:
+            return utxo_set.script_pubkey(self)
+
         tx = self._fetch_tx(testnet=testnet)
         return tx.tx_outs[self.prev_index].script_pubkey
 
@@ -169,20 +443,319 @@ class TransactionOutput:
 
     @classmethod
     def parse(cls, s):
+        s = as_stream(s)
+
+        if isinstance(s, BytesReader):
+            return cls._parse_buffer(s)
+
         amount = little_endian_to_int(s.read(8))
         script_pubkey = Script.parse(s)
 
         return cls(amount, script_pubkey)
 
+    @classmethod
+    def _parse_buffer(cls, reader):
+        amount = reader.read_uint64()
+        script_pubkey = Script._parse_buffer(reader)
+
+        return cls(amount, script_pubkey)
+
+    def _state(self):
+        return self.amount, self.script_pubkey._state()
+
+    def _write(self, parts):
+        """ Append the pieces of the serialization to a list """
+        parts.append(int_to_little_endian(self.amount, 8))
+        parts.append(self.script_pubkey.serialize())
+
     def serialize(self):
-        result = int_to_little_endian(self.amount, 8)
-        result += self.script_pubkey.serialize()
+        parts = []
+        self._write(parts)
+        return b''.join(parts)
+
 
-        return result
+class LazyTransaction(Transaction):
+    """
+    Transaction that only decodes the parts that are accessed
+
+    Parsing walks over the raw bytes once, recording where every input and output starts.
+    ``tx_ins`` and ``tx_outs`` are decoded on first access, with :obj:`LazyScript` scripts whose
+    commands are in turn only decoded when they are accessed. The state of the inputs and outputs
+    is recorded when they are decoded: as long as they still match it, :meth:`serialize` and
+    :meth:`hash` use the original bytes, and when only the inputs or only the outputs changed, the
+    original bytes of the other half are reused without decoding it.
+    """
+    def __init__(self, raw, version, input_offsets, output_offsets, locktime, testnet=False,
+                 witness_offsets=None):
+        segwit = witness_offsets is not None
+        self._raw = raw
+        self._raw_header = (version, locktime, segwit)
+        self._input_offsets = input_offsets
+        self._output_offsets = output_offsets
+        self._witness_offsets = witness_offsets
+        self._tx_ins = None
+        self._tx_outs = None
+        # states of the inputs and outputs when they were decoded
+        self._parsed_ins = None
+        self._parsed_outs = None
+        self._raw_hash = None
+
+        # spans of the raw bytes holding the inputs and the outputs, with their counts, and the
+        # witnesses
+        inputs_start = 6 if segwit else 4
+        if segwit:
+            outputs_end = witness_offsets[0] if witness_offsets else len(raw) - 4
+        else:
+            outputs_end = len(raw) - 4
+        outputs_start = ((output_offsets[0] if output_offsets else outputs_end)
+                         - len(encode_varint(len(output_offsets))))
+        self._spans = ((inputs_start, outputs_start), (outputs_start, outputs_end),
+                       (outputs_end, len(raw) - 4))
+
+        super().__init__(version, None, None, locktime, testnet, segwit)
+
+    @classmethod
+    def parse(cls, s, testnet=False):
+        """
+        Parameters
+        ----------
+        s: bytes-like or :obj:`blockchain.etc.BytesReader`
+            Buffer holding the transaction. When given a memoryview, the transaction keeps a view of
+            it rather than a copy.
+        testnet: bool
+        """
+        s = as_stream(s)
+
+        if not isinstance(s, BytesReader):
+            raise TypeError('LazyTransaction can only be parsed from bytes-like objects')
+
+        start = s.offset
+        version = s.read_uint32()
+
+        segwit = s.buffer[s.offset] == 0
+        if segwit:
+            if s.buffer[s.offset + 1] != 1:
+                raise SyntaxError('bad segwit flag')
+            s.offset += 2
+
+        input_offsets = []
+        for _ in range(s.read_varint()):
+            input_offsets.append(s.offset - start)
+            # previous transaction and index
+            s.offset += 36
+            script_length = s.read_varint()
+            # script and sequence
+            s.offset += script_length + 4
+
+        output_offsets = []
+        for _ in range(s.read_varint()):
+            output_offsets.append(s.offset - start)
+            # amount
+            s.offset += 8
+            script_length = s.read_varint()
+            s.offset += script_length
+
+        witness_offsets = None
+        if segwit:
+            witness_offsets = []
+            for _ in input_offsets:
+                witness_offsets.append(s.offset - start)
+                for _ in range(s.read_varint()):
+                    item_length = s.read_varint()
+                    s.offset += item_length
+
+        locktime = s.read_uint32()
+
+        if s.offset > len(s.data):
+            raise SyntaxError('parsing transaction failed')
+
+        raw = s.data[start:s.offset]
+        return cls(raw, version, input_offsets, output_offsets, locktime, testnet, witness_offsets)
+
+    @property
+    def tx_ins(self):
+        if self._tx_ins is None:
+            witness_offsets = self._witness_offsets or [None] * len(self._input_offsets)
+            self._tx_ins = [self._parse_input(offset, witness_offset)
+                            for offset, witness_offset in zip(self._input_offsets, witness_offsets)]
+            self._parsed_ins = self._states(self._tx_ins)
+        return self._tx_ins
+
+    @tx_ins.setter
+    def tx_ins(self, tx_ins):
+        if tx_ins is not None:
+            self._tx_ins = tx_ins
+
+    @property
+    def tx_outs(self):
+        if self._tx_outs is None:
+            self._tx_outs = [self._parse_output(offset) for offset in self._output_offsets]
+            self._parsed_outs = self._states(self._tx_outs)
+        return self._tx_outs
+
+    @tx_outs.setter
+    def tx_outs(self, tx_outs):
+        if tx_outs is not None:
+            self._tx_outs = tx_outs
+
+    @staticmethod
+    def _states(parts):
+        return tuple([part._state() for part in parts])
+
+    def _parse_input(self, offset, witness_offset):
+        reader = BytesReader(self._raw, offset)
+        prev_tx = reader.read_bytes(32)[::-1]
+        prev_index = reader.read_uint32()
+        script_sig = LazyScript._parse_buffer(reader)
+        sequence = reader.read_uint32()
+
+        witness = None
+        if witness_offset is not None:
+            reader.seek(witness_offset)
+            witness = [reader.read_bytes(reader.read_varint()) for _ in range(reader.read_varint())]
+
+        return TransactionInput(prev_tx, prev_index, script_sig, sequence, witness)
+
+    def _parse_output(self, offset):
+        reader = BytesReader(self._raw, offset)
+        amount = reader.read_uint64()
+        script_pubkey = LazyScript._parse_buffer(reader)
+        return TransactionOutput(amount, script_pubkey)
+
+    def _ins_unchanged(self):
+        """ Whether the raw bytes of the inputs and witnesses still describe the inputs """
+        return self._tx_ins is None or self._states(self._tx_ins) == self._parsed_ins
+
+    def _outs_unchanged(self):
+        """ Whether the raw bytes of the outputs still describe the outputs """
+        return self._tx_outs is None or self._states(self._tx_outs) == self._parsed_outs
+
+    def _unchanged(self):
+        """ Whether the raw bytes still describe this transaction """
+        return ((self.version, self.locktime, self.segwit) == self._raw_header
+                and self._ins_unchanged() and self._outs_unchanged())
+
+    def _state(self):
+        # parts that were never decoded can't have changed
+        return (self.version, self.locktime, self.segwit,
+                None if self._tx_ins is None else self._states(self._tx_ins),
+                None if self._tx_outs is None else self._states(self._tx_outs))
+
+    def _parts(self, witness):
+        ins_unchanged = self._ins_unchanged()
+        outs_unchanged = self._outs_unchanged()
+
+        if not (ins_unchanged or outs_unchanged):
+            return super()._parts(witness)
+
+        (ins_start, ins_end), (outs_start, outs_end), (witness_start, witness_end) = self._spans
+        raw = self._raw
+        parts = [int_to_little_endian(self.version, 4)]
+
+        if witness:
+            parts.append(b'\x00\x01')
+
+        if ins_unchanged:
+            parts.append(bytes(raw[ins_start:ins_end]))
+        else:
+            parts.append(encode_varint(len(self._tx_ins)))
+            for tx_in in self._tx_ins:
+                tx_in._write(parts)
+
+        if outs_unchanged:
+            parts.append(bytes(raw[outs_start:outs_end]))
+        else:
+            parts.append(encode_varint(len(self._tx_outs)))
+            for tx_out in self._tx_outs:
+                tx_out._write(parts)
+
+        witness_index = None
+        if witness:
+            witness_index = len(parts)
+            if ins_unchanged and self._witness_offsets is not None:
+                parts.append(bytes(raw[witness_start:witness_end]))
+            else:
+                for tx_in in self.tx_ins:
+                    tx_in._write_witness(parts)
+
+        parts.append(int_to_little_endian(self.locktime, 4))
+        return parts, witness_index
+
+    def hash(self):
+        if self._unchanged():
+            if self._raw_hash is None:
+                if self.segwit:
+                    with memoryview(self._raw) as view:
+                        inner = hashlib.sha256(view[:4])
+                        inner.update(view[6:self._spans[2][0]])
+                        inner.update(view[-4:])
+                    self._raw_hash = hashlib.sha256(inner.digest()).digest()[::-1]
+                else:
+                    self._raw_hash = hash256(self._raw)[::-1]
+
+            return self._raw_hash
+        return super().hash()
+
+    def serialize(self):
+        if self._unchanged():
+            return bytes(self._raw)
+        return super().serialize()
 
 
 class TransactionFetcher:
-    cache = {}
+    """
+    Fetch transactions by id from a block explorer
+
+    Fetched transactions are kept in a bounded in-memory cache and, if :meth:`use_store` was
+    called, in a persistent :obj:`blockchain.store.TransactionStore`, so that lookups only go to
+    the network the first time a transaction is needed.
+
+    Requests share a pooled :obj:`requests.Session`. They time out after ``timeout`` seconds, and
+    connection errors and server errors are retried ``retries`` times.
+    """
+    cache = LRUCache(maxsize=4096)
+    store = None
+
+    session = None
+    _session_lock = threading.Lock()
+    timeout = 10
+    retries = 3
+    backoff_factor = 0.5
+    max_workers = 8
+
+    @classmethod
+    def use_store(cls, store):
+        """
+        Keep fetched transactions in a store, e.g. a :obj:`blockchain.store.FileStore`
+
+        Parameters
+        ----------
+        store: :obj:`blockchain.store.TransactionStore` or None
+            None stops using the current store.
+        """
+        cls.store = store
+
+    @classmethod
+    def get_session(cls):
+        """ The shared session, created on first use """
+        session = cls.session
+        if session is not None:
+            return session
+
+        # threads asking at once must not each create a session and its connection pools
+        with cls._session_lock:
+            if cls.session is None:
+                retry = Retry(total=cls.retries, backoff_factor=cls.backoff_factor,
+                              status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=cls.max_workers,
+                                      pool_maxsize=cls.max_workers, max_retries=retry)
+
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                cls.session = session
+
+            return cls.session
 
     @staticmethod
     def get_url(testnet=False):
@@ -192,27 +765,118 @@ class TransactionFetcher:
             return 'https://api.bitaps.com/btc/v1/blockchain'
 
     @classmethod
-    def fetch(cls, tx_id, testnet=False, fresh=False) -> Transaction:
-        if fresh or tx_id not in cls.cache:
-            url = '{base_url}/transaction/{tx_id}'.format(base_url=cls.get_url(testnet),
-                                                          tx_id=tx_id)
-            response = requests.get(url)
+    def _load(cls, tx_id, testnet=False):
+        """ Transaction from the store, or None """
+        if cls.store is None:
+            return None
 
-            if response.status_code != 200:
-                raise FetchError(response.text)
+        raw_tx = cls.store.get(bytes.fromhex(tx_id)[::-1])
+        if raw_tx is None:
+            return None
 
+        return Transaction.parse(raw_tx, testnet=testnet)
+
+    @classmethod
+    def _download(cls, tx_id, testnet=False):
+        """ Transaction from the network, safe to call from several threads """
+        url = '{base_url}/transaction/{tx_id}'.format(base_url=cls.get_url(testnet),
+                                                      tx_id=tx_id)
+        try:
+            response = cls.get_session().get(url, timeout=cls.timeout)
+        except requests.RequestException as e:
+            raise FetchError('fetching {} failed: {}'.format(tx_id, e)) from e
+
+        if response.status_code != 200:
+            raise FetchError(response.text)
+
+        try:
             raw_tx = bytes.fromhex(response.json()['data']['rawTx'].strip())
-            if raw_tx[4] == 0:
-                raw_tx = raw_tx[:4] + raw_tx[6:]
-                tx = Transaction.parse(raw_tx, testnet=testnet)
-                tx.locktime = little_endian_to_int(raw_tx[-4:])
+            tx = Transaction.parse(raw_tx, testnet=testnet)
+        except (ValueError, KeyError, TypeError, AttributeError, SyntaxError, IndexError,
+                struct.error) as e:
+            raise FetchError('bad response for {}: {!r}'.format(tx_id, e)) from e
+
+        if tx.id() != tx_id:
+            raise ValueError('Not the same id: {} vs {}'.format(tx_id, tx.id()))
+
+        return tx
+
+    @classmethod
+    def _remember(cls, tx_id, tx, downloaded):
+        if downloaded and cls.store is not None:
+            cls.store.put(tx.hash()[::-1], tx.serialize())
+
+        cls.cache.put(tx_id, tx)
+
+    @classmethod
+    def fetch(cls, tx_id, testnet=False, fresh=False) -> Transaction:
+        tx = None if fresh else cls.cache.get(tx_id)
+
+        if tx is None:
+            if not fresh:
+                tx = cls._load(tx_id, testnet)
+
+            downloaded = tx is None
+            if downloaded:
+                tx = cls._download(tx_id, testnet)
+
+            cls._remember(tx_id, tx, downloaded)
+
+        tx.testnet = testnet
+        return tx
+
+    @classmethod
+    def fetch_many(cls, tx_ids, testnet=False, fresh=False, max_workers=None) -> dict:
+        """
+        Fetch many transactions, downloading the missing ones concurrently
+
+        Parameters
+        ----------
+        tx_ids: iterable
+            Ids of the transactions, duplicates are only fetched once
+        testnet: bool
+        fresh: bool
+            Download all the transactions even if they are cached
+        max_workers: int
+            Maximum number of concurrent requests, ``max_workers`` of the class by default
+
+        Returns
+        -------
+        dict
+            Transactions by id
+        """
+        found = {}
+        missing = []
+
+        for tx_id in dict.fromkeys(tx_ids):
+            tx = None
+            if not fresh:
+                tx = cls.cache.get(tx_id)
+                if tx is None:
+                    tx = cls._load(tx_id, testnet)
+                    if tx is not None:
+                        cls._remember(tx_id, tx, False)
+
+            if tx is None:
+                missing.append(tx_id)
             else:
-                tx = Transaction.parse(raw_tx, testnet=testnet)
+                found[tx_id] = tx
+
+        if len(missing) == 1:
+            found[missing[0]] = cls._download(missing[0], testnet)
+
+        elif missing:
+            # the session is shared by the threads, it is created before they start
+            cls.get_session()
+            workers = min(max_workers or cls.max_workers, len(missing))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                downloads = executor.map(cls._download, missing, [testnet] * len(missing))
+                found.update(zip(missing, downloads))
 
-            if tx.id() != tx_id:
-                raise ValueError('Not the same id: {} vs {}'.format(tx_id, tx.id()))
+        for tx_id in missing:
+            cls._remember(tx_id, found[tx_id], True)
 
-            cls.cache[tx_id] = tx
+        for tx in found.values():
+            tx.testnet = testnet
 
-        cls.cache[tx_id].testnet = testnet
-        return cls.cache[tx_id]
+        return found
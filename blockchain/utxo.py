@@ -0,0 +1,193 @@
+"""
+Set of unspent transaction outputs
+
+Every unspent output is keyed by its outpoint, the 32 byte id of its transaction followed by its
+4 byte little endian index. The coin itself is packed into a single bytes object: its 8 byte little
+endian amount followed by its raw script pubkey. Looking up the value or script spent by an input
+is therefore a dict access, without fetching or parsing the transaction that created the output.
+
+Recently used and modified coins are kept in memory. Modified coins are tracked and written to a
+sqlite database in batches by :meth:`UtxoSet.flush`.
+"""
+import sqlite3
+import struct
+
+from blockchain.script import LazyScript
+
+_AMOUNT = struct.Struct('<Q')
+_INDEX = struct.Struct('<I')
+
+COINBASE_INDEX = 0xffffffff
+NULL_HASH = bytes(32)
+
+
+def outpoint(prev_tx: bytes, prev_index: int) -> bytes:
+    """ Key of an output """
+    return prev_tx + _INDEX.pack(prev_index)
+
+
+class UtxoSet:
+    """
+    Unspent transaction outputs, cached in memory in front of a sqlite database
+
+    Parameters
+    ----------
+    path: str
+        sqlite database file, None keeps the database in memory
+    cache_size: int
+        Number of coins kept in memory. When there are more, the modified coins are flushed to the
+        database and the memory cache is emptied.
+    """
+    def __init__(self, path=None, cache_size=100000):
+        self.cache_size = cache_size
+        self._db = sqlite3.connect(':memory:' if path is None else path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS utxos '
+                         '(outpoint BLOB PRIMARY KEY, coin BLOB NOT NULL) WITHOUT ROWID')
+
+        # outpoint -> packed coin, or None for a coin spent since the last flush
+        self._cache = {}
+        self._dirty = set()
+
+    def __contains__(self, key):
+        return self._get(key) is not None
+
+    def _get(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        row = self._db.execute('SELECT coin FROM utxos WHERE outpoint = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        coin = self._cache[key] = row[0]
+        return coin
+
+    def _set(self, key, coin):
+        self._cache[key] = coin
+        self._dirty.add(key)
+
+    def get(self, prev_tx: bytes, prev_index: int):
+        """
+        Unspent output
+
+        Returns
+        -------
+        tuple
+            (amount, raw script pubkey), or None if the output does not exist or is spent
+        """
+        coin = self._get(outpoint(prev_tx, prev_index))
+        if coin is None:
+            return None
+        return _AMOUNT.unpack_from(coin)[0], coin[_AMOUNT.size:]
+
+    def _coin(self, tx_in):
+        coin = self._get(outpoint(tx_in.prev_tx, tx_in.prev_index))
+        if coin is None:
+            raise KeyError('unknown or spent output {!r}'.format(tx_in))
+        return coin
+
+    def value(self, tx_in) -> int:
+        """ Amount of the output spent by a :obj:`TransactionInput` """
+        return _AMOUNT.unpack_from(self._coin(tx_in))[0]
+
+    def script_pubkey(self, tx_in) -> LazyScript:
+        """ Script pubkey of the output spent by a :obj:`TransactionInput` """
+        return LazyScript(self._coin(tx_in)[_AMOUNT.size:])
+
+    def apply(self, tx):
+        """
+        Spend the outputs used by the inputs of a transaction and add its outputs
+
+        The set is not modified if one of the inputs does not spend an unspent output.
+
+        Parameters
+        ----------
+        tx: :obj:`Transaction`
+
+        Returns
+        -------
+        list
+            Undo data, to pass to :meth:`undo`
+        """
+        spent = []
+
+        if not is_coinbase(tx):
+            keys = set()
+
+            for tx_in in tx.tx_ins:
+                key = outpoint(tx_in.prev_tx, tx_in.prev_index)
+                coin = self._get(key)
+
+                if coin is None or key in keys:
+                    raise KeyError('unknown or spent output {!r}'.format(tx_in))
+
+                keys.add(key)
+                spent.append((key, coin))
+
+        for key, _ in spent:
+            self._set(key, None)
+
+        tx_hash = tx.hash()
+        for index, tx_out in enumerate(tx.tx_outs):
+            raw_script = tx_out.script_pubkey.raw_serialize()
+
+            # OP_RETURN outputs can never be spent
+            if raw_script[:1] == b'\x6a':
+                continue
+
+            self._set(outpoint(tx_hash, index), _AMOUNT.pack(tx_out.amount) + raw_script)
+
+        if len(self._cache) > self.cache_size:
+            self.flush()
+
+        return spent
+
+    def undo(self, tx, spent):
+        """
+        Revert :meth:`apply`
+
+        Parameters
+        ----------
+        tx: :obj:`Transaction`
+        spent: list
+            Undo data returned by :meth:`apply`
+        """
+        tx_hash = tx.hash()
+        for index in range(len(tx.tx_outs)):
+            key = outpoint(tx_hash, index)
+            if self._get(key) is not None:
+                self._set(key, None)
+
+        for key, coin in spent:
+            self._set(key, coin)
+
+    def flush(self):
+        """ Write the modified coins to the database in one transaction and empty the cache """
+        cache = self._cache
+        added = [(key, cache[key]) for key in self._dirty if cache[key] is not None]
+        removed = [(key,) for key in self._dirty if cache[key] is None]
+
+        with self._db:
+            self._db.executemany('DELETE FROM utxos WHERE outpoint = ?', removed)
+            self._db.executemany('INSERT OR REPLACE INTO utxos VALUES (?, ?)', added)
+
+        self._dirty.clear()
+        cache.clear()
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_coinbase(tx) -> bool:
+    """ Whether a transaction is a coinbase, i.e. its only input spends no output """
+    return (len(tx.tx_ins) == 1 and tx.tx_ins[0].prev_tx == NULL_HASH
+            and tx.tx_ins[0].prev_index == COINBASE_INDEX)
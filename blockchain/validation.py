@@ -0,0 +1,176 @@
+"""
+Transaction validation
+
+Script evaluation is pure-Python big integer math and holds the GIL, so verifying many inputs is
+spread over a pool of processes. Inputs are evaluated in chunks and the results are merged back in
+input order, so the outcome never depends on scheduling.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+from blockchain.script import Script, LazyScript, script_type
+from blockchain.sighash import SIGHASH_ALL
+from blockchain.transactions import TransactionFetcher
+
+
+def _evaluate_chunk(jobs):
+    """
+    Evaluate (script_sig, script_pubkey, z, witness, timelocks) jobs, returning one bool per job
+    """
+    return [bool((script_sig + script_pubkey).evaluate(z, witness, timelocks))
+            for script_sig, script_pubkey, z, witness, timelocks in jobs]
+
+
+def fetch_prevouts(txs):
+    """
+    Outputs spent by the inputs of many transactions, fetched in one batch
+
+    Returns
+    -------
+    list
+        For every transaction, the list of :obj:`TransactionOutput` spent by each of its inputs
+    """
+    by_testnet = {}
+    for tx in txs:
+        by_testnet.setdefault(tx.testnet, []).extend(tx_in.prev_tx.hex() for tx_in in tx.tx_ins)
+
+    fetched = {testnet: TransactionFetcher.fetch_many(tx_ids, testnet=testnet)
+               for testnet, tx_ids in by_testnet.items()}
+
+    return [[fetched[tx.testnet][tx_in.prev_tx.hex()].tx_outs[tx_in.prev_index]
+             for tx_in in tx.tx_ins] for tx in txs]
+
+
+def _hash_type(signature):
+    """ Hash type of a signature, its last byte """
+    if isinstance(signature, bytes) and signature:
+        return signature[-1]
+    return SIGHASH_ALL
+
+
+def _first_signature(pushes):
+    """ First non-empty push, skipping e.g. the dummy element of a multisig script sig """
+    return next((push for push in pushes if isinstance(push, bytes) and push), None)
+
+
+def input_sig_hash(hasher, input_index, tx_in, prevout):
+    """
+    Signature hash of an input, picked by the type of the output it spends
+
+    P2PK and P2PKH inputs sign the legacy digest of the script pubkey, P2SH inputs the legacy
+    digest of their redeem script, and P2WPKH inputs, native or nested in P2SH, the BIP143 digest
+    of the P2PKH script of their key hash. The hash type is that of the first signature.
+
+    Parameters
+    ----------
+    hasher: :obj:`blockchain.sighash.SigHasher`
+    input_index: int
+    tx_in: :obj:`TransactionInput`
+    prevout: :obj:`TransactionOutput`
+        Output spent by the input
+
+    Raises
+    ------
+    ValueError
+        For other outputs, e.g. P2WSH, whose signature hashes must be given to
+        :func:`verify_transactions`
+    """
+    script_code = prevout.script_pubkey
+    kind = script_type(script_code.raw_serialize())
+
+    if kind == 'p2sh':
+        cmds = tx_in.script_sig.cmds
+        if not cmds or not isinstance(cmds[-1], bytes):
+            raise ValueError('input {} spends a P2SH output without a redeem script'.format(
+                input_index))
+
+        script_code = LazyScript(cmds[-1])
+        kind = script_type(cmds[-1])
+
+        # the legacy digest of any redeem script but a segwit program
+        if kind not in ('p2wpkh', 'p2wsh'):
+            hash_type = _hash_type(_first_signature(cmds[:-1]))
+            return hasher.legacy(input_index, script_code, hash_type)
+
+    if kind in ('p2pk', 'p2pkh'):
+        hash_type = _hash_type(_first_signature(tx_in.script_sig.cmds))
+        return hasher.legacy(input_index, script_code, hash_type)
+
+    if kind == 'p2wpkh':
+        raw = script_code.raw_serialize()
+        hash_type = _hash_type(tx_in.witness[0] if tx_in.witness else None)
+        return hasher.segwit_v0(input_index, Script.p2pkh(raw[2:22]), prevout.amount, hash_type)
+
+    raise ValueError("can't compute the signature hash of input {} spending a {} output".format(
+        input_index, kind))
+
+
+def compute_sig_hashes(tx, tx_prevouts):
+    """ Signature hashes of all the inputs of a transaction, see :func:`input_sig_hash` """
+    hasher = tx.sig_hasher()
+    return [input_sig_hash(hasher, index, tx_in, prevout)
+            for index, (tx_in, prevout) in enumerate(zip(tx.tx_ins, tx_prevouts))]
+
+
+def verify_transactions(txs, prevouts, sig_hashes=None, max_workers=None, chunk_size=64):
+    """
+    Verify the scripts of every input of many transactions
+
+    Parameters
+    ----------
+    txs: list
+        :obj:`Transaction` objects to verify
+    prevouts: list
+        For every transaction, the list of :obj:`TransactionOutput` spent by each of its inputs.
+        None fetches them all at once with :func:`fetch_prevouts`.
+    sig_hashes: list
+        For every transaction, the list of signature hashes (z) of each of its inputs. None
+        computes them with :func:`compute_sig_hashes`.
+    max_workers: int
+        Number of worker processes. None uses one per CPU, 0 or 1 verifies serially in this
+        process.
+    chunk_size: int
+        Number of inputs sent to a worker at a time
+
+    Returns
+    -------
+    list
+        One bool per transaction, True if all of its inputs are valid
+    """
+    if prevouts is None:
+        prevouts = fetch_prevouts(txs)
+    if sig_hashes is None:
+        sig_hashes = [compute_sig_hashes(tx, tx_prevouts) for tx, tx_prevouts in zip(txs, prevouts)]
+
+    jobs = []
+    owners = []
+
+    for tx_index, (tx, tx_prevouts, tx_sig_hashes) in enumerate(zip(txs, prevouts, sig_hashes)):
+        if not (len(tx.tx_ins) == len(tx_prevouts) == len(tx_sig_hashes)):
+            raise ValueError(f'transaction {tx_index} needs one prevout and sig hash per input')
+
+        for tx_in, prevout, z in zip(tx.tx_ins, tx_prevouts, tx_sig_hashes):
+            jobs.append((tx_in.script_sig, prevout.script_pubkey, z, tx_in.witness,
+                         (tx.version, tx.locktime, tx_in.sequence)))
+            owners.append(tx_index)
+
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+
+    if max_workers is not None and max_workers <= 1 or len(chunks) <= 1:
+        chunk_results = map(_evaluate_chunk, chunks)
+    else:
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                # map returns results in submission order regardless of completion order
+                chunk_results = list(executor.map(_evaluate_chunk, chunks))
+        except (OSError, NotImplementedError):
+            # no working multiprocessing on this platform
+            chunk_results = map(_evaluate_chunk, chunks)
+
+    results = [True] * len(txs)
+    input_results = (result for chunk in chunk_results for result in chunk)
+
+    for tx_index, valid in zip(owners, input_results):
+        if not valid:
+            results[tx_index] = False
+
+    return results
@@ -0,0 +1,82 @@
+from io import BytesIO
+
+import pytest
+
+from blockchain.block import Block, BlockHeader, bits_to_target
+from blockchain.blockfile import iter_blocks, write_block_file
+from blockchain.transactions import Transaction
+
+from tests.test_transactions import RAW_TX
+
+
+GENESIS_HEADER = bytes.fromhex(
+    '0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b2'
+    '7ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c')
+GENESIS_COINBASE = bytes.fromhex(
+    '01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff4d04ff'
+    'ff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e2062'
+    '72696e6b206f66207365636f6e64206261696c6f757420666f722062616e6b73ffffffff0100f2052a0100'
+    '0000434104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef'
+    '38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000')
+GENESIS = GENESIS_HEADER + b'\x01' + GENESIS_COINBASE
+
+RAW_HEADER = bytes.fromhex(
+    '020000208ec39428b17323fa0ddec8e887b4a7c53b8c0a0a220cfd0000000000000000005b0750fce0a889'
+    '502d40508d39576821155e9c9e3f5c3157f961db38fd8b25be1e77a759e93c0118a4ffd71d')
+
+
+def test_header():
+    header = BlockHeader.parse(BytesIO(RAW_HEADER))
+
+    assert header.version == 0x20000002
+    assert header.prev_block.hex() == \
+        '000000000000000000fd0c220a0a8c3bc5a7b487e8c8de0dfa2373b12894c38e'
+    assert header.merkle_root.hex() == \
+        'be258bfd38db61f957315c3f9e9c5e15216857398d50402d5089a8e0fc50075b'
+    assert header.timestamp == 0x59a7771e
+    assert header.serialize() == RAW_HEADER
+    assert header.id() == '0000000000000000007e9e4c586439b0cdbe13b1370bdd9435d76a644d047523'
+
+
+def test_pow():
+    header = BlockHeader.parse(RAW_HEADER)
+
+    assert header.target() == 0x13ce9000000000000000000000000000000000000000000
+    assert int(header.difficulty()) == 888171856257
+    assert header.check_pow()
+
+    header.nonce = bytes(4)
+    assert not header.check_pow()
+
+
+def test_bits_to_target():
+    assert bits_to_target(bytes.fromhex('e93c0118')) == BlockHeader.parse(RAW_HEADER).target()
+
+
+@pytest.mark.parametrize('source', [BytesIO, bytes, memoryview])
+def test_genesis(source):
+    block = Block.parse(source(GENESIS))
+
+    assert block.id() == '000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f'
+    assert block.check_pow()
+    assert block.merkle_root().hex() == \
+        '4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b'
+    assert block.validate_merkle_root()
+    assert block.serialize() == GENESIS
+
+
+def test_merkle_root():
+    block = Block.parse(GENESIS)
+    block.txs.append(Transaction.parse(RAW_TX))
+    assert not block.validate_merkle_root()
+
+    block.header.merkle_root = block.merkle_root()
+    assert block.validate_merkle_root()
+
+
+def test_iter_blocks(tmp_path):
+    path = str(tmp_path / 'blk00000.dat')
+    write_block_file(path, [(GENESIS_HEADER, [GENESIS_COINBASE])] * 2)
+
+    blocks = list(iter_blocks(path))
+    assert [block.serialize() for block in blocks] == [GENESIS] * 2
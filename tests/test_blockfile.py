@@ -0,0 +1,86 @@
+import pytest
+
+from blockchain.blockfile import (iter_block_records, iter_transactions, write_block_file,
+                                  HEADER_SIZE, TESTNET_MAGIC)
+from blockchain.script import Script, script_type
+from blockchain.transactions import Transaction, LazyTransaction
+
+from tests.test_transactions import RAW_TX
+
+
+def p2sh_tx():
+    tx = Transaction.parse(RAW_TX)
+    tx.tx_outs = tx.tx_outs[:1]
+    tx.tx_outs[0].script_pubkey = Script([0xa9, bytes(20), 0x87])
+    return tx.serialize()
+
+
+@pytest.fixture
+def block_file(tmp_path):
+    path = str(tmp_path / 'blk00000.dat')
+    blocks = [
+        (bytes(HEADER_SIZE), [RAW_TX]),
+        (bytes(range(HEADER_SIZE)), [RAW_TX, p2sh_tx(), RAW_TX]),
+    ]
+    write_block_file(path, blocks)
+
+    # block files are preallocated and padded with zeros
+    with open(path, 'ab') as f:
+        f.write(bytes(1000))
+
+    return path
+
+
+def test_block_records(block_file):
+    records = [bytes(record) for record in iter_block_records(block_file)]
+
+    assert len(records) == 2
+    assert records[1][:HEADER_SIZE] == bytes(range(HEADER_SIZE))
+    assert records[1][HEADER_SIZE] == 3
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_iter_transactions(block_file, lazy):
+    txs = list(iter_transactions(block_file, lazy=lazy))
+    expected = [RAW_TX, RAW_TX, p2sh_tx(), RAW_TX]
+
+    assert [tx.serialize() for tx in txs] == expected
+    assert all(isinstance(tx, LazyTransaction) == lazy for tx in txs)
+    assert txs[0].id() == Transaction.parse(RAW_TX).id()
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_script_filter(block_file, lazy):
+    txs = list(iter_transactions(block_file, lazy=lazy,
+                                 script_filter=lambda raw: script_type(raw) == 'p2sh'))
+
+    assert [tx.serialize() for tx in txs] == [p2sh_tx()]
+
+
+def test_early_exit(block_file):
+    txs = iter_transactions(block_file)
+    assert next(txs).serialize() == RAW_TX
+    txs.close()
+
+
+def test_bad_magic(block_file):
+    with pytest.raises(ValueError):
+        list(iter_transactions(block_file, magic=TESTNET_MAGIC))
+
+
+def test_truncated(block_file, tmp_path):
+    with open(block_file, 'rb') as f:
+        data = f.read()
+
+    path = str(tmp_path / 'truncated.dat')
+    with open(path, 'wb') as f:
+        f.write(data[:100])
+
+    with pytest.raises(EOFError):
+        list(iter_transactions(path))
+
+
+def test_empty(tmp_path):
+    path = tmp_path / 'empty.dat'
+    path.write_bytes(b'')
+    assert list(iter_transactions(str(path))) == []
@@ -1,4 +1,9 @@
-from blockchain.crypto import PrivateKeyS256, G_S256, Signature
+import pytest
+
+from blockchain.crypto import (PrivateKeyS256, G_S256, S256Field, S256Point, Signature,
+                               SignatureCache, secp256k1_params, verify_batch)
+from blockchain.fields import FieldElement
+from blockchain.etc import hash256, LRUCache
 
 
 def test_sec_s256_uncompressed():
@@ -48,3 +53,222 @@ def test_sig_der_parse():
 
     assert sig.r == expected_r
     assert sig.s == expected_s
+
+
+def affine_multiply(point, coefficient):
+    """ Reference double-and-add using only affine point addition """
+    result = S256Point(None, None)
+    current = point
+
+    while coefficient:
+        if coefficient & 1:
+            result += current
+        current += current
+        coefficient >>= 1
+
+    return result
+
+
+SCALARS = [1, 2, 3, 7, 5000, 2**128 + 17, secp256k1_params.n - 1]
+
+
+@pytest.mark.parametrize('secret', SCALARS)
+def test_scalar_multiply_matches_affine(secret):
+    result = secret * G_S256
+    expected = affine_multiply(G_S256, secret)
+
+    assert result == expected
+
+
+@pytest.mark.parametrize('use_glv', [False, True])
+@pytest.mark.parametrize('width', [2, 4, 5, 8])
+def test_variable_base_multiply(width, use_glv, monkeypatch):
+    monkeypatch.setattr(S256Point, 'use_glv', use_glv)
+    point = PrivateKeyS256(0xdeadbeef).point
+
+    for k in SCALARS:
+        assert point.multiply(k, width=width) == affine_multiply(point, k)
+
+
+def test_glv_matches_plain_multiply(monkeypatch):
+    point = PrivateKeyS256(0xc0ffee).point
+    scalars = [int.from_bytes(hash256(bytes([i])), 'big') for i in range(20)]
+
+    monkeypatch.setattr(S256Point, 'use_glv', False)
+    expected = [k * point for k in scalars]
+
+    monkeypatch.setattr(S256Point, 'use_glv', True)
+    assert [k * point for k in scalars] == expected
+
+
+def test_scalar_multiply_identity():
+    assert (secp256k1_params.n * G_S256).x is None
+    assert (0 * G_S256).x is None
+
+
+def test_sign_verify():
+    private_key = PrivateKeyS256(12345)
+    z = int.from_bytes(hash256(b'Programming Bitcoin!'), 'big')
+    sig = private_key.sign(z)
+
+    assert private_key.point.verify(z, sig)
+    assert not private_key.point.verify(z + 1, sig)
+
+
+@pytest.mark.parametrize('use_glv', [False, True])
+def test_verify_batch(use_glv, monkeypatch):
+    monkeypatch.setattr(S256Point, 'use_glv', use_glv)
+    items = []
+    for secret in (1, 2, 12345, 2**200 + 7):
+        private_key = PrivateKeyS256(secret)
+        z = int.from_bytes(hash256(secret.to_bytes(32, 'big')), 'big')
+        sig = private_key.sign(z)
+
+        items.append((private_key.point, z, sig))
+        items.append((private_key.point, z + 1, sig))
+        items.append((private_key.point, z, Signature(sig.r, secp256k1_params.n - sig.s)))
+
+    # the public key of the first item paired with the signature of the second key
+    items.append((items[0][0], items[3][1], items[3][2]))
+    # s = 0 can never verify
+    items.append((items[0][0], items[0][1], Signature(items[0][2].r, 0)))
+    # nor can the point at infinity, or r outside the field
+    items.append((S256Point(None, None), items[0][1], items[0][2]))
+    items.append((items[0][0], items[0][1],
+                  Signature(items[0][2].r + secp256k1_params.p, items[0][2].s)))
+
+    # verify_batch first, so that it has to build the tables of odd multiples itself
+    result = verify_batch(items)
+    expected = [point.verify(z, sig) for point, z, sig in items]
+
+    assert result == expected
+    assert expected[0::3][:4] == [True] * 4
+    assert expected[-2:] == [False, False]
+
+
+def test_verify_batch_empty():
+    assert verify_batch([]) == []
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_sec_parse(compressed):
+    for secret in (1, 5001, 2**200 + 7):
+        point = PrivateKeyS256(secret).point
+        assert S256Point.parse(point.sec(compressed)) == point
+
+
+def test_parse_not_on_curve():
+    with pytest.raises(ValueError):
+        S256Point.parse(b'\x04' + (5).to_bytes(32, 'big') + (7).to_bytes(32, 'big'))
+
+    # x = 5 is not the x coordinate of any point
+    with pytest.raises(ValueError):
+        S256Point.parse(b'\x02' + (5).to_bytes(32, 'big'))
+
+
+def test_s256_field_matches_field_element():
+    p = secp256k1_params.p
+    values = [0, 1, 2, 7, p - 1, 2**255 + 19]
+
+    for i in values:
+        for j in values:
+            a, b = S256Field(i), S256Field(j)
+            fa, fb = FieldElement(i, p), FieldElement(j, p)
+
+            assert (a + b).num == (fa + fb).num
+            assert (a - b).num == (fa - fb).num
+            assert (a * b).num == (fa * fb).num
+            assert (a ** j).num == (fa ** j).num
+            assert (i * a).num == (i * fa).num
+            assert (-a).num == (-fa).num
+            if j:
+                assert (a / b).num == (fa / fb).num
+            assert isinstance(a + b, S256Field)
+
+    with pytest.raises(ValueError):
+        S256Field(p)
+
+    with pytest.raises(TypeError):
+        S256Field(1) + FieldElement(1, 13)
+
+
+def test_point_addition():
+    p1 = PrivateKeyS256(1234).point
+    p2 = PrivateKeyS256(5678).point
+
+    assert p1 + p2 == PrivateKeyS256(1234 + 5678).point
+    assert p1 + p1 == PrivateKeyS256(2468).point
+    assert (p1 + -p1).x is None
+    assert p1 + S256Point(None, None) == p1
+
+
+def test_private_keys_from_secrets():
+    secrets = [1, 2, 5000, 2**200 + 7, secp256k1_params.n - 1]
+    keys = PrivateKeyS256.from_secrets(secrets)
+
+    assert [key.secret for key in keys] == secrets
+    assert [key.point for key in keys] == [PrivateKeyS256(secret).point for secret in secrets]
+
+
+def test_parse_cache(monkeypatch):
+    monkeypatch.setattr(S256Point, 'parse_cache', LRUCache(maxsize=2))
+    points = [PrivateKeyS256(secret).point for secret in (11, 12, 13)]
+    secs = [point.sec() for point in points]
+
+    first = S256Point.parse(secs[0])
+    first.verify(1, PrivateKeyS256(11).sign(1))
+    assert first._wnaf_table is not None
+
+    again = S256Point.parse(bytearray(secs[0]))
+    assert again is first
+    assert again._wnaf_table is not None
+
+    S256Point.parse(secs[1])
+    S256Point.parse(secs[2])
+    assert S256Point.parse(secs[0]) is not first
+
+    info = S256Point.parse_cache.info()
+    assert (info.hits, info.misses, info.evictions) == (1, 4, 2)
+
+
+def test_signature_cache():
+    cache = SignatureCache(max_bytes=2 * SignatureCache.ENTRY_SIZE)
+    sec = PrivateKeyS256(11).point.sec()
+
+    cache.add(1, sec, b'sig1')
+    cache.add(2, sec, b'sig2')
+
+    assert cache.contains(1, sec, b'sig1')
+    assert not cache.contains(1, sec, b'sig2')
+
+    # sig2 is now the least recently used entry
+    cache.add(3, sec, b'sig3')
+    assert not cache.contains(2, sec, b'sig2')
+
+    assert cache.contains(3, sec, b'sig3', erase=True)
+    assert not cache.contains(3, sec, b'sig3')
+
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.maxsize) == (2, 3, 1, 2)
+
+
+def test_signature_cache_large_z():
+    cache = SignatureCache()
+    sec = PrivateKeyS256(11).point.sec()
+    n = secp256k1_params.n
+
+    cache.add(2**256 + 5, sec, b'sig')
+    assert cache.contains(2**256 + 5, sec, b'sig')
+    assert cache.contains((2**256 + 5) % n, sec, b'sig')
+    assert not cache.contains(5, sec, b'sig')
+
+    cache.add(-1, sec, b'sig')
+    assert cache.contains(n - 1, sec, b'sig')
+
+
+def test_signature_cache_salt():
+    sec = PrivateKeyS256(11).point.sec()
+
+    assert SignatureCache()._key(1, sec, b'sig') != SignatureCache()._key(1, sec, b'sig')
+    assert SignatureCache(salt=b'x')._key(1, sec, b'sig') == \
+        SignatureCache(salt=b'x')._key(1, sec, b'sig')
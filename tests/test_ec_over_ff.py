@@ -1,7 +1,8 @@
 import pytest
 
+from blockchain import fields
 from blockchain.fields import FieldElement
-from blockchain.elliptic import EllipticCurvePoint
+from blockchain.elliptic import EllipticCurvePoint, wnaf, batch_on_curve, batch_add_points
 
 
 def test_on_curve():
@@ -68,3 +69,98 @@ def test_scalar_multiply():
     expected = p + p
 
     assert result == expected
+
+
+@pytest.mark.parametrize('width', [2, 3, 4, 6])
+def test_wnaf_multiply(width):
+    prime = 223
+    a = FieldElement(0, prime)
+    b = FieldElement(7, prime)
+    point = EllipticCurvePoint(FieldElement(15, prime), FieldElement(86, prime), a, b)
+
+    expected = EllipticCurvePoint(None, None, a, b)
+    for coefficient in range(12):
+        assert point.multiply(coefficient, width=width) == expected
+        expected += point
+
+
+@pytest.mark.parametrize('coefficient', [0, 1, 2, 7, 255, 256, 2**64 + 3])
+def test_wnaf_digits(coefficient):
+    for width in (2, 3, 5):
+        digits = wnaf(coefficient, width)
+
+        assert sum(d * 2**i for i, d in enumerate(digits)) == coefficient
+        assert all(d % 2 and abs(d) < 2**(width - 1) for d in digits if d)
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def vectorize(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(fields, 'np', None)
+    elif fields.np is None:
+        pytest.skip('NumPy is not installed')
+
+
+@pytest.mark.parametrize('prime', [223, 2**31 - 1, 2**61 - 1])
+def test_batch_field_operations(prime, vectorize):
+    a = [FieldElement(n % prime, prime) for n in (0, 1, 2, 3, 100, prime - 1, 2**40 + 7)]
+    b = [FieldElement(n % prime, prime) for n in (5, 0, prime - 1, 3, 77, prime - 2, 12345)]
+
+    assert fields.batch_add(a, b) == [x + y for x, y in zip(a, b)]
+    assert fields.batch_sub(a, b) == [x - y for x, y in zip(a, b)]
+    assert fields.batch_mul(a, b) == [x * y for x, y in zip(a, b)]
+    assert fields.batch_inverse(a) == [x ** -1 for x in a]
+    assert fields.batch_inverse([]) == []
+
+
+def test_batch_field_errors():
+    with pytest.raises(TypeError):
+        fields.batch_add([FieldElement(1, 13)], [FieldElement(1, 17)])
+
+    with pytest.raises(ValueError):
+        fields.batch_mul([FieldElement(1, 13)], [])
+
+
+def test_batch_on_curve(vectorize):
+    prime = 223
+    a = FieldElement(0, prime)
+    b = FieldElement(7, prime)
+
+    coordinates = ((192, 105), (17, 56), (200, 119), (1, 193), (42, 99))
+    xs = [FieldElement(x, prime) for x, _ in coordinates]
+    ys = [FieldElement(y, prime) for _, y in coordinates]
+
+    assert batch_on_curve(xs, ys, a, b) == [True, True, False, True, False]
+
+
+def test_batch_add_points():
+    prime = 223
+    a = FieldElement(0, prime)
+    b = FieldElement(7, prime)
+    inf = EllipticCurvePoint(None, None, a, b)
+
+    g = EllipticCurvePoint(FieldElement(47, prime), FieldElement(71, prime), a, b)
+    multiples = [k * g for k in range(21)]
+
+    ps = multiples + [inf, g, g]
+    qs = multiples[::-1] + [g, inf, multiples[20]]
+
+    assert batch_add_points(ps, qs) == [p + q for p, q in zip(ps, qs)]
+
+
+SECP256K1_P = 2**256 - 2**32 - 977
+SECP256K1_N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+
+
+@pytest.mark.parametrize('modulus', [13, SECP256K1_P, SECP256K1_N])
+def test_batch_inverse_mod(modulus):
+    nums = [1, 0, 2, modulus - 1, modulus, 5, 2 * modulus + 3]
+    result = fields.batch_inverse_mod(nums, modulus)
+
+    for num, inverse in zip(nums, result):
+        if num % modulus:
+            assert num * inverse % modulus == 1
+        else:
+            assert inverse == 0
+
+    assert fields.batch_inverse_mod([], modulus) == []
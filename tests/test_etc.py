@@ -38,3 +38,47 @@ def test_read_varint(test_input, expected):
     result = etc.read_varint(stream)
 
     assert result == expected
+
+    reader = etc.BytesReader(test_input + b'\x00')
+    assert reader.read_varint() == expected
+    assert reader.offset == len(test_input)
+
+
+def test_bytes_reader():
+    reader = etc.BytesReader(bytearray(range(20)))
+
+    assert reader.read_uint32() == 0x03020100
+    assert reader.read_uint64() == 0x0b0a090807060504
+    assert reader.read_bytes(3) == bytes([12, 13, 14])
+    assert reader.read(10).tolist() == [15, 16, 17, 18, 19]
+
+    with pytest.raises(EOFError):
+        reader.read_bytes(1)
+
+
+def test_lru_cache():
+    cache = etc.LRUCache(maxsize=3)
+
+    for key in 'abcd':
+        cache.put(key, key.upper())
+
+    assert 'a' not in cache
+    assert cache.get('b') == 'B'
+
+    cache.put('e', 'E')
+    assert 'c' not in cache
+    assert 'b' in cache
+
+    cache.resize(1)
+    assert len(cache) == 1
+    assert cache.get('e') == 'E'
+
+    assert cache.info() == etc.CacheInfo(hits=2, misses=0, evictions=4, maxsize=1, currsize=1)
+
+
+def test_lru_cache_disabled():
+    cache = etc.LRUCache(maxsize=0)
+    cache.put('a', 1)
+
+    assert cache.get('a') is None
+    assert cache.info().misses == 1
@@ -0,0 +1,111 @@
+import pytest
+
+from blockchain.block import Block
+from blockchain.etc import hash256
+from blockchain.merkle import merkle_parent, merkle_root, verify_proof, MerkleTree
+
+from tests.test_block import GENESIS
+
+
+def naive_merkle_root(hashes):
+    level = list(hashes)
+
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [merkle_parent(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+
+    return level[0]
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 4, 5, 7, 12, 27, 64, 100])
+def test_merkle_root(count):
+    hashes = [hash256(bytes([i])) for i in range(count)]
+    assert merkle_root(hashes) == naive_merkle_root(hashes)
+
+
+def test_merkle_root_generator():
+    hashes = [hash256(bytes([i])) for i in range(9)]
+    assert merkle_root(iter(hashes)) == naive_merkle_root(hashes)
+
+
+@pytest.mark.parametrize('hashes', [[], [b'\x00' * 31], [b'\x00' * 32, b'\x00']])
+def test_merkle_root_bad_input(hashes):
+    with pytest.raises(ValueError):
+        merkle_root(hashes)
+
+
+def leaves(count, salt=b''):
+    return [hash256(salt + bytes([i])) for i in range(count)]
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5, 8, 13])
+def test_tree_root(count):
+    tree = MerkleTree(leaves(count))
+
+    assert len(tree) == count
+    assert tree.root() == merkle_root(leaves(count))
+
+
+def test_tree_append():
+    tree = MerkleTree()
+    with pytest.raises(ValueError):
+        tree.root()
+
+    for count in range(1, 20):
+        tree.append(leaves(count)[-1])
+        assert tree.root() == merkle_root(leaves(count))
+        assert tree.levels == MerkleTree(leaves(count)).levels
+
+
+def test_tree_replace():
+    hashes = leaves(11)
+    tree = MerkleTree(hashes)
+
+    for index in (0, 5, 10, -1):
+        hashes[index] = hash256(b'replaced' + bytes([index % 11]))
+        tree.replace(index, hashes[index])
+        assert tree.root() == merkle_root(hashes)
+
+    with pytest.raises(IndexError):
+        tree.replace(11, hashes[0])
+
+
+def test_tree_remove():
+    hashes = leaves(9)
+    tree = MerkleTree(hashes)
+
+    # the last leaf takes the place of the removed one
+    assert tree.remove(2) == hashes[2]
+    hashes[2] = hashes.pop()
+    assert tree.root() == merkle_root(hashes)
+    assert tree.levels == MerkleTree(hashes).levels
+
+    while len(tree) > 1:
+        tree.remove(len(tree) - 1)
+        hashes.pop()
+        assert tree.root() == merkle_root(hashes)
+
+    tree.remove(0)
+    assert len(tree) == 0
+    assert tree.levels == [bytearray()]
+
+
+@pytest.mark.parametrize('count', [1, 2, 7, 16])
+def test_tree_proof(count):
+    tree = MerkleTree(leaves(count))
+    root = tree.root()
+
+    for index in range(count):
+        proof = tree.proof(index)
+        assert verify_proof(tree[index], index, proof, root)
+        assert not verify_proof(hash256(b'other'), index, proof, root)
+
+    if count > 1:
+        assert not verify_proof(tree[0], 1, tree.proof(0), root)
+
+
+def test_tree_from_transactions():
+    block = Block.parse(GENESIS)
+    tree = MerkleTree.from_transactions(block.txs)
+    assert tree.root()[::-1] == block.header.merkle_root
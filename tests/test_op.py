@@ -0,0 +1,199 @@
+import pytest
+
+from blockchain.crypto import PrivateKeyS256
+from blockchain.etc import hash160
+from blockchain.op import OP_CODE_NAMES, encode_num, decode_num, is_true
+from blockchain.script import Script
+
+
+def script(*cmds):
+    """ Script from opcode names, ints, pushed as numbers, and bytes """
+    return Script([OP_CODE_NAMES[cmd] if isinstance(cmd, str) else
+                   encode_num(cmd) if isinstance(cmd, int) else cmd for cmd in cmds])
+
+
+def test_reserved_op():
+    assert not Script([80, b'\x01']).evaluate(0)
+
+
+def run(*cmds, **kwargs):
+    return script(*cmds).evaluate(0, **kwargs)
+
+
+@pytest.mark.parametrize('element, expected', [
+    (b'', False), (b'\x00', False), (b'\x00\x80', False), (b'\x80', False),
+    (b'\x01', True), (b'\x00\x01', True), (b'\x81', True), (b'\x80\x00', True),
+])
+def test_is_true(element, expected):
+    assert is_true(element) is expected
+
+
+@pytest.mark.parametrize('cmds', [
+    (2, 3, 'OP_ADD', 5, 'OP_NUMEQUAL'),
+    (2, 3, 'OP_SUB', -1, 'OP_NUMEQUAL'),
+    (-5, 'OP_ABS', 'OP_NEGATE', -5, 'OP_NUMEQUAL'),
+    (7, 'OP_1ADD', 'OP_1SUB', 7, 'OP_NUMEQUALVERIFY', 'OP_1'),
+    (0, 'OP_NOT', 0, 'OP_0NOTEQUAL', 'OP_NOT', 'OP_BOOLAND'),
+    (0, 1, 'OP_BOOLOR'),
+    (1, 2, 'OP_LESSTHAN', 2, 2, 'OP_LESSTHANOREQUAL', 'OP_BOOLAND'),
+    (3, 2, 'OP_GREATERTHAN', 2, 2, 'OP_GREATERTHANOREQUAL', 'OP_BOOLAND'),
+    (3, 2, 'OP_NUMNOTEQUAL'),
+    (3, 9, 'OP_MIN', 9, 3, 'OP_MAX', 'OP_ADD', 12, 'OP_NUMEQUAL'),
+    (5, 5, 10, 'OP_WITHIN', 10, 5, 10, 'OP_WITHIN', 'OP_NOT', 'OP_BOOLAND'),
+    ('OP_1NEGATE', -1, 'OP_NUMEQUAL'),
+    ('OP_16', 16, 'OP_EQUAL'),
+    (b'abc', 'OP_SIZE', 3, 'OP_EQUALVERIFY', b'abc', 'OP_EQUAL'),
+])
+def test_arithmetic(cmds):
+    assert run(*cmds)
+
+
+def test_numbers_are_4_bytes():
+    # results may overflow, but can't be used as numbers any more
+    assert run(2 ** 31 - 1, 'OP_1ADD')
+    assert not run(2 ** 31 - 1, 'OP_1ADD', 'OP_1ADD')
+
+
+@pytest.mark.parametrize('cmds, expected', [
+    ((1, 2, 'OP_SWAP'), [2, 1]),
+    ((1, 2, 'OP_OVER'), [1, 2, 1]),
+    ((1, 2, 3, 'OP_ROT'), [2, 3, 1]),
+    ((1, 2, 'OP_TUCK'), [2, 1, 2]),
+    ((1, 2, 'OP_NIP'), [2]),
+    ((1, 2, 'OP_2DUP'), [1, 2, 1, 2]),
+    ((1, 2, 3, 'OP_3DUP'), [1, 2, 3, 1, 2, 3]),
+    ((1, 2, 3, 4, 'OP_2OVER'), [1, 2, 3, 4, 1, 2]),
+    ((1, 2, 3, 4, 5, 6, 'OP_2ROT'), [3, 4, 5, 6, 1, 2]),
+    ((1, 2, 3, 4, 'OP_2SWAP'), [3, 4, 1, 2]),
+    ((1, 2, 3, 'OP_2DROP'), [1]),
+    ((1, 2, 3, 2, 'OP_PICK'), [1, 2, 3, 1]),
+    ((1, 2, 3, 2, 'OP_ROLL'), [2, 3, 1]),
+    ((1, 2, 'OP_DEPTH'), [1, 2, 2]),
+    ((1, 0, 'OP_IFDUP'), [1, 0]),
+    ((1, 'OP_IFDUP'), [1, 1]),
+    ((1, 2, 'OP_TOALTSTACK', 3, 'OP_FROMALTSTACK'), [1, 3, 2]),
+])
+def test_stack_ops(cmds, expected):
+    # the expected stack is compared element by element on top of the resulting one
+    checks = []
+    for value in reversed(expected):
+        checks += [value, 'OP_NUMEQUALVERIFY']
+    assert run(*cmds, *checks, 'OP_DEPTH', 0, 'OP_NUMEQUAL')
+
+
+@pytest.mark.parametrize('cmds', [
+    (1, 'OP_PICK'),
+    (1, 2, 5, 'OP_ROLL'),
+    ('OP_FROMALTSTACK',),
+    (1, 'OP_RETURN'),
+    (0, 'OP_VERIFY', 1),
+    (b'\x01' * 5, 'OP_1ADD'),
+])
+def test_failing_ops(cmds):
+    assert not run(*cmds)
+
+
+def test_hashes():
+    assert run(b'abc', 'OP_SHA256', bytes.fromhex(
+        'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'), 'OP_EQUAL')
+    assert run(b'abc', 'OP_SHA1', bytes.fromhex('a9993e364706816aba3e25717850c26c9cd0d89d'),
+               'OP_EQUAL')
+    assert run(b'abc', 'OP_RIPEMD160', bytes.fromhex('8eb208f7e05d987a9b044a8e98c6b087f15a0bfc'),
+               'OP_EQUAL')
+    assert run(b'abc', 'OP_HASH160', hash160(b'abc'), 'OP_EQUAL')
+
+
+KEYS = [PrivateKeyS256(secret) for secret in (101, 102, 103)]
+Z = 0x5151
+
+
+def multisig(required, keys):
+    return script(required, *[key.point.sec() for key in keys], len(keys), 'OP_CHECKMULTISIG')
+
+
+@pytest.mark.parametrize('signers, valid', [
+    ([0, 1], True), ([0, 2], True), ([1, 2], True),
+    ([1, 0], False), ([0, 0], False),
+])
+def test_checkmultisig(signers, valid):
+    sigs = [KEYS[i].sign(Z).der() + b'\x01' for i in signers]
+    redeem_script = multisig(2, KEYS)
+
+    assert (script(0, *sigs) + redeem_script).evaluate(Z) is valid
+
+    # P2SH, with the redeem script pushed by the script sig
+    script_sig = script(0, *sigs, redeem_script.raw_serialize())
+    script_pubkey = Script.p2sh(hash160(redeem_script.raw_serialize()))
+    assert (script_sig + script_pubkey).evaluate(Z) is valid
+
+
+@pytest.mark.parametrize('nops, valid', [(180, True), (181, False)])
+def test_checkmultisig_op_limit(nops, valid):
+    # 0-of-20: the 20 keys and the opcode itself leave room for 180 other opcodes
+    keys = [bytes([i]) * 33 for i in range(20)]
+    nop = ['OP_NOP'] * nops
+
+    assert script(0, 0, *keys, 20, 'OP_CHECKMULTISIG', *nop).evaluate(Z) is valid
+    assert script(*nop, 0, 0, *keys, 20, 'OP_CHECKMULTISIGVERIFY', 1).evaluate(Z) is valid
+    # the keys of every multisig that runs add up
+    assert script(0, 0, *keys, 20, 'OP_CHECKMULTISIG', 'OP_DROP', 0, 0, *keys, 20,
+                  'OP_CHECKMULTISIG', *nop[22:]).evaluate(Z) is valid
+
+    # the keys of a multisig that doesn't run are not counted
+    assert script(0, 'OP_IF', 0, 0, *keys, 20, 'OP_CHECKMULTISIG', 'OP_ENDIF', 1,
+                  *nop[:198]).evaluate(Z)
+
+
+def test_checksigverify():
+    sig = KEYS[0].sign(Z).der() + b'\x01'
+    sec = KEYS[0].point.sec()
+
+    assert script(sig, sec, 'OP_CHECKSIGVERIFY', 1).evaluate(Z)
+    assert not script(sig, sec, 'OP_CHECKSIGVERIFY', 1).evaluate(Z + 1)
+
+
+@pytest.mark.parametrize('sig', [b'', b'\x30\x01', b'\x01'])
+def test_checksig_malformed_signature(sig):
+    # a signature that can't be parsed fails the check without failing the script
+    sec = KEYS[0].point.sec()
+
+    assert script(sig, sec, 'OP_CHECKSIG', 'OP_NOT').evaluate(Z)
+    assert not script(sig, sec, 'OP_CHECKSIGVERIFY', 1).evaluate(Z)
+
+
+@pytest.mark.parametrize('required, locktime, sequence, valid', [
+    (100, 100, 0, True),
+    (100, 99, 0, False),
+    (100, 200, 0xffffffff, False),
+    (100, 600000000, 0, False),
+    (600000000, 600000001, 0, True),
+    (-1, 100, 0, False),
+])
+def test_checklocktimeverify(required, locktime, sequence, valid):
+    timelocks = (1, locktime, sequence)
+    assert run(required, 'OP_CHECKLOCKTIMEVERIFY', timelocks=timelocks) is valid
+
+
+@pytest.mark.parametrize('required, version, sequence, valid', [
+    (10, 2, 10, True),
+    (10, 2, 9, False),
+    (10, 1, 10, False),
+    (10, 2, 10 | 1 << 22, False),
+    (10 | 1 << 22, 2, 20 | 1 << 22, True),
+    (1 << 31, 1, 0, True),
+    (10, 2, 1 << 31, False),
+])
+def test_checksequenceverify(required, version, sequence, valid):
+    timelocks = (version, 0, sequence)
+    assert run(required, 'OP_CHECKSEQUENCEVERIFY', timelocks=timelocks) is valid
+
+
+def test_locktime_ops_need_timelocks():
+    assert not run(1, 'OP_CHECKLOCKTIMEVERIFY')
+    assert not run(1, 'OP_CHECKSEQUENCEVERIFY')
+    assert run(1, 'OP_NOP1')
+
+
+def test_decode_num():
+    for n in (0, 1, -1, 127, 128, -128, 255, 2 ** 31 - 1, -2 ** 31 + 1):
+        assert decode_num(encode_num(n)) == n
@@ -1,6 +1,14 @@
-from blockchain.script import Script
+import pickle
+from io import BytesIO
+
+import pytest
+
+from blockchain import op, script as script_module
+from blockchain.crypto import PrivateKeyS256, S256Point, SignatureCache
+from blockchain.script import (Script, LazyScript, compile_cmds, decode_cmds, verify_generic, PUSH,
+                               STACK, SIG, IF, ELSE)
 from blockchain.op import OP_CODE_NAMES
-from blockchain.etc import hash160
+from blockchain.etc import hash160, encode_varint, LRUCache
 
 
 def test_p2pk():
@@ -29,3 +37,325 @@ def test_p2pkh_constructor():
     result = Script.p2pkh(pk_hash).cmds
 
     assert result == expected
+
+
+def test_checksig_uses_signature_cache(monkeypatch):
+    monkeypatch.setattr(op, 'signature_cache', SignatureCache())
+    private_key = PrivateKeyS256(8675309)
+    z = 0x1234567890
+    der = private_key.sign(z).der() + b'\x01'
+
+    script = Script([der]) + Script([private_key.point.sec(), OP_CODE_NAMES['OP_CHECKSIG']])
+    assert script.evaluate(z)
+    assert len(op.signature_cache) == 1
+
+    # a cached signature is accepted without verifying it again
+    monkeypatch.setattr(S256Point, 'verify', lambda self, z, sig: False)
+    assert script.evaluate(z)
+    assert not script.evaluate(z + 1)
+
+
+@pytest.mark.parametrize('source', [BytesIO, bytes])
+def test_parse_pushdata(source):
+    data1 = bytes(range(100))
+    data2 = bytes(300)
+    raw = b'\x4c' + bytes([len(data1)]) + data1 + b'\x4d' + len(data2).to_bytes(2, 'little') + data2
+    raw += b'\x76'
+
+    script = Script.parse(source(encode_varint(len(raw)) + raw))
+
+    assert script.cmds == [data1, data2, OP_CODE_NAMES['OP_DUP']]
+
+
+def test_checksig_large_z(monkeypatch):
+    monkeypatch.setattr(op, 'signature_cache', SignatureCache())
+    private_key = PrivateKeyS256(8675309)
+    z = 0x1234567890
+    script_pubkey = Script.p2pk(private_key.point.sec())
+    script_sig = Script([private_key.sign(z).der() + b'\x01'])
+
+    # a signature hash too large for 32 bytes fails instead of raising, cached or not
+    for _ in range(2):
+        assert not (script_sig + script_pubkey).evaluate(z + 2**256)
+        assert not Script(script_sig.cmds + script_pubkey.cmds).evaluate(z + 2**256)
+        assert (script_sig + script_pubkey).evaluate(z)
+
+
+def test_parse_truncated():
+    with pytest.raises(SyntaxError):
+        Script.parse(b'\x05\x04\x01\x02')
+
+
+def test_lazy_script_pickle():
+    raw = bytes.fromhex('76a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac')
+    script = LazyScript(memoryview(raw))
+
+    restored = pickle.loads(pickle.dumps(script))
+    assert restored.raw_serialize() == raw
+    assert restored.cmds == script.cmds
+
+
+@pytest.mark.parametrize('length', [74, 75, 76, 255, 256])
+def test_push_roundtrip(length):
+    script = Script([b'\x01' * length, 0x87])
+    assert Script.parse(BytesIO(script.serialize())).cmds == script.cmds
+
+
+def test_compile_cmds():
+    pk_hash = bytes(20)
+    program = compile_cmds(Script.p2pkh(pk_hash).cmds)
+
+    assert [instruction[0] for instruction in program] == [STACK, STACK, PUSH, STACK, SIG]
+    assert program[2] == (PUSH, pk_hash, 0, None)
+    assert program[4][1] is op.op_checksig.func
+
+
+def test_program_cache(monkeypatch):
+    monkeypatch.setattr(Script, 'programs', LRUCache(maxsize=16))
+    raw = Script.p2pkh(bytes(20)).raw_serialize()
+
+    program = Script.parse(encode_varint(len(raw)) + raw).program()
+    assert Script.programs.info().misses == 1
+
+    # same serialization: the cached program is used without decoding the script
+    lazy = LazyScript(memoryview(raw))
+    assert lazy.program() is program
+    assert lazy._cmds is None
+
+
+def test_evaluate_combined_script():
+    private_key = PrivateKeyS256(8675309)
+    z = 0x1234567890
+    script_pubkey = Script([private_key.point.sec(), OP_CODE_NAMES['OP_CHECKSIG']])
+
+    script = Script([private_key.sign(z).der() + b'\x01']) + script_pubkey
+    assert script.evaluate(z)
+    assert not script.evaluate(z + 1)
+
+    # the combined script is evaluated from its commands once they have changed
+    script.cmds[-1] = OP_CODE_NAMES['OP_DUP']
+    assert script.evaluate(z + 1)
+
+    restored = pickle.loads(pickle.dumps(script_pubkey + script_pubkey))
+    assert restored.cmds == script_pubkey.cmds * 2
+
+
+def test_combined_script_is_lazy(monkeypatch):
+    monkeypatch.setattr(Script, 'programs', LRUCache(maxsize=16))
+    private_key = PrivateKeyS256(8675309)
+    z = 0x1234567890
+    sec = private_key.point.sec()
+    raw = Script.p2pkh(hash160(sec)).raw_serialize()
+    script_sig = Script([private_key.sign(z).der() + b'\x01', sec])
+
+    # a standard pair is evaluated without joining any commands, or decoding a script pubkey whose
+    # program is cached
+    Script.parse(encode_varint(len(raw)) + raw).program()
+    script_pubkey = LazyScript(memoryview(raw))
+    script = script_sig + script_pubkey
+    assert script.evaluate(z)
+    assert script._cmds is None
+    assert script_pubkey._cmds is None
+
+    # the commands are those of the halves when they were added
+    script_sig.cmds.append(OP_CODE_NAMES['OP_NOP'])
+    assert script.cmds == script_sig.cmds[:-1] + LazyScript(raw).cmds
+    assert script.evaluate(z)
+
+
+@pytest.mark.parametrize('raw, cmds', [
+    ('4e01000000ff51', [b'\xff', 81]),
+    ('4d0100ff', [b'\xff']),
+    ('4c01ff4e00000000', [b'\xff', b'']),
+])
+def test_decode_pushdata(raw, cmds):
+    raw = bytes.fromhex(raw)
+
+    assert decode_cmds(raw, 0, len(raw)) == cmds
+    assert Script.parse(encode_varint(len(raw)) + raw).cmds == cmds
+    assert Script.parse(BytesIO(encode_varint(len(raw)) + raw)).cmds == cmds
+
+
+@pytest.mark.parametrize('raw', [
+    b'\x4c', b'\x4d\x01', b'\xc4Nc\xac&', b'\x4e\x02\x00\x00\x00\xff', b'\x02\xff',
+])
+def test_decode_truncated_pushdata(raw):
+    with pytest.raises(SyntaxError):
+        decode_cmds(raw, 0, len(raw))
+    with pytest.raises(SyntaxError):
+        LazyScript(raw).cmds
+    with pytest.raises(SyntaxError):
+        Script.parse(encode_varint(len(raw)) + raw)
+    # the stream must not be read past the end of the script
+    with pytest.raises(SyntaxError):
+        Script.parse(BytesIO(encode_varint(len(raw)) + raw + b'\x00' * 8))
+
+    # a redeem script that can't be decoded fails the input instead of raising
+    script_pubkey = Script.p2sh(hash160(raw))
+    assert not (Script([raw]) + script_pubkey).evaluate(Z)
+    assert not verify_generic(compile_cmds([raw]), compile_cmds(script_pubkey.cmds),
+                              script_pubkey.raw_serialize(), Z)
+
+
+def test_serialize_pushdata():
+    for length, prefix in [(75, '4b'), (255, '4cff'), (520, '4d0802'), (70000, '4e70110100')]:
+        element = b'\x01' * length
+        raw = Script([element]).raw_serialize()
+
+        assert raw == bytes.fromhex(prefix) + element
+        assert decode_cmds(raw, 0, len(raw)) == [element]
+
+
+def test_script_limits():
+    nop = OP_CODE_NAMES['OP_NOP']
+
+    assert Script([nop] * 201 + [b'\x01']).evaluate(0)
+    assert not Script([nop] * 202 + [b'\x01']).evaluate(0)
+
+    assert Script([b'\x01'] * 1000).evaluate(0)
+    assert not Script([b'\x01'] * 1001).evaluate(0)
+
+    assert Script([b'\x01' * 520, b'\x01']).evaluate(0)
+    assert not Script([b'\x01' * 521, b'\x01']).evaluate(0)
+
+
+KEY = PrivateKeyS256(1001)
+OTHER_KEY = PrivateKeyS256(1002)
+Z = 0xabcdef
+
+
+def sign(private_key, z=Z):
+    return private_key.sign(z).der() + b'\x01'
+
+
+def template_cases():
+    sec = KEY.point.sec()
+    uncompressed = KEY.point.sec(compressed=False)
+    p2pkh = Script.p2pkh(hash160(sec))
+    p2wpkh = Script.p2wpkh(hash160(sec))
+    redeem = Script([b'\x01', OP_CODE_NAMES['OP_EQUAL']]).raw_serialize()
+    p2sh_p2pk = Script.p2sh(hash160(Script.p2pk(sec).raw_serialize())).raw_serialize()
+
+    return [
+        # (script sig, script pubkey, witness, valid)
+        (Script([sign(KEY)]), Script.p2pk(sec), None, True),
+        (Script([sign(KEY)]), Script.p2pk(uncompressed), None, True),
+        (Script([sign(KEY, Z + 1)]), Script.p2pk(sec), None, False),
+        (Script([sign(OTHER_KEY)]), Script.p2pk(sec), None, False),
+        (Script([b'']), Script.p2pk(sec), None, False),
+        (Script([sign(KEY), sec]), p2pkh, None, True),
+        (Script([sign(KEY), uncompressed]), Script.p2pkh(hash160(uncompressed)), None, True),
+        (Script([sign(KEY, Z + 1), sec]), p2pkh, None, False),
+        (Script([sign(OTHER_KEY), OTHER_KEY.point.sec()]), p2pkh, None, False),
+        (Script([b'\x30\x01', sec]), p2pkh, None, False),
+        (Script([b'\x01', sign(KEY), sec]), p2pkh, None, True),
+        (Script([sign(KEY)]), p2pkh, None, False),
+        (Script(), p2wpkh, [sign(KEY), sec], True),
+        (Script(), p2wpkh, [sign(KEY, Z + 1), sec], False),
+        (Script(), p2wpkh, [sign(OTHER_KEY), OTHER_KEY.point.sec()], False),
+        # a witness program fails without a valid witness
+        (Script(), p2wpkh, None, False),
+        (Script(), p2wpkh, [], False),
+        (Script(), p2wpkh, [b'\x01', b'\x01'], False),
+        (Script(), p2wpkh, [sign(KEY), sec, b''], False),
+        # native segwit needs an empty script sig
+        (Script([b'\x01']), p2wpkh, [sign(KEY), sec], False),
+        # P2WSH and unknown programs aren't supported
+        (Script(), Script([0, bytes(32)]), [b'\x01'], False),
+        (Script(), Script([0, bytes(24)]), [sign(KEY), sec], False),
+        (Script(), Script([OP_CODE_NAMES['OP_1'], bytes(32)]), [sign(KEY)], False),
+        # a witness on an input that doesn't spend a witness program
+        (Script([sign(KEY), sec]), p2pkh, [b'\x01'], False),
+        (Script([sign(KEY), sec]), p2pkh, [], True),
+        (Script([sign(KEY), sec, p2pkh.raw_serialize()]),
+         Script.p2sh(hash160(p2pkh.raw_serialize())), None, True),
+        (Script([sign(KEY, Z + 1), sec, p2pkh.raw_serialize()]),
+         Script.p2sh(hash160(p2pkh.raw_serialize())), None, False),
+        (Script([sign(KEY), sec, p2pkh.raw_serialize()]), Script.p2sh(bytes(20)), None, False),
+        (Script([p2wpkh.raw_serialize()]), Script.p2sh(hash160(p2wpkh.raw_serialize())),
+         [sign(KEY), sec], True),
+        (Script([p2wpkh.raw_serialize()]), Script.p2sh(hash160(p2wpkh.raw_serialize())),
+         [sign(OTHER_KEY), sec], False),
+        (Script([p2wpkh.raw_serialize()]), Script.p2sh(hash160(p2wpkh.raw_serialize())),
+         None, False),
+        # nested segwit needs the redeem script as the only push of the script sig
+        (Script([b'\x01', p2wpkh.raw_serialize()]),
+         Script.p2sh(hash160(p2wpkh.raw_serialize())), [sign(KEY), sec], False),
+        (Script([b'\x01', redeem]), Script.p2sh(hash160(redeem)), None, True),
+        (Script([b'\x02', redeem]), Script.p2sh(hash160(redeem)), None, False),
+        # a redeem script that is itself P2SH only compares the hash of the push below it
+        (Script([b'\x30\x01', Script.p2pk(sec).raw_serialize(), p2sh_p2pk]),
+         Script.p2sh(hash160(p2sh_p2pk)), None, True),
+        (Script([b'\x30\x01', p2pkh.raw_serialize(), p2sh_p2pk]),
+         Script.p2sh(hash160(p2sh_p2pk)), None, False),
+        # a P2SH script sig must be push-only, or the redeem script would be skipped
+        (Script([redeem, OP_CODE_NAMES['OP_NOP']]), Script.p2sh(hash160(redeem)), None, False),
+        (Script([sign(KEY), sec, p2pkh.raw_serialize(), OP_CODE_NAMES['OP_NOP']]),
+         Script.p2sh(hash160(p2pkh.raw_serialize())), None, False),
+    ]
+
+
+@pytest.mark.parametrize('script_sig, script_pubkey, witness, valid', template_cases())
+def test_templates_match_interpreter(script_sig, script_pubkey, witness, valid):
+    generic = verify_generic(compile_cmds(script_sig.cmds), compile_cmds(script_pubkey.cmds),
+                             script_pubkey.raw_serialize(), Z, witness)
+
+    assert (script_sig + script_pubkey).evaluate(Z, witness) == generic == valid
+
+
+def test_template_skips_interpreter(monkeypatch):
+    def interpreter(*args):
+        raise AssertionError('standard scripts are verified without the interpreter')
+
+    monkeypatch.setattr(script_module, 'verify_generic', interpreter)
+    sec = KEY.point.sec()
+
+    assert (Script([sign(KEY), sec]) + Script.p2pkh(hash160(sec))).evaluate(Z)
+    assert (Script() + Script.p2wpkh(hash160(sec))).evaluate(Z, [sign(KEY), sec])
+
+
+def cmds(*names):
+    return [OP_CODE_NAMES[name] if isinstance(name, str) else name for name in names]
+
+
+@pytest.mark.parametrize('script_cmds, valid', [
+    (cmds('OP_1', 'OP_IF', 'OP_1', 'OP_ELSE', 'OP_0', 'OP_ENDIF'), True),
+    (cmds('OP_0', 'OP_IF', 'OP_1', 'OP_ELSE', 'OP_0', 'OP_ENDIF'), False),
+    (cmds('OP_0', 'OP_NOTIF', 'OP_1', 'OP_ELSE', 'OP_0', 'OP_ENDIF'), True),
+    (cmds('OP_0', 'OP_IF', 'OP_0', 'OP_ENDIF', 'OP_1'), True),
+    # nested branches are jumped over as a whole
+    (cmds('OP_0', 'OP_IF', 'OP_1', 'OP_IF', 'OP_0', 'OP_ELSE', 'OP_0', 'OP_ENDIF', 'OP_ELSE',
+          'OP_1', 'OP_IF', 'OP_1', 'OP_ELSE', 'OP_0', 'OP_ENDIF', 'OP_ENDIF'), True),
+    # every OP_ELSE toggles the branch
+    (cmds('OP_1', 'OP_IF', 'OP_0', 'OP_ELSE', 'OP_RETURN', 'OP_ELSE', 'OP_1', 'OP_ENDIF'), True),
+    (cmds('OP_0', 'OP_IF', 'OP_RETURN', 'OP_ELSE', 'OP_1', 'OP_ELSE', 'OP_RETURN', 'OP_ENDIF'),
+     True),
+    # reserved and unknown opcodes only fail when executed, disabled ones always do
+    (cmds('OP_0', 'OP_IF', 80, 0xba, 'OP_ENDIF', 'OP_1'), True),
+    (cmds('OP_0', 'OP_IF', 0x7e, 'OP_ENDIF', 'OP_1'), False),
+    # unbalanced conditionals
+    (cmds('OP_1', 'OP_IF', 'OP_1'), False),
+    (cmds('OP_1', 'OP_ENDIF', 'OP_1'), False),
+    (cmds('OP_1', 'OP_ELSE', 'OP_1'), False),
+    (cmds('OP_IF', 'OP_1', 'OP_ENDIF'), False),
+])
+def test_conditionals(script_cmds, valid):
+    assert Script(script_cmds).evaluate(0) is valid
+
+
+def test_branch_targets():
+    script_cmds = cmds('OP_1', 'OP_IF', 'OP_1', 'OP_IF', 'OP_ENDIF', 'OP_ELSE', 'OP_2', 'OP_ELSE',
+                       'OP_ENDIF')
+    program = compile_cmds(script_cmds)
+
+    # OP_IF -> OP_ELSE -> OP_ELSE -> OP_ENDIF, and the nested OP_IF -> its OP_ENDIF
+    assert [(index, instruction[2]) for index, instruction in enumerate(program)
+            if instruction[0] in (IF, ELSE)] == [(1, 5), (3, 4), (5, 7), (7, 8)]
+
+
+def test_branches_are_separate():
+    # a conditional can't be opened in the script sig and closed in the script pubkey
+    script_sig = Script(cmds('OP_1', 'OP_IF'))
+    script_pubkey = Script(cmds('OP_1', 'OP_ENDIF'))
+
+    assert not (script_sig + script_pubkey).evaluate(0)
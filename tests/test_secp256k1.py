@@ -0,0 +1,76 @@
+import pytest
+
+from blockchain import secp256k1
+from blockchain.secp256k1 import (N, GX, GY, LAMBDA, FixedBaseTable, to_jacobian, from_jacobian,
+                                  jacobian_multiply, generator_multiply, odd_multiples,
+                                  wnaf_multiply, wnaf_multiply_many, glv_split, glv_terms,
+                                  endomorphism_table)
+
+
+SCALARS = [1, 2, 15, 16, 255, 256, 0x123456789abcdef, 2**255 + 3, N - 1]
+
+
+@pytest.mark.parametrize('k', SCALARS)
+def test_generator_multiply(k):
+    expected = from_jacobian(jacobian_multiply(to_jacobian(GX, GY), k))
+    assert from_jacobian(generator_multiply(k)) == expected
+
+
+def test_generator_multiply_order():
+    assert from_jacobian(generator_multiply(N)) is None
+
+
+def test_fixed_base_table_persistence(tmp_path):
+    path = str(tmp_path / 'g.table')
+    table = FixedBaseTable.build(GX, GY, window=4)
+    table.save(path)
+
+    loaded = FixedBaseTable.load(path)
+    assert loaded.window == 4
+
+    for k in SCALARS:
+        assert from_jacobian(loaded.multiply(k)) == from_jacobian(table.multiply(k))
+
+
+def test_fixed_base_table_bad_file(tmp_path):
+    path = tmp_path / 'bad.table'
+    path.write_bytes(b'not a table')
+
+    with pytest.raises(ValueError):
+        FixedBaseTable.load(str(path))
+
+
+def test_use_generator_table(tmp_path, monkeypatch):
+    monkeypatch.setattr(secp256k1, '_generator_table', None)
+    path = str(tmp_path / 'g.table')
+
+    created = secp256k1.use_generator_table(path, window=4)
+    reloaded = secp256k1.use_generator_table(path)
+
+    assert created.window == reloaded.window == 4
+    assert from_jacobian(generator_multiply(12345)) == \
+        from_jacobian(jacobian_multiply(to_jacobian(GX, GY), 12345))
+
+
+@pytest.mark.parametrize('k', SCALARS + [0, N // 2, N // 3, 2**128, LAMBDA])
+def test_glv_split(k):
+    k1, k2 = glv_split(k)
+
+    assert (k1 + k2 * LAMBDA) % N == k
+    assert abs(k1).bit_length() <= 129
+    assert abs(k2).bit_length() <= 129
+
+
+def test_endomorphism():
+    table = odd_multiples(GX, GY, 4)
+    expected = odd_multiples(*from_jacobian(generator_multiply(LAMBDA)), 4)
+
+    assert endomorphism_table(table) == expected
+
+
+@pytest.mark.parametrize('k', SCALARS)
+def test_glv_multiply(k):
+    table = odd_multiples(GX, GY, 5)
+
+    expected = from_jacobian(wnaf_multiply(table, k, 5))
+    assert from_jacobian(wnaf_multiply_many(glv_terms(table, k, 5))) == expected
@@ -0,0 +1,169 @@
+import pytest
+
+from blockchain import sighash, transactions
+from blockchain.crypto import S256Point, Signature
+from blockchain.etc import hash160, hash256, int_to_little_endian
+from blockchain.op import OP_CODE_NAMES
+from blockchain.script import Script
+from blockchain.sighash import (SigHasher, SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE,
+                                SIGHASH_ANYONECANPAY)
+from blockchain.transactions import Transaction, TransactionInput, TransactionOutput
+
+from tests.test_transactions import RAW_TX, SEGWIT_TX
+
+
+# unsigned native P2WPKH example of BIP143
+UNSIGNED_SEGWIT_TX = bytes.fromhex(
+    '0100000002fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f0000000000eeffff'
+    'ffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202c'
+    'b206000000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143b'
+    'de42dbee7e4dbe6a21b2d50ce2f0167faa815988ac11000000')
+
+
+def naive_legacy(tx, input_index, script_code, hash_type):
+    """ Legacy signature hash computed by serializing a modified copy of the transaction """
+    base_type = hash_type & 0x1f
+    if base_type == SIGHASH_SINGLE and input_index >= len(tx.tx_outs):
+        return 1
+
+    tx_ins = []
+    for index, tx_in in enumerate(tx.tx_ins):
+        if index == input_index:
+            tx_ins.append(TransactionInput(tx_in.prev_tx, tx_in.prev_index, script_code,
+                                           tx_in.sequence))
+        elif not hash_type & SIGHASH_ANYONECANPAY:
+            sequence = tx_in.sequence if base_type == SIGHASH_ALL else 0
+            tx_ins.append(TransactionInput(tx_in.prev_tx, tx_in.prev_index, Script(), sequence))
+
+    if base_type == SIGHASH_NONE:
+        tx_outs = []
+    elif base_type == SIGHASH_SINGLE:
+        tx_outs = [TransactionOutput(2 ** 64 - 1, Script()) for _ in range(input_index)]
+        tx_outs.append(tx.tx_outs[input_index])
+    else:
+        tx_outs = tx.tx_outs
+
+    modified = Transaction(tx.version, tx_ins, tx_outs, tx.locktime)
+    return int.from_bytes(hash256(modified.serialize() + int_to_little_endian(hash_type, 4)),
+                          'big')
+
+
+def test_legacy():
+    tx = Transaction.parse(RAW_TX)
+    script_code = Script.parse(bytes.fromhex(
+        '1976a914a802fc56c704ce87c42d7c92eb75e7896bdc41ae88ac'))
+
+    z = tx.sig_hash(0, script_code)
+    assert z == 0x27e0c5994dec7824e56dec6b2fcb342eb7cdb0d0957c2fce9882f715e85d81a6
+
+    sig, sec = tx.tx_ins[0].script_sig.cmds
+    assert S256Point.parse(sec).verify(z, Signature.parse(sig[:-1]))
+
+
+@pytest.mark.parametrize('hash_type', [
+    SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE, SIGHASH_ALL | SIGHASH_ANYONECANPAY,
+    SIGHASH_NONE | SIGHASH_ANYONECANPAY, SIGHASH_SINGLE | SIGHASH_ANYONECANPAY,
+])
+def test_legacy_hash_types(hash_type):
+    tx = Transaction.parse(UNSIGNED_SEGWIT_TX)
+    tx.tx_ins.append(TransactionInput(bytes(range(32)), 7, sequence=0xfffffffd))
+    script_code = Script.p2pkh(bytes(20))
+
+    for input_index in range(len(tx.tx_ins)):
+        assert (tx.sig_hash(input_index, script_code, hash_type=hash_type)
+                == naive_legacy(tx, input_index, script_code, hash_type))
+
+
+def test_segwit_v0():
+    tx = Transaction.parse(UNSIGNED_SEGWIT_TX)
+    hasher = tx.sig_hasher()
+
+    assert hasher.hash_prevouts().hex() == (
+        '96b827c8483d4e9b96712b6713a7b68d6e8003a781feba36c31143470b4efd37')
+    assert hasher.hash_sequence().hex() == (
+        '52b0a642eea2fb7ae638c36f6252b6750293dbe574a806984b8e4d8548339a3b')
+    assert hasher.hash_outputs().hex() == (
+        '863ef3e1a92afbfdb97f31ad0fc7683ee943e9abcf2501590ff8f6551f47e5e5')
+
+    script_code = Script.p2pkh(bytes.fromhex('1d0f172a0ecb48aee1be1f2687d2963ae33f71a1'))
+    z = tx.sig_hash(1, script_code, amount=600000000, witness_v0=True)
+    assert z == 0xc37af31116d1b27caf68aae9e3ac82f1477929014d5b917657d0eb49478cb670
+
+
+def test_segwit_v0_signature():
+    tx = Transaction.parse(SEGWIT_TX)
+    sig, sec = tx.tx_ins[1].witness
+
+    script_code = Script.p2pkh(hash160(sec))
+    z = tx.sig_hash(1, script_code, amount=600000000, witness_v0=True)
+    assert S256Point.parse(sec).verify(z, Signature.parse(sig[:-1]))
+
+
+def test_segwit_v0_needs_amount():
+    tx = Transaction.parse(UNSIGNED_SEGWIT_TX)
+
+    with pytest.raises(ValueError):
+        tx.sig_hash(1, Script.p2pkh(bytes(20)), witness_v0=True)
+
+
+def test_hasher_reuse():
+    tx = Transaction.parse(UNSIGNED_SEGWIT_TX)
+    hasher = tx.sig_hasher()
+    assert isinstance(hasher, SigHasher)
+
+    # signing an input does not change the signature hashes of the others
+    tx.tx_ins[0].script_sig = Script([b'\x30' * 71])
+    tx.tx_ins[1].witness = [b'\x30' * 71, b'\x02' * 33]
+    assert tx.sig_hasher() is hasher
+
+
+@pytest.mark.parametrize('change', [
+    lambda tx: setattr(tx.tx_outs[0], 'amount', tx.tx_outs[0].amount - 1),
+    lambda tx: tx.tx_outs[1].script_pubkey.cmds.append(OP_CODE_NAMES['OP_NOP']),
+    lambda tx: setattr(tx.tx_outs[0], 'script_pubkey', Script.p2pkh(bytes(20))),
+    lambda tx: tx.tx_outs.pop(),
+    lambda tx: setattr(tx.tx_ins[0], 'prev_tx', bytes(32)),
+    lambda tx: setattr(tx.tx_ins[0], 'prev_index', 5),
+    lambda tx: setattr(tx.tx_ins[0], 'sequence', 0),
+    lambda tx: tx.tx_ins.__setitem__(0, TransactionInput(bytes(32), 0)),
+    lambda tx: tx.tx_ins.reverse(),
+    lambda tx: setattr(tx, 'locktime', tx.locktime + 1),
+    lambda tx: setattr(tx, 'version', 2),
+])
+def test_hasher_rebuilt_on_change(change):
+    tx = Transaction.parse(UNSIGNED_SEGWIT_TX)
+    script_code = Script.p2pkh(bytes(20))
+    tx.sig_hash(1, script_code, amount=1000, witness_v0=True)
+    tx.sig_hash(1, script_code)
+
+    change(tx)
+
+    fresh = Transaction.parse(tx.serialize())
+    assert (tx.sig_hash(1, script_code, amount=1000, witness_v0=True)
+            == fresh.sig_hash(1, script_code, amount=1000, witness_v0=True))
+    assert tx.sig_hash(1, script_code) == fresh.sig_hash(1, script_code)
+
+
+def test_hasher_built_once(monkeypatch):
+    # hashing every input shares one hasher, and the outpoints, sequences and outputs are hashed
+    # once for all of them
+    built = []
+    hashed = []
+
+    class CountingHasher(SigHasher):
+        def __init__(self, tx):
+            built.append(tx)
+            super().__init__(tx)
+
+    monkeypatch.setattr(transactions, 'SigHasher', CountingHasher)
+    monkeypatch.setattr(sighash, 'hash256', lambda data: hashed.append(data) or hash256(data))
+
+    script_code = Script.p2pkh(bytes(20))
+    tx_ins = [TransactionInput(i.to_bytes(32, 'big'), i) for i in range(200)]
+    tx = Transaction(1, tx_ins, [TransactionOutput(1000, script_code)] * 2, 0)
+
+    for i in range(len(tx_ins)):
+        tx.sig_hash(i, script_code, amount=1000, witness_v0=True)
+
+    assert len(built) == 1
+    assert len(hashed) == 3
@@ -0,0 +1,123 @@
+import os
+
+import pytest
+
+from blockchain.etc import LRUCache
+from blockchain.store import FileStore, MemoryStore, TransactionStore
+from blockchain.transactions import Transaction, TransactionFetcher
+
+from tests.test_transactions import RAW_TX
+
+
+TX = Transaction.parse(RAW_TX)
+
+
+@pytest.mark.parametrize('store_class', [MemoryStore, FileStore])
+def test_store(tmp_path, store_class):
+    store = store_class(str(tmp_path)) if store_class is FileStore else store_class()
+    tx_hash = TX.hash()[::-1]
+
+    assert store.get(tx_hash) is None
+    assert tx_hash not in store
+
+    store.put(tx_hash, RAW_TX)
+    store.put(tx_hash, RAW_TX)
+
+    assert store.get(tx_hash) == RAW_TX
+    assert tx_hash in store
+    assert len(store) == 1
+
+    store.close()
+
+
+def test_incomplete_store():
+    class GetOnlyStore(TransactionStore):
+        def get(self, tx_hash):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnlyStore()
+
+
+def test_file_store_reopen(tmp_path):
+    hashes = [bytes([i]) * 32 for i in range(3)]
+
+    with FileStore(str(tmp_path)) as store:
+        for i, tx_hash in enumerate(hashes):
+            store.put(tx_hash, RAW_TX[:10 + i])
+
+    with FileStore(str(tmp_path)) as store:
+        assert len(store) == 3
+        for i, tx_hash in enumerate(hashes):
+            assert store.get(tx_hash) == RAW_TX[:10 + i]
+
+
+def test_file_store_interrupted_write(tmp_path):
+    with FileStore(str(tmp_path)) as store:
+        store.put(b'\x01' * 32, RAW_TX)
+
+    # half an index entry, and an entry past the end of the data
+    with open(os.path.join(str(tmp_path), FileStore.INDEX_FILE), 'ab') as f:
+        f.write(b'\x02' * 32 + (10 ** 6).to_bytes(8, 'little') + b'\x10\x00\x00\x00')
+        f.write(b'\x03' * 10)
+
+    with FileStore(str(tmp_path)) as store:
+        assert len(store) == 1
+        assert store.get(b'\x01' * 32) == RAW_TX
+
+        store.put(b'\x04' * 32, RAW_TX)
+
+    with FileStore(str(tmp_path)) as store:
+        assert store.get(b'\x04' * 32) == RAW_TX
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, raw_tx):
+        self.raw_tx = raw_tx
+
+    def json(self):
+        return {'data': {'rawTx': self.raw_tx.hex()}}
+
+
+class FakeSession:
+    def __init__(self, get):
+        self.get = get
+
+
+@pytest.fixture
+def fetcher(monkeypatch):
+    monkeypatch.setattr(TransactionFetcher, 'cache', LRUCache(maxsize=16))
+    monkeypatch.setattr(TransactionFetcher, 'store', None)
+    monkeypatch.setattr(TransactionFetcher, 'session', None)
+    return TransactionFetcher
+
+
+def test_fetch_with_store(tmp_path, monkeypatch, fetcher):
+    urls = []
+
+    def get(url, timeout):
+        urls.append(url)
+        return FakeResponse(RAW_TX)
+
+    monkeypatch.setattr(fetcher, 'session', FakeSession(get))
+
+    fetcher.use_store(FileStore(str(tmp_path)))
+    assert fetcher.fetch(TX.id()).serialize() == RAW_TX
+    assert fetcher.fetch(TX.id()) is fetcher.fetch(TX.id())
+    assert len(urls) == 1
+    fetcher.store.close()
+
+    # restart: a new process has an empty memory cache but the same store
+    def offline(url, timeout):
+        raise AssertionError('no network access expected')
+
+    monkeypatch.setattr(fetcher, 'session', FakeSession(offline))
+    fetcher.cache.clear()
+    fetcher.use_store(FileStore(str(tmp_path)))
+
+    tx = fetcher.fetch(TX.id(), testnet=True)
+    assert tx.serialize() == RAW_TX
+    assert tx.testnet
+    fetcher.store.close()
@@ -1,19 +1,43 @@
+import http.server
+import json
+import threading
+import time
 from io import BytesIO
 
-from blockchain.transactions import Transaction
+import pytest
+import requests
+
+from blockchain import transactions
+from blockchain.etc import BytesReader, LRUCache, hash256
+from blockchain.transactions import (Transaction, LazyTransaction, TransactionInput,
+                                     TransactionOutput, TransactionFetcher, FetchError)
 from blockchain.script import Script
 
 
-def test_parse_transaction():
-    raw_tx = ('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b'
-              '483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a98'
-              '6d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545'
-              'de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b'
-              '654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e33216'
-              '6702cb75f40df79fea1288ac19430600')
+RAW_TX = bytes.fromhex(
+    '0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b'
+    '483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a98'
+    '6d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545'
+    'de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b'
+    '654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e33216'
+    '6702cb75f40df79fea1288ac19430600')
+
+# signed native P2WPKH example of BIP143
+SEGWIT_TX = bytes.fromhex(
+    '01000000000102fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f000000004948'
+    '30450221008b9d1dc26ba6a9cb62127b02742fa9d754cd3bebf337f7a55d114c8e5cdd30be022040529b194ba3'
+    'f9281a99f2b1c0a19c0489bc22ede944ccf4ecbab4cc618ef3ed01eeffffffef51e1b804cc89d182d279655c3a'
+    'a89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb206000000001976a9148280b37df3'
+    '78db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f016'
+    '7faa815988ac000247304402203609e17b84f6a7d30c80bfa610b5b4542f32a8a0d5447a12fb1366d7f01cc44a'
+    '0220573a954c4518331561406f90300e8f3358f51928d43c212a8caed02de67eebee0121025476c2e83188368d'
+    'a1ff3e292e7acafcdb3566bb0ad253f62fc70f07aeee635711000000')
+SEGWIT_TXID = 'e8151a2af31c368a35053ddd4bdb285a8595c769a3ad83e0fa02314a602d4609'
+
 
-    stream = BytesIO(bytes.fromhex(raw_tx))
-    tx = Transaction.parse(stream)
+@pytest.mark.parametrize('source', [BytesIO, bytes, bytearray, memoryview])
+def test_parse_transaction(source):
+    tx = Transaction.parse(source(RAW_TX))
 
     assert tx.version == 1
 
@@ -27,3 +51,331 @@ def test_parse_transaction():
 
     pk_hash2 = bytes.fromhex('1c4bc762dd5423e332166702cb75f40df79fea12')
     assert tx.tx_outs[1].script_pubkey.cmds == Script.p2pkh(pk_hash2).cmds
+
+
+def test_parse_transaction_roundtrip():
+    tx = Transaction.parse(RAW_TX)
+
+    assert tx.serialize() == RAW_TX
+    assert tx.tx_ins[0].prev_tx == bytes.fromhex('d1c789a9c60383bf715f3f6ad9d14b91fe55f3deb369fe5d'
+                                                 '9280cb1a01793f81')
+    assert type(tx.tx_ins[0].prev_tx) is bytes
+    assert all(type(cmd) is bytes for cmd in tx.tx_ins[0].script_sig.cmds)
+
+
+@pytest.mark.parametrize('source', [bytes, memoryview])
+def test_lazy_transaction(source):
+    eager = Transaction.parse(RAW_TX)
+    lazy = LazyTransaction.parse(source(RAW_TX))
+
+    assert lazy.id() == eager.id()
+    assert lazy._tx_ins is None and lazy._tx_outs is None
+    assert lazy.serialize() == RAW_TX
+
+    assert [tx_out.amount for tx_out in lazy.tx_outs] == [tx_out.amount for tx_out in eager.tx_outs]
+    assert lazy.tx_outs[0].script_pubkey._cmds is None
+    assert lazy.tx_outs[0].script_pubkey.cmds == eager.tx_outs[0].script_pubkey.cmds
+
+    assert lazy.tx_ins[0].prev_tx == eager.tx_ins[0].prev_tx
+    assert lazy.tx_ins[0].script_sig.cmds == eager.tx_ins[0].script_sig.cmds
+    assert lazy.serialize() == RAW_TX
+
+
+def test_lazy_transaction_changes():
+    lazy = LazyTransaction.parse(RAW_TX)
+    eager = Transaction.parse(RAW_TX)
+
+    lazy.locktime += 1
+    eager.locktime += 1
+    assert lazy.id() == eager.id()
+
+    lazy.tx_outs[0].amount -= 1000
+    eager.tx_outs[0].amount -= 1000
+    assert lazy.serialize() == eager.serialize()
+
+
+@pytest.mark.parametrize('raw', [RAW_TX, SEGWIT_TX])
+def test_lazy_transaction_partial_changes(raw):
+    eager = Transaction.parse(raw)
+
+    # reading the outputs keeps hashing the raw bytes, without decoding the inputs
+    lazy = LazyTransaction.parse(raw)
+    assert lazy.tx_outs[0].amount == eager.tx_outs[0].amount
+    assert lazy.tx_outs[0].script_pubkey.cmds == eager.tx_outs[0].script_pubkey.cmds
+    assert lazy._unchanged()
+    assert lazy.id() == eager.id()
+    assert lazy._tx_ins is None
+
+    # changing the outputs reuses the raw inputs and witnesses
+    lazy.tx_outs[0].amount -= 1000
+    eager.tx_outs[0].amount -= 1000
+    assert lazy.serialize() == eager.serialize()
+    assert lazy.serialize_legacy() == eager.serialize_legacy()
+    assert lazy.id() == eager.id()
+    assert lazy._tx_ins is None
+
+    # and the other way around
+    lazy = LazyTransaction.parse(raw)
+    eager = Transaction.parse(raw)
+    lazy.tx_ins[0].sequence -= 1
+    eager.tx_ins[0].sequence -= 1
+    assert lazy.serialize() == eager.serialize()
+    assert lazy.id() == eager.id()
+    assert lazy._tx_outs is None
+
+
+def test_lazy_transaction_in_buffer():
+    reader = BytesReader(RAW_TX + RAW_TX)
+    first = LazyTransaction.parse(reader)
+    second = LazyTransaction.parse(reader)
+
+    assert first.id() == second.id() == Transaction.parse(RAW_TX).id()
+    assert reader.offset == 2 * len(RAW_TX)
+
+
+def test_serialization_cache():
+    tx = Transaction.parse(RAW_TX)
+    tx_id = tx.id()
+
+    assert tx.serialize() is tx.serialize()
+    assert tx.id() == tx_id
+
+    tx.locktime += 1
+    assert tx.id() != tx_id
+    tx.locktime -= 1
+    assert tx.id() == tx_id
+
+    tx.tx_outs[0].amount -= 1000
+    assert tx.serialize() == Transaction.parse(BytesIO(tx.serialize())).serialize() != RAW_TX
+    tx.tx_outs[0].amount += 1000
+    assert tx.id() == tx_id
+
+    # in place changes to the scripts and lists are picked up too
+    tx.tx_outs[0].script_pubkey.cmds.append(0x6a)
+    assert tx.id() != tx_id
+    tx.tx_outs[0].script_pubkey.cmds.pop()
+    assert tx.id() == tx_id
+
+    tx.tx_ins.append(tx.tx_ins[0])
+    assert tx.id() != tx_id
+    tx.tx_ins.pop()
+    assert tx.serialize() == RAW_TX
+
+
+class StubExplorer(http.server.ThreadingHTTPServer):
+    """ Local block explorer serving the raw transactions it was given """
+    def __init__(self, txs, failures=()):
+        super().__init__(('127.0.0.1', 0), StubExplorerHandler)
+        self.txs = {tx.id(): tx.serialize() for tx in txs}
+        self.failures = set(failures)
+        # tx id -> body of a malformed response
+        self.bodies = {}
+        self.requests = []
+        self.connections = 0
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class StubExplorerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        tx_id = self.path.rsplit('/', 1)[-1]
+
+        with server.lock:
+            server.requests.append(tx_id)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+
+        time.sleep(0.01)
+
+        with server.lock:
+            server.active -= 1
+            failing = tx_id in server.failures
+            server.failures.discard(tx_id)
+
+        if failing:
+            status, body = 503, b'try again'
+        elif tx_id in server.bodies:
+            status, body = 200, server.bodies[tx_id]
+        elif tx_id in server.txs:
+            status, body = 200, json.dumps({'data': {'rawTx': server.txs[tx_id].hex()}}).encode()
+        else:
+            status, body = 404, b'not found'
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def prevout_txs(count):
+    txs = []
+    for locktime in range(count):
+        tx = Transaction.parse(RAW_TX)
+        tx.locktime = locktime
+        txs.append(tx)
+    return txs
+
+
+@pytest.fixture
+def explorer(monkeypatch):
+    servers = []
+
+    def start(txs, failures=()):
+        server = StubExplorer(txs, failures)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        monkeypatch.setattr(TransactionFetcher, 'get_url', staticmethod(lambda testnet: server.url))
+        return server
+
+    monkeypatch.setattr(TransactionFetcher, 'cache', LRUCache(maxsize=64))
+    monkeypatch.setattr(TransactionFetcher, 'store', None)
+    monkeypatch.setattr(TransactionFetcher, 'session', None)
+    monkeypatch.setattr(TransactionFetcher, 'backoff_factor', 0)
+    monkeypatch.setattr(TransactionFetcher, 'max_workers', 4)
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    TransactionFetcher.session.close()
+
+
+def test_fetch_many(explorer):
+    txs = prevout_txs(12)
+    server = explorer(txs, failures=[txs[3].id()])
+    tx_ids = [tx.id() for tx in txs]
+
+    fetched = TransactionFetcher.fetch_many(tx_ids + tx_ids[:5])
+
+    assert list(fetched) == tx_ids
+    assert [tx.serialize() for tx in fetched.values()] == [tx.serialize() for tx in txs]
+
+    # duplicates are fetched once, the failed request is retried
+    assert sorted(server.requests) == sorted(tx_ids + [tx_ids[3]])
+    assert server.max_active <= 4
+    assert server.connections <= 4
+
+    # cached now
+    assert TransactionFetcher.fetch_many(tx_ids[:2]) == {tx_ids[0]: fetched[tx_ids[0]],
+                                                         tx_ids[1]: fetched[tx_ids[1]]}
+    assert len(server.requests) == 13
+
+
+def test_fetch_many_errors(explorer):
+    txs = prevout_txs(3)
+    explorer(txs[:2])
+
+    with pytest.raises(FetchError):
+        TransactionFetcher.fetch_many([tx.id() for tx in txs])
+
+
+def test_fetch_bad_responses(explorer):
+    server = explorer([])
+    bodies = [b'not json', b'{}', b'[1]', b'{"data": {"rawTx": null}}',
+              b'{"data": {"rawTx": "zz"}}', b'{"data": {"rawTx": "0100"}}']
+    server.bodies = {bytes([i]).hex() * 32: body for i, body in enumerate(bodies)}
+
+    for tx_id in server.bodies:
+        with pytest.raises(FetchError):
+            TransactionFetcher.fetch(tx_id)
+
+    with pytest.raises(FetchError):
+        TransactionFetcher.fetch_many(list(server.bodies))
+
+
+def test_fetch_many_shares_one_session(explorer, monkeypatch):
+    sessions = []
+
+    class CountingSession(requests.Session):
+        def __init__(self):
+            super().__init__()
+            sessions.append(self)
+
+    monkeypatch.setattr(transactions.requests, 'Session', CountingSession)
+    txs = prevout_txs(8)
+    explorer(txs)
+
+    TransactionFetcher.fetch_many([tx.id() for tx in txs])
+    assert len(sessions) == 1
+
+
+def test_fee_prefetches(explorer):
+    txs = prevout_txs(5)
+    server = explorer(txs)
+
+    tx_ins = [TransactionInput(prev_tx.hash(), 0) for prev_tx in txs]
+    tx = Transaction(1, tx_ins, [TransactionOutput(1000, Script())], 0)
+
+    amount = txs[0].tx_outs[0].amount
+    assert tx.fee() == 5 * amount - 1000
+    assert server.max_active > 1
+    assert len(server.requests) == 5
+
+
+@pytest.mark.parametrize('source', [BytesIO, bytes, memoryview])
+def test_parse_segwit(source):
+    tx = Transaction.parse(source(SEGWIT_TX))
+
+    assert tx.segwit
+    assert tx.id() == SEGWIT_TXID
+    assert tx.wtxid() == hash256(SEGWIT_TX)[::-1].hex()
+    assert tx.serialize() == SEGWIT_TX
+    assert hash256(tx.serialize_legacy())[::-1].hex() == SEGWIT_TXID
+
+    assert tx.tx_ins[0].witness == []
+    assert [len(item) for item in tx.tx_ins[1].witness] == [71, 33]
+    assert tx.tx_outs[1].amount == 223450000
+    assert tx.locktime == 17
+
+
+def test_segwit_changes():
+    tx = Transaction.parse(SEGWIT_TX)
+    wtxid = tx.wtxid()
+
+    # witnesses are not part of the id
+    tx.tx_ins[1].witness.append(b'\x01')
+    assert tx.id() == SEGWIT_TXID
+    assert tx.wtxid() != wtxid
+    assert Transaction.parse(tx.serialize()).tx_ins[1].witness[-1] == b'\x01'
+
+    tx.tx_ins[1].witness.pop()
+    tx.locktime = 0
+    assert tx.id() != SEGWIT_TXID
+    assert tx.id() == hash256(tx.serialize_legacy())[::-1].hex()
+
+
+def test_legacy_is_not_segwit():
+    tx = Transaction.parse(RAW_TX)
+
+    assert not tx.segwit
+    assert tx.wtxid() == tx.id()
+    assert tx.serialize_legacy() == RAW_TX
+
+
+@pytest.mark.parametrize('source', [bytes, memoryview])
+def test_lazy_segwit(source):
+    lazy = LazyTransaction.parse(source(SEGWIT_TX))
+
+    assert lazy.segwit
+    assert lazy.id() == SEGWIT_TXID
+    assert lazy.serialize() == SEGWIT_TX
+
+    assert lazy.tx_ins[1].witness == Transaction.parse(SEGWIT_TX).tx_ins[1].witness
+    assert lazy.id() == SEGWIT_TXID
+    assert lazy.serialize() == SEGWIT_TX
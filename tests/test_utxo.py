@@ -0,0 +1,96 @@
+import pytest
+
+from blockchain.script import Script
+from blockchain.transactions import Transaction, TransactionInput, TransactionOutput
+from blockchain.utxo import UtxoSet, NULL_HASH, COINBASE_INDEX, is_coinbase
+
+from tests.test_transactions import RAW_TX
+
+
+P2PKH = Script.p2pkh(bytes(20))
+
+
+def coinbase(amount, tag=b'\x01'):
+    tx_in = TransactionInput(NULL_HASH, COINBASE_INDEX, Script([tag]))
+    tx_outs = [TransactionOutput(amount, P2PKH), TransactionOutput(0, Script([0x6a, b'data']))]
+    return Transaction(1, [tx_in], tx_outs, 0)
+
+
+def spend(tx, index, amounts):
+    tx_in = TransactionInput(tx.hash(), index)
+    return Transaction(1, [tx_in], [TransactionOutput(amount, P2PKH) for amount in amounts], 0)
+
+
+def test_apply():
+    utxos = UtxoSet()
+    funding = coinbase(5000)
+    assert is_coinbase(funding)
+
+    utxos.apply(funding)
+    assert utxos.get(funding.hash(), 0) == (5000, P2PKH.raw_serialize())
+    # OP_RETURN outputs are never added
+    assert utxos.get(funding.hash(), 1) is None
+
+    tx = spend(funding, 0, [3000, 1500])
+    assert tx.tx_ins[0].value(utxo_set=utxos) == 5000
+    assert tx.tx_ins[0].script_pubkey(utxo_set=utxos).cmds == P2PKH.cmds
+    assert tx.fee(utxo_set=utxos) == 500
+
+    utxos.apply(tx)
+    assert utxos.get(funding.hash(), 0) is None
+    assert utxos.get(tx.hash(), 1) == (1500, P2PKH.raw_serialize())
+
+    # double spend
+    with pytest.raises(KeyError):
+        utxos.apply(spend(funding, 0, [1000]))
+
+
+def test_apply_is_atomic():
+    utxos = UtxoSet()
+    funding = coinbase(5000)
+    utxos.apply(funding)
+
+    tx = spend(funding, 0, [1000])
+    tx.tx_ins.append(TransactionInput(Transaction.parse(RAW_TX).hash(), 0))
+
+    with pytest.raises(KeyError):
+        utxos.apply(tx)
+
+    assert utxos.get(funding.hash(), 0) is not None
+    assert utxos.get(tx.hash(), 0) is None
+
+
+def test_undo():
+    utxos = UtxoSet()
+    funding = coinbase(5000)
+    utxos.apply(funding)
+
+    tx = spend(funding, 0, [4000])
+    undo = utxos.apply(tx)
+    utxos.flush()
+
+    utxos.undo(tx, undo)
+    assert utxos.get(tx.hash(), 0) is None
+    assert utxos.get(funding.hash(), 0) == (5000, P2PKH.raw_serialize())
+
+    utxos.flush()
+    assert utxos.get(tx.hash(), 0) is None
+    assert utxos.get(funding.hash(), 0) == (5000, P2PKH.raw_serialize())
+
+
+def test_flush(tmp_path):
+    path = str(tmp_path / 'utxos.sqlite')
+    txs = [coinbase(1000 + i, bytes([i])) for i in range(10)]
+
+    with UtxoSet(path, cache_size=4) as utxos:
+        for tx in txs:
+            utxos.apply(tx)
+
+        # the cache was flushed on the way
+        assert len(utxos._cache) <= 4
+        utxos.apply(spend(txs[0], 0, [500]))
+
+    with UtxoSet(path) as utxos:
+        assert utxos.get(txs[0].hash(), 0) is None
+        for i, tx in enumerate(txs[1:], 1):
+            assert utxos.get(tx.hash(), 0) == (1000 + i, P2PKH.raw_serialize())
@@ -0,0 +1,124 @@
+import pytest
+
+from blockchain.crypto import PrivateKeyS256
+from blockchain.etc import hash160
+from blockchain.op import OP_CODE_NAMES
+from blockchain.script import Script
+from blockchain.transactions import Transaction, TransactionInput, TransactionOutput
+from blockchain.validation import verify_transactions, compute_sig_hashes
+
+from tests.test_transactions import SEGWIT_TX
+
+
+def make_p2pk_tx(secret, num_inputs, bad_input=None):
+    private_key = PrivateKeyS256(secret)
+    script_pubkey = Script([private_key.point.sec(), OP_CODE_NAMES['OP_CHECKSIG']])
+
+    tx_ins = []
+    prevouts = []
+    sig_hashes = []
+
+    for i in range(num_inputs):
+        z = secret * 1000 + i
+        signed_z = z + 1 if i == bad_input else z
+        der = private_key.sign(signed_z).der() + b'\x01'
+
+        tx_ins.append(TransactionInput(bytes(32), i, Script([der])))
+        prevouts.append(TransactionOutput(1000, script_pubkey))
+        sig_hashes.append(z)
+
+    tx = Transaction(1, tx_ins, [TransactionOutput(900, script_pubkey)], 0)
+    return tx, prevouts, sig_hashes
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_verify_transactions(max_workers):
+    cases = [make_p2pk_tx(11, 3), make_p2pk_tx(12, 2, bad_input=1), make_p2pk_tx(13, 1)]
+    txs, prevouts, sig_hashes = zip(*cases)
+
+    result = verify_transactions(txs, prevouts, sig_hashes, max_workers=max_workers,
+                                 chunk_size=2)
+
+    assert result == [True, False, True]
+
+
+def test_verify_transactions_mismatched_prevouts():
+    tx, prevouts, sig_hashes = make_p2pk_tx(11, 2)
+
+    with pytest.raises(ValueError):
+        verify_transactions([tx], [prevouts[:1]], [sig_hashes])
+
+
+def test_verify_transactions_computes_sig_hashes():
+    private_key = PrivateKeyS256(21)
+    script_pubkey = Script([private_key.point.sec(), OP_CODE_NAMES['OP_CHECKSIG']])
+
+    tx_ins = [TransactionInput(bytes([i]) * 32, i) for i in range(3)]
+    prevouts = [TransactionOutput(1000, script_pubkey)] * 3
+    tx = Transaction(1, tx_ins, [TransactionOutput(2900, script_pubkey)], 0)
+
+    for i, tx_in in enumerate(tx_ins):
+        z = tx.sig_hash(i, script_pubkey)
+        tx_in.script_sig = Script([private_key.sign(z).der() + b'\x01'])
+
+    assert verify_transactions([tx], [prevouts], max_workers=1) == [True]
+
+    tx.tx_outs[0].amount -= 1
+    assert verify_transactions([tx], [prevouts], max_workers=1) == [False]
+
+
+def test_compute_sig_hashes_p2sh():
+    keys = [PrivateKeyS256(31), PrivateKeyS256(32)]
+    p2pkh = Script.p2pkh(hash160(keys[0].point.sec()))
+    multisig = Script([OP_CODE_NAMES['OP_1'], keys[0].point.sec(), keys[1].point.sec(),
+                       OP_CODE_NAMES['OP_2'], OP_CODE_NAMES['OP_CHECKMULTISIG']])
+
+    redeem_scripts = [p2pkh, multisig]
+    prevouts = [TransactionOutput(1000, Script.p2sh(hash160(redeem.raw_serialize())))
+                for redeem in redeem_scripts]
+    tx_ins = [TransactionInput(bytes([i]) * 32, i) for i in range(2)]
+    tx = Transaction(1, tx_ins, [TransactionOutput(1900, p2pkh)], 0)
+
+    # P2SH inputs sign their redeem script
+    z = tx.sig_hash(0, p2pkh)
+    tx_ins[0].script_sig = Script([keys[0].sign(z).der() + b'\x01', keys[0].point.sec(),
+                                   p2pkh.raw_serialize()])
+    z = tx.sig_hash(1, multisig)
+    tx_ins[1].script_sig = Script([b'', keys[1].sign(z).der() + b'\x01',
+                                   multisig.raw_serialize()])
+
+    assert verify_transactions([tx], [prevouts], max_workers=1) == [True]
+
+
+def test_compute_sig_hashes_segwit():
+    tx = Transaction.parse(SEGWIT_TX)
+    sig, sec = tx.tx_ins[1].witness
+    prevouts = [TransactionOutput(625000000, Script.p2pk(bytes(33))),
+                TransactionOutput(600000000, Script.p2wpkh(hash160(sec)))]
+
+    z = compute_sig_hashes(tx, prevouts)[1]
+    assert z == tx.sig_hash(1, Script.p2pkh(hash160(sec)), amount=600000000, witness_v0=True)
+
+    prevouts[1] = TransactionOutput(600000000, Script([0, bytes(32)]))
+    with pytest.raises(ValueError):
+        compute_sig_hashes(tx, prevouts)
+
+
+def test_verify_transactions_witness():
+    tx = Transaction.parse(SEGWIT_TX)
+    sig, sec = tx.tx_ins[1].witness
+
+    # only the P2WPKH input is verified, the other spends an anyone-can-spend output
+    prevouts = [TransactionOutput(625000000, Script([OP_CODE_NAMES['OP_1']])),
+                TransactionOutput(600000000, Script.p2wpkh(hash160(sec)))]
+    tx.tx_ins[0].script_sig = Script()
+    sig_hashes = [0, tx.sig_hash(1, Script.p2pkh(hash160(sec)), amount=600000000,
+                                 witness_v0=True)]
+
+    assert verify_transactions([tx], [prevouts], [sig_hashes], max_workers=1) == [True]
+
+    tx.tx_ins[1].witness = [b'\x01', b'\x01']
+    assert verify_transactions([tx], [prevouts], [sig_hashes], max_workers=1) == [False]
+
+    tx.tx_ins[1].witness = []
+    assert verify_transactions([tx], [prevouts], [sig_hashes], max_workers=1) == [False]